@@ -1,24 +1,288 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import inspect
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_branches import BRANCH_WORKERS, Fork, branch_state, merge_changes
+from agent_budget import no_budget
+from agent_checkpoint import no_checkpoint
+from agent_io import terminal
+from agent_resources import Resource
+from agent_trace import TracedIO, no_trace
+from ai_telemetry import action as telemetry_action
+from ai_telemetry import current_spending
+
 # A class to represent an agent that can run a sequence of actions as a state machine.
+#
+# Actions are functions of (state, input) returning (next action, its input). run
+# calls them in turn; arun runs them on an event loop, where an action may also be
+# a coroutine, so many runs can share one thread (see agent_sessions.py). Actions
+# with an io parameter also get the channel they talk to the user through (see
+# agent_io.py). An action can also return a fork of branches to run at the same
+# time (see agent_branches.py). With a tracer, every step is timed (see
+# agent_trace.py), and with a budget a run stops going round once it has spent
+# it (see agent_budget.py). Values all the runs share, such as a search index,
+# are declared as resources (see agent_resources.py). With a checkpoint, a run
+# saves each step, and can be resumed from the last one (see agent_checkpoint.py).
+
+# runs the branches of forks for Agent.run
+branch_executor = None
+# marks the branch executor's threads
+branch_thread = threading.local()
+
+# what every step of a run, and of its branches, is run with
+Run = namedtuple("Run", ["io", "trace", "spending", "checkpoint"])
 
 
 class Agent:
-    def __init__(self, start_action="start", end_action="end"):
+    def __init__(self, start_action="start", end_action="end", name=None, budget=None):
+        # the name AI calls are attributed to in telemetry, with the action
+        self.name = name
+        # the Budget of runs not given one
+        self.budget = budget
         self.actions = {}
+        self.io_actions = set()  # names of the actions that take an io
+        self.resources = {}
+        # action name -> the action a resumed run goes to instead, when it
+        # stopped just before that one, e.g. to show the user again what it asked
+        self.resume_actions = {}
         self.start_action = start_action
         self.end_action = end_action
 
     def add_action(self, action_func):
         name = action_func.__name__.lower()
         self.actions[name] = action_func
+        if "io" in inspect.signature(action_func).parameters:
+            self.io_actions.add(name)
         return action_func
 
-    def run(self, input=None):
-        state = {}
-        action_name = self.start_action
-        next_input = input
-        while action_name != self.end_action and action_name in self.actions:
+    def add_resource(self, build_func=None, warm=False):
+        """Declare the resource build_func builds, named after it; as a decorator
+        with warm=True, use @agent.add_resource(warm=True)"""
+
+        if build_func is None:
+            return functools.partial(self.add_resource, warm=warm)
+        name = build_func.__name__.lower()
+        self.resources[name] = Resource(name, build_func, warm)
+        return build_func
+
+    def resource(self, name):
+        # built by the first run to ask for it, and shared by them all
+        return self.resources[name].get()
+
+    def warm_resources(self):
+        for resource in self.resources.values():
+            if resource.warm:
+                resource.get()
+
+    def arguments(self, action_name, state, input, io):
+        if action_name in self.io_actions:
+            return state, input, io
+        return state, input
+
+    def start_run(self, io, tracer, budget, checkpoint):
+        # with a tracer, the io is timed as waits on the user
+        budget = budget if budget is not None else self.budget
+        spending = budget.start_run(self.name) if budget is not None else no_budget
+        checkpoint = checkpoint if checkpoint is not None else no_checkpoint
+        if tracer is None:
+            return Run(io, no_trace, spending, checkpoint)
+        return Run(TracedIO(io), tracer.start_run(self.name), spending, checkpoint)
+
+    def first_step(self, run, input):
+        # the (action, its input, state) saved last, else the start
+        saved = run.checkpoint.load(self)
+        if saved is None:
+            return self.start_action, input, {}
+        action_name, next_input, state = saved
+        return self.resume_actions.get(action_name, action_name), next_input, state
+
+    @contextlib.contextmanager
+    def spending(self, run):
+        # AI calls made in the run are counted against its budget
+        token = current_spending.set(run.spending)
+        try:
+            yield
+        finally:
+            current_spending.reset(token)
+            run.spending.finish()
+
+    def run(self, input=None, io=terminal, tracer=None, budget=None, checkpoint=None):
+        if checkpoint is not None:
+            # a new session, whatever was saved before
+            checkpoint.clear()
+        return self.resume(checkpoint, input, io, tracer, budget)
+
+    def resume(self, checkpoint, input=None, io=terminal, tracer=None, budget=None):
+        """run from the step saved last to checkpoint, or from the start with
+        input if it has none"""
+
+        run = self.start_run(io, tracer, budget, checkpoint)
+        action_name, next_input, state = self.first_step(run, input)
+        with self.spending(run):
+            self.run_chain(state, action_name, next_input, run)
+        return state
+
+    def run_chain(self, state, action_name, next_input, run, join=None):
+        # the actions from action_name, until the end or join
+        while action_name not in (self.end_action, join) and action_name in self.actions:
+            if join is None:
+                run.checkpoint.save(action_name, next_input, state)
+            budgeted = run.spending.step(action_name, state, next_input)
+            if budgeted is None:
+                break
+            action_name, next_input = budgeted
             action = self.actions[action_name]
-            action_name, next_input = action(state, next_input)
-            # print("DEBUG", action_name, next_input)
+            if inspect.iscoroutinefunction(action):
+                raise TypeError(f"Action {action_name} is a coroutine, run the agent with arun")
+            with telemetry_action(self.name, action_name), run.trace.step(
+                action_name, state
+            ) as step:
+                result = action(*self.arguments(action_name, state, next_input, run.io))
+                step.result(result)
+
+            if isinstance(result, Fork):
+                action_name = result.join
+                next_input = self.run_fork(state, result, run)
+            else:
+                action_name, next_input = result
 
+        if join is None:
+            run.checkpoint.save(self.end_action, next_input, state)
+        return next_input
+
+    def run_fork(self, state, fork, run):
+        # the first branch runs on this thread, and the others on the branch
+        # executor, each in a copy of this context for its telemetry
+        global branch_executor
+        if branch_executor is None:
+            branch_executor = ThreadPoolExecutor(
+                BRANCH_WORKERS, thread_name_prefix="agent-branch", initializer=mark_branch_thread
+            )
+
+        branches = [branch_state(state) for _ in fork.branches]
+        runs = [
+            (
+                self.run_chain,
+                branch,
+                action_name,
+                branch_input,
+                run._replace(trace=run.trace.fork(number)),
+                fork.join,
+            )
+            for number, (branch, (action_name, branch_input)) in enumerate(
+                zip(branches, fork.branches)
+            )
+        ]
+        if getattr(branch_thread, "active", False):
+            # a fork in a branch runs all its branches here, one after another:
+            # once the outer branches took every thread, branches waiting on
+            # the executor for theirs would wait for ever
+            inline, pooled = runs, []
+        else:
+            inline, pooled = runs[:1], runs[1:]
+        futures = [
+            branch_executor.submit(contextvars.copy_context().run, *run) for run in pooled
+        ]
+        try:
+            results = [run[0](*run[1:]) for run in inline]
+        finally:
+            # every branch finishes before a failure is raised
+            concurrent.futures.wait(futures)
+        results += [future.result() for future in futures]
+
+        merge_changes(state, branches, fork.merge)
+        return results
+
+    async def arun(
+        self, input=None, executor=None, io=terminal, tracer=None, budget=None, checkpoint=None
+    ):
+        """run on the running event loop: coroutine actions are awaited, and the
+        others are called in executor (the loop's default one if None), so that
+        they can block without blocking the loop"""
+
+        if checkpoint is not None:
+            checkpoint.clear()
+        return await self.aresume(checkpoint, input, executor, io, tracer, budget)
+
+    async def aresume(
+        self, checkpoint, input=None, executor=None, io=terminal, tracer=None, budget=None
+    ):
+        # resume on the running event loop, as arun runs
+        run = self.start_run(io, tracer, budget, checkpoint)
+        action_name, next_input, state = self.first_step(run, input)
+        with self.spending(run):
+            await self.arun_chain(state, action_name, next_input, executor, run)
         return state
+
+    async def arun_chain(self, state, action_name, next_input, executor, run, join=None):
+        while action_name not in (self.end_action, join) and action_name in self.actions:
+            if join is None:
+                run.checkpoint.save(action_name, next_input, state)
+            budgeted = run.spending.step(action_name, state, next_input)
+            if budgeted is None:
+                break
+            action_name, next_input = budgeted
+            action = self.actions[action_name]
+            arguments = self.arguments(action_name, state, next_input, run.io)
+            with telemetry_action(self.name, action_name), run.trace.step(
+                action_name, state
+            ) as step:
+                if inspect.iscoroutinefunction(action):
+                    result = await action(*arguments)
+                else:
+                    result = await call_in_executor(executor, action, *arguments)
+                step.result(result)
+
+            if isinstance(result, Fork):
+                action_name = result.join
+                next_input = await self.arun_fork(state, result, executor, run)
+            else:
+                action_name, next_input = result
+
+        if join is None:
+            run.checkpoint.save(self.end_action, next_input, state)
+        return next_input
+
+    async def arun_fork(self, state, fork, executor, run):
+        # each branch in its own task
+        branches = [branch_state(state) for _ in fork.branches]
+        results = await asyncio.gather(
+            *(
+                self.arun_chain(
+                    branch,
+                    action_name,
+                    branch_input,
+                    executor,
+                    run._replace(trace=run.trace.fork(number)),
+                    fork.join,
+                )
+                for number, (branch, (action_name, branch_input)) in enumerate(
+                    zip(branches, fork.branches)
+                )
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        merge_changes(state, branches, fork.merge)
+        return results
+
+
+def mark_branch_thread():
+    branch_thread.active = True
+
+
+async def call_in_executor(executor, function, *args):
+    # in a copy of this context, so the action's AI calls are attributed to it
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(context.run, function, *args)
+    )
@@ -0,0 +1,116 @@
+import importlib
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from agent_io import EndOfScript, ScriptedIO, load_scripts
+from ai_hedge import percentile
+
+# Scripted sessions of a demo agent run in bulk, across a pool of processes
+#
+# Each session replays its user's turns through a ScriptedIO (see agent_io.py),
+# and ends when the agent does or when it asks for more turns than the script
+# has. The report gives the sessions per second and how long the agent took to
+# answer each turn.
+#
+#   python -m agent_batch demos.simple_rag.agent sessions.jsonl --processes 4
+#
+# AI_BACKEND=mock (with AI_MOCK_URL, to share one mock server) runs the sessions
+# without an API.
+
+PROCESSES = int(os.environ.get("AGENT_BATCH_PROCESSES", os.cpu_count() or 1))
+
+SessionResult = namedtuple(
+    "SessionResult", ["session", "seconds", "turn_latencies", "transcript", "error"]
+)
+
+
+def run_session(module, session, turns):
+    """Run one scripted session of the agent in module"""
+
+    agent = importlib.import_module(module).agent
+    io = ScriptedIO(turns)
+    error = None
+
+    start = time.perf_counter()
+    try:
+        agent.run(io=io)
+    except EndOfScript:
+        pass
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    io.finish()
+
+    return SessionResult(
+        session,
+        time.perf_counter() - start,
+        io.turn_latencies,
+        io.transcript.getvalue(),
+        error,
+    )
+
+
+def run_sessions(module, scripts, processes=PROCESSES):
+    """The SessionResult of each session of scripts (user turns by session id), in
+    order, and the seconds they took"""
+
+    start = time.perf_counter()
+    # forked workers start with the agent's resources already built here
+    importlib.import_module(module).agent.warm_resources()
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(processes, mp_context=context) as executor:
+        results = list(
+            executor.map(
+                run_session,
+                [module] * len(scripts),
+                list(scripts),
+                list(scripts.values()),
+            )
+        )
+    return results, time.perf_counter() - start
+
+
+def report(results, seconds):
+    latencies = [latency for result in results for latency in result.turn_latencies]
+    failed = [result for result in results if result.error is not None]
+
+    lines = [
+        f"sessions: {len(results)} in {seconds:.2f} s, {len(results) / seconds:.2f}/s",
+        f"failed: {len(failed)}",
+    ]
+    if latencies:
+        lines.append(
+            f"turns: {len(latencies)}, latency "
+            + ", ".join(f"p{p} {percentile(latencies, p):.3f} s" for p in [50, 95, 99])
+            + f", max {max(latencies):.3f} s"
+        )
+    for result in failed:
+        lines.append(f"  {result.session}: {result.error}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run scripted sessions of a demo agent")
+    parser.add_argument("module", help="the agent's module, e.g. demos.simple_rag.agent")
+    parser.add_argument("script", help='JSON lines of user turns, {"session": id, "input": text}')
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--transcripts", help="a directory to write each session's transcript to")
+    arguments = parser.parse_args()
+
+    results, seconds = run_sessions(
+        arguments.module, load_scripts(arguments.script), arguments.processes
+    )
+    print(report(results, seconds))
+
+    if arguments.transcripts:
+        os.makedirs(arguments.transcripts, exist_ok=True)
+        for result in results:
+            path = os.path.join(arguments.transcripts, f"{result.session}.txt")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(result.transcript)
@@ -0,0 +1,128 @@
+import copy
+import os
+from collections import namedtuple
+
+# Fan-out and fan-in for agents: an action can return fork(...) instead of
+# (next action, its input), to run several branches at the same time
+#
+# Each branch starts at an action and runs until it reaches the join action (or
+# the end), on its own copy of the state as it was at the fork, so its changes
+# are kept apart from the other branches'. Once every branch has reached the
+# join, their changes are merged into the state, and the join action is run with
+# the list of the inputs the branches passed to it, in the order of the branches.
+#
+# Two branches changing the same key is a conflict, settled by the merge rule
+# for that key: the name of one of MERGE_RULES, or a function of (the value at
+# the fork, the branches' values) returning the merged value. A conflict on a key
+# without a rule raises MergeConflict. Branches that all set a key to equal
+# values do not conflict. A branch that removed the key has REMOVED as its
+# value, which "extend" and "update" cannot merge with another branch's change,
+# so they raise MergeConflict too.
+#
+# Agent.run runs the branches on threads, and Agent.arun on its event loop. A
+# branch that forks again under Agent.run runs its own branches one after
+# another, on its thread, rather than wait for threads its fork's branches hold.
+
+BRANCH_WORKERS = int(os.environ.get("AGENT_BRANCH_WORKERS", 16))
+
+Fork = namedtuple("Fork", ["branches", "join", "merge"])
+
+
+def fork(branches, join, merge=None):
+    """Run branches, each an (action name, input), then the action join
+
+    merge maps a state key to the rule that merges conflicting changes to it"""
+
+    return Fork(list(branches), join, merge or {})
+
+
+class MergeConflict(Exception):
+    pass
+
+
+# a removed key, as a branch's value for it
+REMOVED = object()
+
+
+def merge_error(key):
+    def merge(_original, _values):
+        raise MergeConflict(f"Branches changed {key!r} and it has no merge rule")
+
+    return merge
+
+
+def merge_removed(rule, values):
+    if any(value is REMOVED for value in values):
+        raise MergeConflict(f"A branch removed a key another changed, which {rule!r} cannot merge")
+
+
+def merge_extend(original, values):
+    # the items each branch added after the original ones, in branch order
+    merge_removed("extend", values)
+    merged = list(original or [])
+    for value in values:
+        merged.extend(value[len(original or []) :])
+    return merged
+
+
+def merge_update(original, values):
+    merge_removed("update", values)
+    merged = dict(original or {})
+    for value in values:
+        merged.update(value)
+    return merged
+
+
+MERGE_RULES = {
+    "first": lambda _original, values: values[0],
+    "last": lambda _original, values: values[-1],
+    "extend": merge_extend,
+    "update": merge_update,
+}
+
+
+def branch_state(state):
+    """A branch's own copy of the state
+
+    Lists, dicts and sets are copied deeply, so changes to them stay in the
+    branch. Other objects are shared rather than copied, and should not be
+    changed by a branch; a search index or the like is better declared as a
+    resource of the agent (see agent_resources.py), outside the state."""
+
+    return {
+        key: copy.deepcopy(value) if isinstance(value, (dict, list, set)) else value
+        for key, value in state.items()
+    }
+
+
+def changes(state, branch):
+    """The keys a branch changed in its copy of state, with their new values or REMOVED"""
+
+    changed = {key: REMOVED for key in state if key not in branch}
+    for key, value in branch.items():
+        if key not in state or state[key] != value:
+            changed[key] = value
+    return changed
+
+
+def merge_changes(state, branches, rules):
+    """Apply the changes each branch made to its copy of state"""
+
+    changed = {}
+    for branch in branches:
+        for key, value in changes(state, branch).items():
+            changed.setdefault(key, []).append(value)
+
+    for key, values in changed.items():
+        if all(value is values[0] or value == values[0] for value in values[1:]):
+            # one branch changed it, or they all agree
+            value = values[0]
+        else:
+            rule = rules.get(key, merge_error(key))
+            rule = MERGE_RULES[rule] if isinstance(rule, str) else rule
+            value = rule(state.get(key), values)
+
+        if value is REMOVED:
+            state.pop(key, None)
+        else:
+            state[key] = value
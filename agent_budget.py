@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from ai_rate_limit import CHARACTERS_PER_TOKEN
+
+# Limits on what one agent run may spend, so a model that keeps sending the
+# agent round the same actions cannot run up AI calls and latency without end
+#
+# A Budget caps the steps of a run, the AI requests made in it, their tokens and
+# the run's wall-clock time, and catches a run going round in a cycle: the same
+# action given the same state and input more than max_repeats times. The limits
+# are checked before each step. Once one is reached the run goes to the budget's
+# fallback action, with the reason as its input, and ends after it; without a
+# fallback it ends there. Limits left as None are not checked.
+#
+#   budget = Budget(max_steps=50, max_llm_calls=30, fallback="stop_planning")
+#   agent.run(budget=budget)
+#   print(budget.report())
+#
+# The budget keeps the Spending of its last RUNS_KEPT runs. AI requests are
+# counted through ai_telemetry, in the action that made them.
+
+MAX_REPEATS = int(os.environ.get("AGENT_MAX_REPEATS", 2))
+RUNS_KEPT = 1000
+
+
+def fingerprint(action_name, state, input):
+    # equal for equal states; objects JSON cannot encode are compared by repr
+    return hash(json.dumps([action_name, state, input], sort_keys=True, default=repr))
+
+
+class Spending:
+    """What one run has spent of its budget, added to from any thread"""
+
+    def __init__(self, budget, agent):
+        self.budget = budget
+        self.agent = agent
+        self.steps = 0
+        self.llm_calls = 0
+        self.tokens = 0
+        self.start = time.perf_counter()
+        self.end = None
+        self.exhausted = None  # why the run was cut short
+        self.fingerprints = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def seconds(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def add_call(self, call):
+        # a finished ai_telemetry Call; a streamed response without usage is
+        # counted by the size of its prompt
+        if call.prompt_tokens is None:
+            tokens = call.prompt_bytes // CHARACTERS_PER_TOKEN if call.requests else 0
+        else:
+            tokens = call.prompt_tokens + call.completion_tokens
+        with self.lock:
+            self.llm_calls += call.requests
+            self.tokens += tokens
+
+    def over(self, action_name, state, input):
+        # the reason the run cannot take this step, or None
+        budget = self.budget
+        if budget.max_steps is not None and self.steps >= budget.max_steps:
+            return f"{self.steps} steps, the most allowed"
+        if budget.max_llm_calls is not None and self.llm_calls >= budget.max_llm_calls:
+            return f"{self.llm_calls} AI calls, the most allowed"
+        if budget.max_tokens is not None and self.tokens >= budget.max_tokens:
+            return f"{self.tokens} tokens, over the {budget.max_tokens} allowed"
+        if budget.max_seconds is not None and self.seconds >= budget.max_seconds:
+            return f"{self.seconds:.1f} seconds, over the {budget.max_seconds} allowed"
+        if budget.max_repeats is not None:
+            key = fingerprint(action_name, state, input)
+            self.fingerprints[key] += 1
+            if self.fingerprints[key] > budget.max_repeats:
+                return f"a cycle, back at {action_name} with the same state again"
+        return None
+
+    def step(self, action_name, state, input):
+        """The (action, input) the run takes next instead of action_name and
+        input, or None to end the run"""
+
+        with self.lock:
+            if self.exhausted is not None:
+                # the fallback has run
+                return None
+            reason = self.over(action_name, state, input)
+            if reason is None:
+                self.steps += 1
+                return action_name, input
+            self.exhausted = reason
+            if self.budget.fallback is None:
+                return None
+            self.steps += 1
+            return self.budget.fallback, reason
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+
+class Budget:
+    """The limits on each run of an agent, and what its recent runs spent"""
+
+    def __init__(
+        self,
+        max_steps=None,
+        max_llm_calls=None,
+        max_tokens=None,
+        max_seconds=None,
+        max_repeats=MAX_REPEATS,
+        fallback=None,
+    ):
+        self.max_steps = max_steps
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.max_repeats = max_repeats
+        self.fallback = fallback
+        self.runs = deque(maxlen=RUNS_KEPT)
+
+    def start_run(self, agent):
+        spending = Spending(self, agent)
+        self.runs.append(spending)
+        return spending
+
+    def report(self):
+        """The spending of each run kept, against the limits"""
+
+        def limit(value):
+            return "-" if value is None else value
+
+        lines = [
+            f"limits: {limit(self.max_steps)} steps, {limit(self.max_llm_calls)} AI calls, "
+            f"{limit(self.max_tokens)} tokens, {limit(self.max_seconds)} s, "
+            f"{limit(self.max_repeats)} repeats",
+            f"  {'agent':<20} {'steps':>6} {'calls':>6} {'tokens':>8} {'seconds':>8}  exhausted",
+        ]
+        for spending in list(self.runs):
+            lines.append(
+                f"  {str(spending.agent):<20} {spending.steps:>6} {spending.llm_calls:>6} "
+                f"{spending.tokens:>8} {spending.seconds:>8.2f}  {spending.exhausted or ''}"
+            )
+        return "\n".join(lines)
+
+
+class NoBudget:
+    """What a run spends against when it has no budget"""
+
+    def step(self, action_name, state, input):
+        return action_name, input
+
+    def add_call(self, call):
+        pass
+
+    def finish(self):
+        pass
+
+
+no_budget = NoBudget()
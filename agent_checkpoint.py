@@ -0,0 +1,322 @@
+import io
+import operator
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from urllib.parse import quote
+
+# Checkpoints of agent runs, so that a session can carry on after a crash or a
+# redeploy instead of starting again and repeating its AI calls
+#
+# agent.run(checkpoint=Checkpoint(store, session)) saves, before every step of
+# the run, the action it goes to next, that action's input and the state, and
+# then the end. agent.resume(checkpoint) carries on from the last one saved, or
+# starts the session if it has none; an action in agent.resume_actions is
+# carried on from the action it maps to, e.g. to ask the user again.
+#
+# Each save is a record of what changed since the one before: the state's keys
+# with new values, the keys removed, and for lists that only grew, just the new
+# items. Every SNAPSHOT_EVERY saves, the record is the whole state instead and
+# the store drops the records before it, so a resume reads no more than that.
+# Records are pickled, and compressed with zlib when over COMPRESS_BYTES.
+#
+# The agent's resources (see agent_resources.py) are saved by name and looked up
+# again on resume, so a state that refers to a search index does not save the
+# index. Other values must be picklable.
+#
+# Stores keep each session's records in order:
+#   FileStore   - appends them to a file per session
+#   SQLiteStore - inserts them in a table of a SQLite database
+# A store is anything with append(session, record, snapshot), records(session)
+# and delete(session).
+#
+# Only the run's own steps are saved, not its branches' (see agent_branches.py):
+# a run resumed in the middle of a fork forks again.
+
+CHECKPOINT_DIR = os.environ.get(
+    "AGENT_CHECKPOINT_DIR", os.path.join(os.path.dirname(__file__), ".checkpoints")
+)
+SNAPSHOT_EVERY = 100
+COMPRESS_BYTES = 1024
+
+PROTOCOL = pickle.HIGHEST_PROTOCOL
+SNAPSHOT = 1
+COMPRESSED = 2
+
+
+# a state value as last saved: pickled, and for a list of frozen items, a copy
+Saved = namedtuple("Saved", ["encoded", "items"])
+
+FROZEN_TYPES = {str, bytes, int, float, bool, type(None)}
+
+
+def frozen(value):
+    # a value that cannot change once it is in a list, so is saved only once
+    if type(value) is tuple:
+        return all(map(frozen, value))
+    return type(value) in FROZEN_TYPES
+
+
+def appended(items, value):
+    # the items appended to a copy of a list to give value, or None if it changed otherwise
+    if type(value) is not list or len(value) < len(items):
+        return None
+    if not all(map(operator.is_, items, value)):
+        return None
+    return value[len(items) :]
+
+
+class ResourcePickler(pickle.Pickler):
+    # saves the resources, by id of their value, as their names
+    def __init__(self, file, resources):
+        super().__init__(file, PROTOCOL)
+        self.resources = resources
+
+    def persistent_id(self, obj):
+        return self.resources.get(id(obj))
+
+
+class ResourceUnpickler(pickle.Unpickler):
+    def __init__(self, file, agent):
+        super().__init__(file)
+        self.agent = agent
+
+    def persistent_load(self, name):
+        return self.agent.resource(name)
+
+
+class Checkpoint:
+    """The saved steps of one session of an agent, in store"""
+
+    def __init__(self, store, session, snapshot_every=SNAPSHOT_EVERY):
+        self.store = store
+        self.session = session
+        self.snapshot_every = snapshot_every
+        self.agent = None
+        self.resources = {}
+        self.saved = {}  # key -> Saved
+        self.records = 0  # saved since the last snapshot
+
+    def find_resources(self):
+        # the agent's resources built so far, by id of their value
+        self.resources = {
+            id(resource.value): name
+            for name, resource in self.agent.resources.items()
+            if resource.built
+        }
+
+    def encode(self, value):
+        if not self.resources:
+            return pickle.dumps(value, PROTOCOL)
+        file = io.BytesIO()
+        ResourcePickler(file, self.resources).dump(value)
+        return file.getvalue()
+
+    def decode(self, data):
+        return ResourceUnpickler(io.BytesIO(data), self.agent).load()
+
+    def clear(self):
+        # a new session
+        self.store.delete(self.session)
+        self.saved = {}
+        self.records = 0
+
+    def remember(self, value, encoded):
+        # what a later save compares value with: for a list of frozen items, a
+        # copy of it, so that items appended can be found without encoding it
+        items = list(value) if type(value) is list and all(map(frozen, value)) else None
+        return Saved(encoded, items)
+
+    def save(self, action_name, next_input, state):
+        self.find_resources()
+        snapshot = self.records % self.snapshot_every == 0
+        values = {}
+        extended = {}
+        saved = {}
+        for key, value in state.items():
+            previous = self.saved.get(key)
+            if not snapshot and previous is not None and previous.items is not None:
+                added = appended(previous.items, value)
+                if added is not None and all(map(frozen, added)):
+                    if added:
+                        extended[key] = self.encode(added)
+                    saved[key] = Saved(None, list(value))
+                    continue
+
+            encoded = self.encode(value)
+            saved[key] = self.remember(value, encoded)
+            if snapshot or previous is None or encoded != previous.encoded:
+                values[key] = encoded
+        removed = [] if snapshot else [key for key in self.saved if key not in state]
+
+        record = pickle.dumps(
+            (action_name, self.encode(next_input), values, extended, removed), PROTOCOL
+        )
+        flags = SNAPSHOT if snapshot else 0
+        if len(record) > COMPRESS_BYTES:
+            record = zlib.compress(record)
+            flags |= COMPRESSED
+
+        self.store.append(self.session, bytes([flags]) + record, snapshot)
+        self.saved = saved
+        self.records = 1 if snapshot else self.records + 1
+
+    def load(self, agent):
+        """The (action, its input, state) saved last, or None if there are none"""
+
+        self.agent = agent
+        records = self.store.records(self.session)
+        if not records:
+            self.saved = {}
+            self.records = 0
+            return None
+
+        state = {}
+        for record in records:
+            flags, record = record[0], record[1:]
+            if flags & COMPRESSED:
+                record = zlib.decompress(record)
+            action_name, next_input, values, extended, removed = pickle.loads(record)
+            for key in removed:
+                state.pop(key, None)
+            for key, value in values.items():
+                state[key] = self.decode(value)
+            for key, items in extended.items():
+                state[key].extend(self.decode(items))
+
+        # later saves are changes to the state as loaded
+        self.find_resources()
+        self.saved = {key: self.remember(value, self.encode(value)) for key, value in state.items()}
+        self.records = len(records)
+        return action_name, self.decode(next_input), state
+
+
+class NoCheckpoint:
+    """What a run saves its steps to when it has no checkpoint"""
+
+    def clear(self):
+        pass
+
+    def save(self, action_name, next_input, state):
+        pass
+
+    def load(self, agent):
+        return None
+
+
+no_checkpoint = NoCheckpoint()
+
+
+class FileStore:
+    """Each session's records appended to a file of its own in directory, each
+    after its length; with sync, every record is flushed to disk"""
+
+    def __init__(self, directory=CHECKPOINT_DIR, sync=False):
+        self.directory = directory
+        self.sync = sync
+        # session -> the length of its file up to a record cut short by a crash
+        self.torn = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, session):
+        return os.path.join(self.directory, quote(str(session), safe="") + ".checkpoint")
+
+    def write(self, file, data):
+        file.write(data)
+        if self.sync:
+            file.flush()
+            os.fsync(file.fileno())
+
+    def append(self, session, record, snapshot):
+        path = self.path(session)
+        data = struct.pack("<I", len(record)) + record
+        if not snapshot:
+            with open(path, "r+b" if session in self.torn else "ab") as file:
+                if session in self.torn:
+                    # records appended after the torn one would be lost behind it
+                    file.truncate(self.torn.pop(session))
+                    file.seek(0, os.SEEK_END)
+                self.write(file, data)
+            return
+
+        # the records before a snapshot are not needed any more
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            self.write(file, data)
+        os.replace(temporary_path, path)
+        self.torn.pop(session, None)
+
+    def records(self, session):
+        try:
+            with open(self.path(session), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+
+        records = []
+        offset = 0
+        while offset + 4 <= len(data):
+            (length,) = struct.unpack_from("<I", data, offset)
+            if offset + 4 + length > len(data):
+                break
+            records.append(data[offset + 4 : offset + 4 + length])
+            offset += 4 + length
+        if offset < len(data):
+            # cut short by a crash while it was written
+            self.torn[session] = offset
+        return records
+
+    def delete(self, session):
+        self.torn.pop(session, None)
+        try:
+            os.remove(self.path(session))
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteStore:
+    """Records in a SQLite database shared by every session, from any thread"""
+
+    def __init__(self, path=os.path.join(CHECKPOINT_DIR, "checkpoints.sqlite")):
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # a commit appends to the write-ahead log, without waiting on the disk
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "id INTEGER PRIMARY KEY, session TEXT NOT NULL, record BLOB NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS checkpoints_session ON checkpoints (session, id)"
+            )
+
+    def append(self, session, record, snapshot):
+        with self.lock, self.connection:
+            if snapshot:
+                self.connection.execute(
+                    "DELETE FROM checkpoints WHERE session = ?", (str(session),)
+                )
+            self.connection.execute(
+                "INSERT INTO checkpoints (session, record) VALUES (?, ?)", (str(session), record)
+            )
+
+    def records(self, session):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT record FROM checkpoints WHERE session = ? ORDER BY id", (str(session),)
+            ).fetchall()
+        return [record for (record,) in rows]
+
+    def delete(self, session):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM checkpoints WHERE session = ?", (str(session),))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,177 @@
+import asyncio
+import builtins
+import io as string_io
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Where an agent's actions talk to the user, so one agent can run in a terminal,
+# from a script of user turns, or behind a server
+#
+# Agent.run(io=...) passes the channel to every action with an io parameter.
+# Channels have print and input methods that work like the builtins, and
+# aprint and ainput for coroutine actions:
+#   TerminalIO - the terminal, with the builtins (the default)
+#   ScriptedIO - replies with a script of user turns, keeping a transcript and
+#                how long the agent took to answer each turn
+#   QueueIO    - asyncio queues, for a server to pass messages to and from a
+#                session running on its event loop
+#
+# Behind QueueIO, an action that is a plain function holds one of the session
+# manager's AGENT_SYNC_WORKERS threads (see agent_sessions.py) for as long as
+# its user takes to reply, and while they are all waiting no other session's
+# plain function action can run. So at most MAX_SYNC_INPUTS of them may wait
+# at once, one less than the threads, and QueueIO.input raises
+# TooManySyncInputs rather than take the last one: an action that waits on its
+# user behind a server should be a coroutine, with await io.ainput().
+
+MAX_SYNC_INPUTS = int(
+    os.environ.get("AGENT_MAX_SYNC_INPUTS", int(os.environ.get("AGENT_SYNC_WORKERS", 64)) - 1)
+)
+
+
+def format_output(values, sep=" ", end="\n"):
+    return sep.join(str(value) for value in values) + end
+
+
+class TerminalIO:
+    def print(self, *values, sep=" ", end="\n", flush=False):
+        builtins.print(*values, sep=sep, end=end, flush=flush)
+
+    def input(self, prompt=""):
+        return builtins.input(prompt)
+
+    async def aprint(self, *values, sep=" ", end="\n", flush=False):
+        self.print(*values, sep=sep, end=end, flush=flush)
+
+    async def ainput(self, prompt=""):
+        # input() blocks, so it waits in a thread rather than on the event loop
+        return await asyncio.to_thread(self.input, prompt)
+
+
+terminal = TerminalIO()
+
+
+class EndOfScript(Exception):
+    """The agent asked for more input than its script has"""
+
+
+class ScriptedIO:
+    """Replies to each prompt with the next of turns, and keeps what the agent
+    printed (and the replies) in transcript
+
+    turn_latencies are the seconds the agent took after each reply before it
+    asked for the next one or finished (see finish)."""
+
+    def __init__(self, turns=()):
+        self.turns = iter(turns)
+        self.transcript = string_io.StringIO()
+        self.turn_latencies = []
+        self.replied_at = None
+
+    def reply(self, prompt):
+        # subclasses may reply according to the prompt
+        try:
+            return next(self.turns)
+        except StopIteration:
+            raise EndOfScript()
+
+    def print(self, *values, sep=" ", end="\n", flush=False):
+        self.transcript.write(format_output(values, sep, end))
+
+    def input(self, prompt=""):
+        self.finish()
+        self.transcript.write(prompt)
+        answer = self.reply(prompt)
+        self.transcript.write(answer + "\n")
+        self.replied_at = time.perf_counter()
+        return answer
+
+    def finish(self):
+        """Record how long the agent took to answer the last reply"""
+
+        if self.replied_at is not None:
+            self.turn_latencies.append(time.perf_counter() - self.replied_at)
+            self.replied_at = None
+
+    async def aprint(self, *values, sep=" ", end="\n", flush=False):
+        self.print(*values, sep=sep, end=end)
+
+    async def ainput(self, prompt=""):
+        return self.input(prompt)
+
+
+def load_scripts(path):
+    """The user turns of each session in a JSON lines file, by session id
+
+    Each line is one turn, {"session": id, "input": text}, in the order the user
+    gives them; the turns of different sessions may be interleaved."""
+
+    scripts = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                turn = json.loads(line)
+                scripts.setdefault(turn["session"], []).append(turn["input"])
+    return scripts
+
+
+# what a session sent to its user: "output" text, or a "prompt" for the next reply
+Message = namedtuple("Message", ["kind", "text"])
+
+
+class TooManySyncInputs(Exception):
+    """More plain function actions would wait on their users than MAX_SYNC_INPUTS"""
+
+
+class QueueIO:
+    """A session's messages in outbox and the user's replies in inbox, both
+    asyncio queues of the event loop the QueueIO is created on
+
+    The server takes Messages with receive() and gives replies with send().
+    Plain function actions, which run in a thread pool, wait for a reply
+    without blocking the event loop, holding their thread, up to
+    MAX_SYNC_INPUTS of them at once across every QueueIO."""
+
+    # plain function actions waiting in input, in every session
+    sync_inputs = 0
+    sync_inputs_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.outbox = asyncio.Queue()
+        self.inbox = asyncio.Queue()
+
+    async def receive(self):
+        return await self.outbox.get()
+
+    async def send(self, reply):
+        await self.inbox.put(reply)
+
+    async def aprint(self, *values, sep=" ", end="\n", flush=False):
+        await self.outbox.put(Message("output", format_output(values, sep, end)))
+
+    async def ainput(self, prompt=""):
+        await self.outbox.put(Message("prompt", prompt))
+        return await self.inbox.get()
+
+    # from other threads only: called on the event loop, they would block it
+    def print(self, *values, sep=" ", end="\n", flush=False):
+        message = Message("output", format_output(values, sep, end))
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, message)
+
+    def input(self, prompt=""):
+        with QueueIO.sync_inputs_lock:
+            if QueueIO.sync_inputs >= MAX_SYNC_INPUTS:
+                raise TooManySyncInputs(
+                    f"{MAX_SYNC_INPUTS} plain function actions are already waiting on their "
+                    "users; make the action a coroutine that awaits io.ainput()"
+                )
+            QueueIO.sync_inputs += 1
+        try:
+            return asyncio.run_coroutine_threadsafe(self.ainput(prompt), self.loop).result()
+        finally:
+            with QueueIO.sync_inputs_lock:
+                QueueIO.sync_inputs -= 1
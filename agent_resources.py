@@ -0,0 +1,50 @@
+import threading
+
+# Values an agent's runs share in a process, such as a search index, built once
+# rather than once per run
+#
+# A resource is declared on the agent with the function that builds it, and its
+# actions look it up by the function's name:
+#   @agent.add_resource
+#   def search_engine():
+#       return digest_book()
+#   ...
+#   search_engine = agent.resource("search_engine")
+# It is built the first time it is looked up, once however many runs ask for it
+# at the same time, and then every run of the agent in the process shares it and
+# must only read it. The runs' state is left with just the conversation, and
+# branches (see agent_branches.py) do not copy it.
+#
+# Declared with warm=True, a resource is built by agent.warm_resources(), when
+# a server starts rather than in its first session: SessionManager warms them
+# as it opens, and agent_batch before it forks its worker processes, so that the
+# workers share the parent's copy of the resource's memory instead of each
+# building their own.
+
+
+class Resource:
+    """A value built the first time it is asked for, from any thread"""
+
+    def __init__(self, name, build, warm=False):
+        self.name = name
+        self.build = build
+        self.warm = warm
+        self.value = None
+        self.built = False
+        self.builds = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.built:
+            with self.lock:
+                if not self.built:
+                    self.value = self.build()
+                    self.builds += 1
+                    self.built = True
+        return self.value
+
+    def reset(self):
+        # built again when next asked for, e.g. after its source changed
+        with self.lock:
+            self.value = None
+            self.built = False
@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_io import terminal
+
+# Many sessions of an agent in one process, each a run of Agent.arun with its own
+# state, all on one event loop
+#
+# Coroutine actions cost a session nothing while they wait, so thousands can be in
+# progress at once. Actions that are plain functions (such as the demos', which
+# block on input() and on request_ai_response) run on a pool of SYNC_WORKERS
+# threads, and at most that many of them run at once; the rest wait their turn.
+# A plain function action waiting on its user's reply through QueueIO holds its
+# thread until the reply comes, so fewer than SYNC_WORKERS of them may wait at
+# once (see MAX_SYNC_INPUTS in agent_io.py); actions that wait on the user
+# behind a server should be coroutines.
+
+MAX_SESSIONS = int(os.environ.get("AGENT_MAX_SESSIONS", 10000))
+SYNC_WORKERS = int(os.environ.get("AGENT_SYNC_WORKERS", 64))
+
+
+class SessionManager:
+    """Runs sessions of an agent concurrently, at most max_sessions at a time
+
+    Use it on the event loop it runs the sessions on, e.g.
+        async with SessionManager(agent) as sessions:
+            for user in users:
+                sessions.start(user.id, user.question)
+            states = await sessions.wait()"""
+
+    def __init__(self, agent, max_sessions=MAX_SESSIONS, sync_workers=SYNC_WORKERS):
+        self.agent = agent
+        self.max_sessions = max_sessions
+        self.sync_workers = sync_workers
+        self.sessions = {}  # session id -> asyncio.Task of its run
+        self.semaphore = None
+        self.executor = None
+
+    def start(
+        self, session_id, input=None, io=terminal, tracer=None, budget=None, checkpoint=None
+    ):
+        """Start a session talking to its user through io (see agent_io.py),
+        traced by tracer if given (see agent_trace.py), limited by budget (see
+        agent_budget.py) and saving its steps to checkpoint (see
+        agent_checkpoint.py), which begins once fewer than max_sessions are
+        running"""
+
+        return self.add(
+            session_id,
+            functools.partial(
+                self.agent.arun, input, io=io, tracer=tracer, budget=budget, checkpoint=checkpoint
+            ),
+        )
+
+    def resume(self, session_id, checkpoint, io=terminal, tracer=None, budget=None):
+        # a session from the step it saved last to checkpoint, started as start starts one
+        return self.add(
+            session_id,
+            functools.partial(self.agent.aresume, checkpoint, io=io, tracer=tracer, budget=budget),
+        )
+
+    def add(self, session_id, run):
+        # run is called with the executor for the session's blocking actions
+        if session_id in self.sessions:
+            raise ValueError(f"Session {session_id!r} already exists")
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_sessions)
+            self.executor = ThreadPoolExecutor(
+                self.sync_workers, thread_name_prefix="agent-action"
+            )
+
+        task = asyncio.create_task(self._run(run), name=f"session-{session_id}")
+        self.sessions[session_id] = task
+        return task
+
+    async def _run(self, run):
+        async with self.semaphore:
+            return await run(executor=self.executor)
+
+    def running(self):
+        return [session_id for session_id, task in self.sessions.items() if not task.done()]
+
+    def cancel(self, session_id):
+        # an action running in the thread pool finishes first
+        self.sessions[session_id].cancel()
+
+    async def wait(self, return_exceptions=True):
+        """The final state of every session started so far, by session id
+
+        With return_exceptions, a session that failed or was cancelled has its
+        exception in place of a state, otherwise the first failure is raised."""
+
+        session_ids = list(self.sessions)
+        results = await asyncio.gather(
+            *(self.sessions[session_id] for session_id in session_ids),
+            return_exceptions=return_exceptions,
+        )
+        return dict(zip(session_ids, results))
+
+    async def close(self):
+        # cancels the sessions still running
+        for task in self.sessions.values():
+            task.cancel()
+        await asyncio.gather(*self.sessions.values(), return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        # before the first session, rather than in it
+        await asyncio.to_thread(self.agent.warm_resources)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
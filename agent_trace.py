@@ -0,0 +1,349 @@
+import contextlib
+import itertools
+import json
+import threading
+import time
+from collections import Counter, namedtuple
+
+from agent_branches import Fork
+from ai_hedge import percentile
+from ai_telemetry import current_step
+
+# A trace of every step of agent runs, to see where a session's time goes
+#
+# Agent.run(tracer=...) records a Step for each action it runs: its step number,
+# the action it went to next, the size of the state, and its wall time split
+# into time in AI calls, time waiting on the user (the io's input and print) and
+# the rest, compute. The AI calls and the waits are also kept as spans, so
+#   tracer.write_chrome_trace(path)
+# shows each run as a flame chart in chrome://tracing or Perfetto, and
+#   tracer.report()
+# gives, for each agent, the calls and p50/p95 time of each action and the loops
+# of actions it went round most often.
+
+Step = namedtuple(
+    "Step",
+    [
+        "agent",
+        "run",  # the number of the run in this tracer
+        "branch",  # "" for the run itself, else e.g. "1" or "1.0" for a branch of a fork
+        "step",  # the number of the step in the run, counting its branches' steps
+        "action",
+        "next_action",  # or the join of the fork it returned
+        "branches",  # the number of branches of the fork it returned, else 0
+        "start",  # time.perf_counter() when it started
+        "wall",
+        "llm",
+        "io",
+        "compute",
+        "state_keys",  # len(state) after the step
+        "spans",  # (kind, start, end) of each AI call ("llm") and wait on the user ("io")
+    ],
+)
+
+
+def covered(spans):
+    # the time covered by any of the spans, which may overlap
+    total = 0.0
+    covered_until = None
+    for start, end in sorted(spans):
+        if covered_until is not None and start < covered_until:
+            start = covered_until
+        if end > start:
+            total += end - start
+            covered_until = end if covered_until is None else max(covered_until, end)
+    return total
+
+
+class StepTimer:
+    """Collects the spans of the step running in this context, see ai_telemetry"""
+
+    def __init__(self):
+        self.spans = []
+        self.next_action = None
+        self.branches = 0
+
+    def add(self, kind, start, end):
+        self.spans.append((kind, start, end))
+
+    def result(self, result):
+        # the (next action, input) or fork the action returned
+        if isinstance(result, Fork):
+            self.next_action, self.branches = result.join, len(result.branches)
+        else:
+            self.next_action = result[0]
+
+
+class RunTrace:
+    """Records the steps of one run, or of one branch of it"""
+
+    def __init__(self, tracer, agent, run, branch="", steps=None):
+        self.tracer = tracer
+        self.agent = agent
+        self.run = run
+        self.branch = branch
+        self.steps = itertools.count() if steps is None else steps
+
+    def fork(self, number):
+        # branch number of a fork this run or branch returned
+        branch = f"{self.branch}.{number}" if self.branch else str(number)
+        return RunTrace(self.tracer, self.agent, self.run, branch, self.steps)
+
+    @contextlib.contextmanager
+    def step(self, action, state):
+        timer = StepTimer()
+        token = current_step.set(timer)
+        step = next(self.steps)
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            end = time.perf_counter()
+            current_step.reset(token)
+
+            # output while a response streams in is part of the AI call
+            spans = timer.spans
+            llm = covered([(s, e) for kind, s, e in spans if kind == "llm"])
+            waited = covered([(s, e) for _kind, s, e in spans])
+            wall = end - start
+            self.tracer.record(
+                Step(
+                    self.agent,
+                    self.run,
+                    self.branch,
+                    step,
+                    action,
+                    timer.next_action,
+                    timer.branches,
+                    start,
+                    wall,
+                    llm,
+                    waited - llm,
+                    max(0.0, wall - waited),
+                    len(state),
+                    spans,
+                )
+            )
+
+
+class NoTrace:
+    """What a run records its steps with when it has no tracer"""
+
+    timer = StepTimer()
+
+    def fork(self, number):
+        return self
+
+    def step(self, action, state):
+        return contextlib.nullcontext(self.timer)
+
+
+no_trace = NoTrace()
+
+
+class TracedIO:
+    """An io (see agent_io.py) whose input and print are timed as waits on the user"""
+
+    def __init__(self, io):
+        self.io = io
+
+    def __getattr__(self, name):
+        return getattr(self.io, name)
+
+    @contextlib.contextmanager
+    def waiting(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer = current_step.get()
+            if timer is not None:
+                timer.add("io", start, time.perf_counter())
+
+    def print(self, *values, **options):
+        with self.waiting():
+            self.io.print(*values, **options)
+
+    def input(self, prompt=""):
+        with self.waiting():
+            return self.io.input(prompt)
+
+    async def aprint(self, *values, **options):
+        with self.waiting():
+            await self.io.aprint(*values, **options)
+
+    async def ainput(self, prompt=""):
+        with self.waiting():
+            return await self.io.ainput(prompt)
+
+
+def transition_loops(actions):
+    """Each time a run comes back to an action, the actions since it was last
+    there; going round the same loop again, from any of its actions, counts once
+    more for the loop"""
+
+    last_seen = {}
+    loops = []
+    for position, action in enumerate(actions):
+        if action in last_seen:
+            loops.append(tuple(actions[last_seen[action] : position + 1]))
+            # the loop is closed, so its actions start a new one
+            last_seen = {}
+        last_seen[action] = position
+    return loops
+
+
+def loop_key(loop):
+    # the same for every rotation of a loop
+    actions = loop[:-1]
+    return min(actions[position:] + actions[:position] for position in range(len(actions)))
+
+
+class Tracer:
+    """The steps of every run traced with it, from any thread"""
+
+    def __init__(self):
+        self.steps = []
+        self.runs = itertools.count()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def start_run(self, agent):
+        return RunTrace(self, agent, next(self.runs))
+
+    def record(self, step):
+        with self.lock:
+            self.steps.append(step)
+
+    def chrome_trace(self):
+        """The steps as Chrome trace events: one process per agent, one thread
+        per run or branch, and the AI calls and waits on the user inside them"""
+
+        with self.lock:
+            steps = list(self.steps)
+
+        def microseconds(seconds):
+            return round((seconds - self.origin) * 1e6, 3)
+
+        processes = {}
+        threads = {}
+        events = []
+        for step in steps:
+            if step.agent not in processes:
+                processes[step.agent] = len(processes) + 1
+                events.append(
+                    {
+                        "name": "process_name",
+                        "ph": "M",
+                        "pid": processes[step.agent],
+                        "args": {"name": str(step.agent)},
+                    }
+                )
+            pid = processes[step.agent]
+
+            thread = (step.agent, step.run, step.branch)
+            if thread not in threads:
+                threads[thread] = len(threads) + 1
+                name = f"run {step.run}" + (f" branch {step.branch}" if step.branch else "")
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": threads[thread],
+                        "args": {"name": name},
+                    }
+                )
+            tid = threads[thread]
+
+            events.append(
+                {
+                    "name": step.action,
+                    "cat": "action",
+                    "ph": "X",
+                    "ts": microseconds(step.start),
+                    "dur": round(step.wall * 1e6, 3),
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {
+                        "step": step.step,
+                        "next_action": step.next_action,
+                        "branches": step.branches,
+                        "llm_s": step.llm,
+                        "io_s": step.io,
+                        "compute_s": step.compute,
+                        "state_keys": step.state_keys,
+                    },
+                }
+            )
+            for kind, start, end in step.spans:
+                events.append(
+                    {
+                        "name": kind,
+                        "cat": kind,
+                        "ph": "X",
+                        "ts": microseconds(start),
+                        "dur": round((end - start) * 1e6, 3),
+                        "pid": pid,
+                        "tid": tid,
+                    }
+                )
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.chrome_trace(), file)
+
+    def report(self, loops=5):
+        """For each agent, the calls and p50/p95 seconds of each action with its
+        time split into AI calls, waiting on the user and compute, and its most
+        frequent loops of actions"""
+
+        with self.lock:
+            steps = list(self.steps)
+
+        lines = []
+        for agent in dict.fromkeys(step.agent for step in steps):
+            agent_steps = [step for step in steps if step.agent == agent]
+            runs = {}
+            for step in sorted(agent_steps, key=lambda step: step.step):
+                # loops are followed along each run and each branch
+                runs.setdefault((step.run, step.branch), []).append(step.action)
+
+            number_of_runs = len({run for run, _branch in runs})
+            lines.append(f"{agent}: {number_of_runs} runs, {len(agent_steps)} steps")
+            lines.append(
+                f"  {'action':<28} {'calls':>6} {'p50 s':>7} {'p95 s':>7} "
+                f"{'llm %':>6} {'io %':>6} {'compute %':>9}"
+            )
+
+            by_action = {}
+            for step in agent_steps:
+                by_action.setdefault(step.action, []).append(step)
+            for action, action_steps in sorted(
+                by_action.items(), key=lambda item: -sum(step.wall for step in item[1])
+            ):
+                walls = [step.wall for step in action_steps]
+                total = sum(walls) or 1.0
+                lines.append(
+                    f"  {action:<28} {len(action_steps):>6} {percentile(walls, 50):>7.3f} "
+                    f"{percentile(walls, 95):>7.3f} "
+                    f"{100 * sum(step.llm for step in action_steps) / total:>6.1f} "
+                    f"{100 * sum(step.io for step in action_steps) / total:>6.1f} "
+                    f"{100 * sum(step.compute for step in action_steps) / total:>9.1f}"
+                )
+
+            counts = Counter()
+            first_seen = {}  # each loop as it first went round
+            for actions in runs.values():
+                for loop in transition_loops(actions):
+                    counts[loop_key(loop)] += 1
+                    first_seen.setdefault(loop_key(loop), loop)
+            if counts:
+                lines.append("  most frequent loops:")
+                for key, count in counts.most_common(loops):
+                    lines.append(f"  {count:>6} x {' -> '.join(first_seen[key])}")
+            lines.append("")
+
+        return "\n".join(lines)
@@ -1,27 +1,132 @@
+import asyncio
 import json
 import os
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
 
-from openai import NOT_GIVEN
+from ai_cache import cache_key, default_cache
+from ai_hedge import HedgePolicy, hedged
+from ai_telemetry import measure
+from ai_rate_limit import (
+    MAX_RETRIES,
+    RATE_LIMIT_RPM,
+    RATE_LIMIT_TPM,
+    RateLimiter,
+    estimate_tokens,
+    with_retries,
+)
 from env import API_KEY
 
-API_TYPE = "azure"
+# openai and httpx are only imported once a request is made: importing them takes
+# longer than the rest of a demo's startup, and the client is built on first use
+
+# "azure", "openai", or "mock" for a local stand-in (see ai_mock.py), at
+# AI_MOCK_URL if set, or else started in this process
+API_TYPE = os.environ.get("AI_BACKEND", "azure")
 API_KEY = os.environ.get("OPENAI_API_KEY", API_KEY)
 BASE_URL = "https://ol-ai-assistant-prod.openai.azure.com/openai/deployments/gpt-4o-testing/chat/completions?api-version=2024-08-01-preview"
 MODEL = "gpt-4o-testing"
 
-if API_TYPE == "azure":
-    from openai import AzureOpenAI
+mock_server = None
+
+# None until the first request builds it, see get_client
+client = None
+
+
+def azure_api_version():
     from urllib.parse import urlparse, parse_qs
 
-    version = parse_qs(urlparse(BASE_URL).query)["api-version"][0]
-    client = AzureOpenAI(api_key=API_KEY, base_url=BASE_URL, api_version=version)
-else:
+    return parse_qs(urlparse(BASE_URL).query)["api-version"][0]
+
+
+def build_client():
+    if API_TYPE == "azure":
+        from openai import AzureOpenAI
+
+        return AzureOpenAI(api_key=API_KEY, base_url=BASE_URL, api_version=azure_api_version())
+
     from openai import OpenAI
 
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+    return OpenAI(api_key=API_KEY, base_url=BASE_URL)
+
+
+def get_client():
+    global client
+    if client is None:
+        client = build_client()
+    return client
+
+
+def use_backend(api_type, base_url=None, **mock_options):
+    """Send requests to another backend from now on; "mock" starts a local
+    ai_mock server with mock_options unless given the base_url of one"""
+
+    global API_TYPE, API_KEY, BASE_URL, MODEL, client, mock_server
+
+    if api_type == "mock":
+        if base_url is None:
+            import ai_mock
+
+            mock_server = ai_mock.start_server(**mock_options)
+            base_url = mock_server.url
+        API_KEY = "mock"
+        # so mock responses are never cached as real ones
+        MODEL = "mock"
+
+    API_TYPE = api_type
+    if base_url is not None:
+        BASE_URL = base_url
+    client = None
+    async_clients.clear()
+
+
+# the async client shares one pool of HTTP connections between all the requests
+# made on an event loop, and at most MAX_CONCURRENT_REQUESTS are in flight at once
+MAX_CONNECTIONS = int(os.environ.get("AI_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("AI_MAX_KEEPALIVE_CONNECTIONS", 20))
+KEEPALIVE_EXPIRY = 30.0
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("AI_MAX_CONCURRENT_REQUESTS", 16))
+
+# an httpx connection pool and an asyncio semaphore belong to the event loop they
+# are first used on, so each loop gets its own client and semaphore
+async_clients = weakref.WeakKeyDictionary()
+
+# hedged requests from synchronous code run on an event loop in its own thread,
+# so that the slower attempt can be cancelled
+background_loop = None
+background_loop_lock = threading.Lock()
+
+# used by request_ai_response(..., hedge=True), see ai_hedge.py
+hedge_policy = HedgePolicy()
+
+if API_TYPE == "mock":
+    use_backend("mock", os.environ.get("AI_MOCK_URL"))
+
+
+# latency of the most recent streamed responses, oldest first
+STREAM_METRICS_SIZE = 1000
+StreamMetrics = namedtuple("StreamMetrics", ["time_to_first_token", "total_time", "cached"])
+stream_metrics = deque(maxlen=STREAM_METRICS_SIZE)
+
+# responses are cached by request, see ai_cache.py; set_response_cache replaces the cache
+response_cache = None
+
 
+def get_response_cache():
+    global response_cache
+    if response_cache is None:
+        response_cache = default_cache()
+    return response_cache
 
-def request_ai_response(user, system=None, response_format=NOT_GIVEN):
+
+def set_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+
+def build_messages(user, system=None):
     messages = []
 
     if system:
@@ -39,6 +144,174 @@ def request_ai_response(user, system=None, response_format=NOT_GIVEN):
         }
     )
 
+    return messages
+
+
+def request_ai_response(user, system=None, response_format=None, stream=False, hedge=False):
+    """The response message, or with stream a ResponseStream of its content
+
+    hedge (True for the shared hedge_policy, or a HedgePolicy) sends a duplicate
+    of a slow request and takes whichever answers first. Only structured
+    responses, the idempotent decisions, can be hedged."""
+
+    messages = build_messages(user, system)
+
+    schema = response_format
+    key = cache_key(messages, MODEL, schema)
+
+    if stream:
+        if schema is not None:
+            raise ValueError("Only free-text responses can be streamed")
+        return ResponseStream(key, messages)
+
+    if hedge and schema is None:
+        raise ValueError("Only structured responses can be hedged")
+
+    with measure(messages, MODEL, schema) as call:
+        if hedge:
+            policy = hedge_policy if hedge is True else hedge
+            send = lambda: run_in_background(
+                hedged(
+                    lambda: acreate_completion(messages, response_format, call=call),
+                    policy,
+                    schema.__name__,
+                )
+            )
+        else:
+            send = lambda: create_completion(messages, response_format, call)
+
+        return get_response_cache().fetch(key, send, schema)
+
+
+class ResponseStream:
+    """A free-text response as it arrives: iterating yields pieces of its content
+
+    Once iterated, message is the whole response, and time_to_first_token and
+    total_time (seconds from the start of iteration) are also in stream_metrics.
+    A cached response arrives as one piece."""
+
+    def __init__(self, key, messages):
+        self.key = key
+        self.messages = messages
+        self.message = None
+        self.time_to_first_token = None
+        self.total_time = None
+        self.cached = False
+
+    def __iter__(self):
+        start = time.perf_counter()
+        cache = get_response_cache()
+
+        with measure(self.messages, MODEL, stream=True) as call:
+            message = cache.cached(self.key)
+            if message is not None:
+                self.cached = True
+                deltas = [message.content]
+            else:
+                deltas = stream_completion(self.messages, call)
+
+            content = []
+            for delta in deltas:
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - start
+                    call.first_token()
+                content.append(delta)
+                yield delta
+
+        self.total_time = time.perf_counter() - start
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.total_time
+        stream_metrics.append(
+            StreamMetrics(self.time_to_first_token, self.total_time, self.cached)
+        )
+
+        from openai.types.chat import ChatCompletionMessage
+
+        self.message = ChatCompletionMessage(role="assistant", content="".join(content))
+        if not self.cached:
+            cache.save(self.key, self.message)
+
+
+def print_stream(stream, io=None):
+    """Print a ResponseStream as it arrives, to io (see agent_io.py) if given,
+    and return its content"""
+
+    output = print if io is None else io.print
+    for delta in stream:
+        output(delta, end="", flush=True)
+    output()
+    return stream.message.content
+
+
+async def arequest_ai_response(
+    user, system=None, response_format=None, rate_limiter=None, max_retries=None
+):
+    """request_ai_response for asyncio: many requests share one connection pool,
+    and wait for a free slot once MAX_CONCURRENT_REQUESTS are in flight
+
+    With max_retries, failed requests are retried by ai_rate_limit.with_retries
+    instead of the client, paced by rate_limiter if given"""
+
+    messages = build_messages(user, system)
+
+    schema = response_format
+    key = cache_key(messages, MODEL, schema)
+
+    with measure(messages, MODEL, schema) as call:
+        if max_retries is None:
+            send = lambda: acreate_completion(messages, response_format, call=call)
+        else:
+            send = lambda: with_retries(
+                lambda: acreate_completion(
+                    messages, response_format, max_retries=0, call=call
+                ),
+                max_retries,
+                rate_limiter,
+                estimate_tokens(messages, schema),
+                on_retry=call.add_retry,
+            )
+
+        return await get_response_cache().afetch(key, send, schema)
+
+
+async def arun_batch(
+    requests,
+    rpm=RATE_LIMIT_RPM,
+    tpm=RATE_LIMIT_TPM,
+    max_retries=MAX_RETRIES,
+    return_exceptions=False,
+):
+    """The responses to many requests, each a dict of request_ai_response's
+    arguments, in the order they were given
+
+    Requests are sent as fast as the RPM and TPM limits allow (by default
+    AI_RATE_LIMIT_RPM and AI_RATE_LIMIT_TPM; None is no limit), and retried on
+    429 and 5xx responses. With return_exceptions, a request that still failed has its
+    exception in place of a response, otherwise the first failure is raised."""
+
+    rate_limiter = RateLimiter(rpm, tpm)
+    return await asyncio.gather(
+        *[
+            arequest_ai_response(**request, rate_limiter=rate_limiter, max_retries=max_retries)
+            for request in requests
+        ],
+        return_exceptions=return_exceptions,
+    )
+
+
+def run_batch(requests, **options):
+    """arun_batch from synchronous code"""
+
+    async def run():
+        try:
+            return await arun_batch(requests, **options)
+        finally:
+            await close_async_client()
+
+    return asyncio.run(run())
+
+
+def create_completion(messages, response_format=None, call=None):
     # print()
     # print("-" * 80)
     # print("DEBUG: Calling AI with")
@@ -49,7 +322,8 @@ def request_ai_response(user, system=None, response_format=NOT_GIVEN):
     # print("-" * 20)
     # print()
 
-    if response_format == NOT_GIVEN:
+    client = get_client()
+    if response_format is None:
         completion = client.chat.completions.create(messages=messages, model=MODEL)
         # print(
         #     "DEBUG: AI response",
@@ -67,4 +341,109 @@ def request_ai_response(user, system=None, response_format=NOT_GIVEN):
     # print("-" * 80)
     # print()
 
+    if call is not None:
+        call.add_usage(completion.usage)
+
+    return completion.choices[0].message
+
+
+def stream_completion(messages, call=None):
+    # the API version in BASE_URL predates usage in Azure streams
+    options = {} if API_TYPE == "azure" else {"stream_options": {"include_usage": True}}
+
+    usage = None
+    with get_client().chat.completions.create(
+        messages=messages, model=MODEL, stream=True, **options
+    ) as chunks:
+        for chunk in chunks:
+            # Azure sends content filter results in chunks without choices, and
+            # usage comes in a last chunk without choices
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    if call is not None:
+        call.add_usage(usage)
+
+
+def build_async_client():
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+    )
+
+    if API_TYPE == "azure":
+        from openai import AsyncAzureOpenAI
+
+        return AsyncAzureOpenAI(
+            api_key=API_KEY,
+            base_url=BASE_URL,
+            api_version=azure_api_version(),
+            http_client=http_client,
+        )
+
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, http_client=http_client)
+
+
+def get_async_client():
+    """The async client and concurrency limit of the running event loop"""
+
+    loop = asyncio.get_running_loop()
+    if loop not in async_clients:
+        async_clients[loop] = (
+            build_async_client(),
+            asyncio.Semaphore(MAX_CONCURRENT_REQUESTS),
+        )
+    return async_clients[loop]
+
+
+def run_in_background(coroutine):
+    """Run a coroutine on the background event loop, and wait for its result"""
+
+    global background_loop
+    with background_loop_lock:
+        if background_loop is None:
+            background_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=background_loop.run_forever, name="ai-background-loop", daemon=True
+            ).start()
+
+    return asyncio.run_coroutine_threadsafe(coroutine, background_loop).result()
+
+
+async def close_async_client():
+    # closes the pooled connections of the running event loop
+    entry = async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].close()
+
+
+async def acreate_completion(messages, response_format=None, max_retries=None, call=None):
+    async_client, semaphore = get_async_client()
+    if max_retries is not None:
+        # shares the connection pool
+        async_client = async_client.with_options(max_retries=max_retries)
+
+    async with semaphore:
+        if response_format is None:
+            completion = await async_client.chat.completions.create(
+                messages=messages, model=MODEL
+            )
+        else:
+            completion = await async_client.beta.chat.completions.parse(
+                messages=messages, model=MODEL, response_format=response_format
+            )
+
+    if call is not None:
+        call.add_usage(completion.usage)
+
     return completion.choices[0].message
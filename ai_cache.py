@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+
+# Content-addressed cache of AI responses, used by ai.request_ai_response
+#
+# A response is keyed by a hash of everything that determines it: the messages,
+# the model and the JSON schema of the response format. Responses are kept in an
+# in-memory LRU in front of a SQLite store, which has a time to live and a size
+# limit, and which survives between runs.
+#
+# Caching is opt-in: a cached free-text response would be the same for every
+# session sending the same prompt, and the stores keep the conversations on disk.
+#
+# Modes (AI_CACHE_MODE):
+#   "off"    - always call the API, store nothing (the default)
+#   "use"    - return cached responses, call the API and store the response on a miss
+#   "record" - always call the API, and store the response (replacing any cached one)
+#   "replay" - only return cached responses; a miss raises CacheMiss, so a recorded
+#              run can be re-executed offline, and any change in its prompts is caught
+
+MODES = ["off", "use", "record", "replay"]
+
+CACHE_MODE = os.environ.get("AI_CACHE_MODE", "off")
+CACHE_PATH = os.environ.get(
+    "AI_CACHE_PATH", os.path.join(os.path.dirname(__file__), ".ai_cache", "responses.sqlite")
+)
+MEMORY_ENTRIES = 256
+TTL_SECONDS = 7 * 24 * 60 * 60  # None keeps responses until they are evicted for size
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class CacheMiss(Exception):
+    pass
+
+
+@cache
+def response_schema(response_format):
+    # generating a schema is slower than the rest of a memory hit
+    return response_format.model_json_schema() if response_format is not None else None
+
+
+def cache_key(messages, model, response_format=None):
+    schema = response_schema(response_format)
+    request = {"messages": messages, "model": model, "schema": schema}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def to_entry(message):
+    # the raw content, and the parsed object as JSON for structured responses
+    parsed = getattr(message, "parsed", None)
+    return {
+        "content": message.content,
+        "refusal": message.refusal,
+        "parsed": parsed.model_dump(mode="json") if parsed is not None else None,
+    }
+
+
+def from_entry(entry, response_format=None):
+    # rebuild the message the API would have returned, with its parsed object
+    from openai.types.chat import ChatCompletionMessage, ParsedChatCompletionMessage
+
+    if response_format is None:
+        return ChatCompletionMessage(
+            role="assistant", content=entry["content"], refusal=entry["refusal"]
+        )
+
+    parsed = entry["parsed"]
+    return ParsedChatCompletionMessage[response_format](
+        role="assistant",
+        content=entry["content"],
+        refusal=entry["refusal"],
+        parsed=response_format.model_validate(parsed) if parsed is not None else None,
+    )
+
+
+class MemoryCache:
+    def __init__(self, max_entries=MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """Responses on disk, expired after ttl seconds and evicted least recently used
+    first once the stored entries exceed max_bytes"""
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL_SECONDS, max_bytes=MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, entry TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT entry, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            entry, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(entry)
+
+    def set(self, key, entry):
+        now = time.time()
+        entry = json.dumps(entry)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, entry, len(entry), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self.connection.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+            )
+
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        # drop the least recently used entries until the rest fit
+        excess = total - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def close(self):
+        self.connection.close()
+
+
+class ResponseCache:
+    """The caches consulted in order (fastest first), and the mode they are used in"""
+
+    def __init__(self, stores, mode=CACHE_MODE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {MODES}")
+        self.stores = stores
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        for position, store in enumerate(self.stores):
+            entry = store.get(key)
+            if entry is not None:
+                # faster stores in front of the one that had it are filled in
+                for faster_store in self.stores[:position]:
+                    faster_store.set(key, entry)
+                return entry
+        return None
+
+    def store(self, key, entry):
+        for store in self.stores:
+            store.set(key, entry)
+
+    def cached(self, key, response_format=None):
+        """The cached response for key if the mode allows one, else None"""
+
+        if self.mode not in ["use", "replay"]:
+            return None
+
+        entry = self.lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return from_entry(entry, response_format)
+
+        self.misses += 1
+        if self.mode == "replay":
+            raise CacheMiss(f"No recorded response for request {key}")
+        return None
+
+    def save(self, key, message):
+        # a new response from the API
+        if self.mode != "off":
+            self.store(key, to_entry(message))
+
+    def fetch(self, key, call, response_format=None):
+        """The cached response for key, or call() for a new one, according to the mode"""
+
+        message = self.cached(key, response_format)
+        if message is None:
+            message = call()
+            self.save(key, message)
+        return message
+
+    async def afetch(self, key, call, response_format=None):
+        """fetch, where call() returns an awaitable"""
+
+        message = self.cached(key, response_format)
+        if message is None:
+            message = await call()
+            self.save(key, message)
+        return message
+
+
+def default_cache(mode=CACHE_MODE, path=CACHE_PATH):
+    if mode == "off":
+        return ResponseCache([], mode)
+    return ResponseCache([MemoryCache(), SQLiteCache(path)], mode)
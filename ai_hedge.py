@@ -0,0 +1,125 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+# Hedged requests, used by ai.request_ai_response(..., hedge=...)
+#
+# A few completions take many times the median. A hedged request waits for its
+# first attempt up to a high percentile of recent latencies of the same kind of
+# request, then sends a duplicate, takes whichever finishes first and cancels
+# the rest. As only slow requests are hedged, a small extra spend removes much of
+# the tail. Only idempotent requests may be hedged, as a duplicate may well be
+# answered too.
+
+PERCENTILE = 95
+INITIAL_DELAY = 2.0  # seconds, until there are enough latencies to go by
+MIN_SAMPLES = 20
+MIN_DELAY = 0.05
+WINDOW = 500  # recent latencies kept per kind of request
+MAX_HEDGES = 1  # duplicates per call
+# duplicates in all, as a fraction of calls, plus a few to start with
+MAX_HEDGE_FRACTION = 0.1
+HEDGE_BURST = 5
+
+
+def percentile(values, percent):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))]
+
+
+class HedgePolicy:
+    """When to send a duplicate request, and how many may be sent"""
+
+    def __init__(
+        self,
+        percentile=PERCENTILE,
+        initial_delay=INITIAL_DELAY,
+        min_delay=MIN_DELAY,
+        max_hedges=MAX_HEDGES,
+        max_hedge_fraction=MAX_HEDGE_FRACTION,
+    ):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.max_hedge_fraction = max_hedge_fraction
+
+        self.latencies = {}
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def delay(self, kind):
+        with self.lock:
+            latencies = self.latencies.get(kind)
+            if latencies is None or len(latencies) < MIN_SAMPLES:
+                return self.initial_delay
+            return max(self.min_delay, percentile(latencies, self.percentile))
+
+    def record(self, kind, latency):
+        with self.lock:
+            self.latencies.setdefault(kind, deque(maxlen=WINDOW)).append(latency)
+
+    def start_call(self):
+        with self.lock:
+            self.calls += 1
+
+    def take_hedge(self):
+        # the budget across calls: hedges are refused once they would be more
+        # than max_hedge_fraction of the calls made
+        with self.lock:
+            if self.hedges >= self.max_hedge_fraction * self.calls + HEDGE_BURST:
+                return False
+            self.hedges += 1
+            return True
+
+
+async def hedged(call, policy, kind):
+    """await call(), sending duplicates of it by the policy, and return the first
+    attempt to succeed; raises the first error if every attempt fails"""
+
+    policy.start_call()
+    delay = policy.delay(kind)
+
+    starts = {}
+
+    def attempt():
+        task = asyncio.ensure_future(call())
+        starts[task] = time.perf_counter()
+        return task
+
+    pending = {attempt()}
+    errors = []
+    hedges = 0
+    try:
+        while pending:
+            may_hedge = hedges < policy.max_hedges
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if may_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            for task in done:
+                if task.exception() is None:
+                    policy.record(kind, time.perf_counter() - starts[task])
+                    return task.result()
+                errors.append(task.exception())
+
+            if not done:
+                # the wait timed out; once the budget is spent, stop hedging
+                hedges += 1
+                if policy.take_hedge():
+                    pending.add(attempt())
+                else:
+                    hedges = policy.max_hedges
+
+        raise errors[0]
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the chat completions API, selected with AI_BACKEND=mock
+#
+# It answers every request deterministically: the same messages and seed always
+# get the same response. Structured requests get a response that is valid for
+# the JSON schema of their response format, and free-text requests get a few
+# sentences of filler. A script of rules can give specific responses to the
+# requests that match them, so an agent can be steered through its actions.
+#
+# Each response waits for a latency drawn from a configurable distribution, and
+# streamed responses send a word at a time.
+#
+# Run on its own, e.g. for load tests from other processes:
+#   python -m ai_mock --port 8000 --latency lognormal:0.5,0.4
+
+SEED = os.environ.get("AI_MOCK_SEED", "0")
+LATENCY = os.environ.get("AI_MOCK_LATENCY", "fixed:0")
+TOKEN_INTERVAL = float(os.environ.get("AI_MOCK_TOKEN_INTERVAL", 0))
+SCRIPT_PATH = os.environ.get("AI_MOCK_SCRIPT")
+
+MAX_ITEMS = 3
+WORDS = (
+    "alice rabbit queen hatter garden tea party door key bottle cake march hare "
+    "cat grin court tarts caterpillar mushroom pool tears croquet flamingo duchess "
+    "pepper baby turtle gryphon lobster quadrille trial jury king cards dream"
+).split()
+
+
+class Latency:
+    """A latency distribution, from a spec such as "lognormal:0.5,0.4"
+
+    fixed:SECONDS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA, optionally with a
+    slow tail, e.g. "fixed:0.1+tail:0.05,5,10" makes 5% of responses 5-10x slower"""
+
+    def __init__(self, spec, seed=SEED):
+        distribution, _, tail = spec.partition("+tail:")
+        self.kind, _, parameters = distribution.partition(":")
+        self.parameters = [float(parameter) for parameter in parameters.split(",")]
+        self.tail = [float(parameter) for parameter in tail.split(",")] if tail else None
+
+        if self.kind not in ["fixed", "uniform", "lognormal"]:
+            raise ValueError(f"Unknown latency distribution {self.kind!r}")
+
+        self.random_state = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self):
+        with self.lock:
+            if self.kind == "fixed":
+                latency = self.parameters[0]
+            elif self.kind == "uniform":
+                latency = self.random_state.uniform(*self.parameters)
+            else:
+                median, sigma = self.parameters
+                latency = median * self.random_state.lognormvariate(0, sigma)
+
+            if self.tail is not None:
+                fraction, low, high = self.tail
+                if self.random_state.random() < fraction:
+                    latency *= self.random_state.uniform(low, high)
+
+        return latency
+
+
+def load_script(path):
+    """Rules from a JSON file: a list of {"match", "response_format", "content"}
+
+    A rule applies to a request whose last message matches the regex "match" (if
+    given), and whose response format has the name "response_format" (if given).
+    The first rule that applies gives the content: a string, or for a structured
+    request the object to respond with."""
+
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def request_seed(seed, request):
+    # the same request gets the same response, whichever order requests arrive in
+    content = json.dumps([seed, request["messages"], request.get("response_format")])
+    return hashlib.sha256(content.encode("utf-8")).digest()
+
+
+def resolve(schema, root):
+    while "$ref" in schema:
+        node = root
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            node = node[part]
+        schema = node
+    return schema
+
+
+def generate(schema, random_state, root=None):
+    """A value that is valid for a JSON schema, as generated for strict
+    structured outputs from a pydantic model"""
+
+    root = schema if root is None else root
+    schema = resolve(schema, root)
+
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return random_state.choice(schema["enum"])
+    for combination in ["anyOf", "oneOf"]:
+        if combination in schema:
+            return generate(random_state.choice(schema[combination]), random_state, root)
+    if "allOf" in schema:
+        return generate(schema["allOf"][0], random_state, root)
+
+    kind = schema.get("type", "string")
+    if isinstance(kind, list):
+        kind = random_state.choice(kind)
+
+    if kind == "object":
+        return {
+            name: generate(property_schema, random_state, root)
+            for name, property_schema in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        low = schema.get("minItems", 1)
+        high = max(low, schema.get("maxItems", MAX_ITEMS))
+        return [
+            generate(schema.get("items", {}), random_state, root)
+            for _ in range(random_state.randint(low, high))
+        ]
+    if kind == "integer":
+        return random_state.randint(schema.get("minimum", 1), schema.get("maximum", 100))
+    if kind == "number":
+        return random_state.uniform(schema.get("minimum", 0), schema.get("maximum", 100))
+    if kind == "boolean":
+        return random_state.random() < 0.5
+    if kind == "null":
+        return None
+    return sentence(random_state, 3, 8)
+
+
+def sentence(random_state, low, high):
+    words = [random_state.choice(WORDS) for _ in range(random_state.randint(low, high))]
+    return " ".join(words).capitalize()
+
+
+def respond(request, seed=SEED, script=()):
+    """The content of the response to a chat completions request"""
+
+    response_format = request.get("response_format")
+    json_schema = (response_format or {}).get("json_schema")
+    last_message = request["messages"][-1]["content"]
+
+    for rule in script:
+        if "match" in rule and not re.search(rule["match"], last_message):
+            continue
+        if "response_format" in rule and (
+            json_schema is None or rule["response_format"] != json_schema["name"]
+        ):
+            continue
+        content = rule["content"]
+        return content if isinstance(content, str) else json.dumps(content)
+
+    random_state = random.Random(request_seed(seed, request))
+    if json_schema is not None:
+        return json.dumps(generate(json_schema["schema"], random_state))
+    return " ".join(sentence(random_state, 6, 14) + "." for _ in range(3))
+
+
+def count_usage(request, content):
+    # roughly four characters to a token
+    prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+    completion_tokens = len(content) // 4 + 1
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, port=0, seed=SEED, latency=LATENCY, token_interval=TOKEN_INTERVAL, script=None
+    ):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.seed = seed
+        self.latency = Latency(latency, seed) if isinstance(latency, str) else latency
+        self.token_interval = token_interval
+        self.script = script if script is not None else []
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def handle_error(self, request, client_address):
+        # clients hang up on requests they no longer need, e.g. hedged ones
+        pass
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        content = respond(request, server.seed, server.script)
+        time.sleep(server.latency.sample())
+
+        completion = {
+            "id": "mock",
+            "created": int(time.time()),
+            "model": request["model"],
+        }
+        usage = count_usage(request, content)
+
+        if not request.get("stream"):
+            completion["object"] = "chat.completion"
+            completion["choices"] = [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ]
+            completion["usage"] = usage
+            body = json.dumps(completion).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion["object"] = "chat.completion.chunk"
+        words = re.findall(r"\S+\s*", content)
+        for number, word in enumerate(words):
+            if number and server.token_interval:
+                time.sleep(server.token_interval)
+            self.send_chunk(completion, {"content": word})
+        self.send_chunk(completion, {}, "stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            completion["choices"] = []
+            completion["usage"] = usage
+            self.send_data(f"data: {json.dumps(completion)}\n\n".encode("utf-8"))
+        self.send_data(b"data: [DONE]\n\n")
+        self.send_data(b"")
+
+    def send_chunk(self, completion, delta, finish_reason=None):
+        completion["choices"] = [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        self.send_data(f"data: {json.dumps(completion)}\n\n".encode("utf-8"))
+
+    def send_data(self, data):
+        # one chunk of a chunked transfer
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(**options):
+    """A MockServer answering in a background thread"""
+
+    if "script" not in options and SCRIPT_PATH:
+        options["script"] = load_script(SCRIPT_PATH)
+
+    server = MockServer(**options)
+    threading.Thread(target=server.serve_forever, name="ai-mock", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="A local mock chat completions API")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--seed", default=SEED)
+    parser.add_argument("--latency", default=LATENCY)
+    parser.add_argument("--token-interval", type=float, default=TOKEN_INTERVAL)
+    parser.add_argument("--script", default=SCRIPT_PATH)
+    arguments = parser.parse_args()
+
+    server = MockServer(
+        port=arguments.port,
+        seed=arguments.seed,
+        latency=arguments.latency,
+        token_interval=arguments.token_interval,
+        script=load_script(arguments.script) if arguments.script else None,
+    )
+    print(f"Mock chat completions API at {server.url}")
+    server.serve_forever()
@@ -0,0 +1,174 @@
+import asyncio
+import email.utils
+import json
+import os
+import random
+import time
+
+from ai_cache import response_schema
+
+# Pacing and retries for AI requests, used by ai.arun_batch
+#
+# An Azure deployment has a requests per minute (RPM) and a tokens per minute
+# (TPM) limit, and answers 429 once either is exceeded. A RateLimiter holds a
+# token bucket for each and makes every request wait until both have room for
+# it, judged by an estimate of its tokens made before it is sent. 429 and 5xx
+# responses are retried after a jittered exponential backoff, or after the
+# Retry-After the server asked for, which also pauses every other request.
+
+RATE_LIMIT_RPM = os.environ.get("AI_RATE_LIMIT_RPM")  # None is no limit
+RATE_LIMIT_TPM = os.environ.get("AI_RATE_LIMIT_TPM")
+# Azure enforces its per minute limits over windows of a few seconds, so the
+# buckets only let through about a second's worth at once
+BURST_SECONDS = 1.0
+
+# about four characters per token of English text
+CHARACTERS_PER_TOKEN = 4
+MESSAGE_TOKENS = 4  # role and framing of each message
+# TPM counts the tokens a response may use, which are unknown before the call
+RESPONSE_TOKENS_ESTIMATE = 512
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+def estimate_tokens(messages, response_format=None):
+    """Tokens a request will count against the TPM limit, without a tokenizer"""
+
+    characters = sum(len(message["content"]) for message in messages)
+    schema = response_schema(response_format)
+    if schema is not None:
+        characters += len(json.dumps(schema))
+
+    return (
+        characters // CHARACTERS_PER_TOKEN
+        + MESSAGE_TOKENS * len(messages)
+        + RESPONSE_TOKENS_ESTIMATE
+    )
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        # a request larger than the bucket waits for a full bucket
+        self.refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, amount):
+        # all of it, so a request larger than the bucket leaves it in debt, which
+        # the next request waits off
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """Paces requests under an RPM and a TPM limit, in the order they arrive"""
+
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM):
+        self.requests = TokenBucket(float(rpm)) if rpm is not None else None
+        self.tokens = TokenBucket(float(tpm)) if tpm is not None else None
+        self.resume_at = 0.0
+        # asyncio.Lock wakes waiters first come, first served
+        self.lock = asyncio.Lock()
+
+    def wait_time(self, tokens, now):
+        wait = self.resume_at - now
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    async def acquire(self, tokens):
+        async with self.lock:
+            while (wait := self.wait_time(tokens, time.monotonic())) > 0:
+                await asyncio.sleep(wait)
+
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+
+    def pause(self, seconds):
+        # the server asked for no requests until then
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+def is_retryable(error):
+    import openai
+
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+def retry_after(error):
+    """Seconds the server asked to wait before retrying, if it said"""
+
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    milliseconds = response.headers.get("retry-after-ms")
+    if milliseconds is not None:
+        try:
+            return max(0.0, float(milliseconds) / 1000)
+        except ValueError:
+            pass
+
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    # or an HTTP date
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, wait=None):
+    # "full jitter": a random delay up to an exponentially growing cap, so
+    # requests that failed together do not all retry together
+    if wait is not None:
+        return wait + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+async def with_retries(
+    call, max_retries=MAX_RETRIES, rate_limiter=None, tokens=0, on_retry=None
+):
+    """await call(), paced by rate_limiter, retrying 429, 5xx and connection errors;
+    on_retry() is called before each retry"""
+
+    import openai
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            await rate_limiter.acquire(tokens)
+
+        try:
+            return await call()
+        except openai.APIError as error:
+            if attempt == max_retries or not is_retryable(error):
+                raise
+
+            wait = retry_after(error)
+            if wait is not None and rate_limiter is not None:
+                rate_limiter.pause(wait)
+            await asyncio.sleep(backoff_delay(attempt, wait))
+            if on_retry is not None:
+                on_retry()
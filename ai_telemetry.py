@@ -0,0 +1,331 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Telemetry of AI requests: one CallRecord per request_ai_response call, sent
+# to every sink in sinks
+#
+# Records say which agent action made the call (set by Agent.run), what it cost
+# in tokens and how long it took, so the actions that dominate cost and latency
+# stand out. Sinks are anything with a record(call_record) method:
+#   JsonlSink          - appends each record to a JSON lines trace file
+#   Aggregator         - counts, token totals and latency percentiles per action
+#   PrometheusExporter - an Aggregator that renders the Prometheus text format
+#
+# AI_TELEMETRY_JSONL adds a JsonlSink writing to that path.
+
+CallRecord = namedtuple(
+    "CallRecord",
+    [
+        "time",  # when the call started, seconds since the epoch
+        "agent",
+        "action",
+        "model",
+        "schema",  # name of the response format, None for free text
+        "stream",
+        "cached",  # answered from the response cache, without a request
+        "prompt_bytes",
+        "prompt_tokens",  # None when the API did not report usage, e.g. streamed
+        "completion_tokens",
+        "cached_tokens",  # prompt tokens the API served from its prompt cache
+        "latency",
+        "time_to_first_token",  # streamed responses only
+        "retries",
+        "error",  # the exception's class name if the call failed
+    ],
+)
+
+# (agent, action) of the agent action running in this context
+current_action = contextvars.ContextVar("current_action", default=(None, None))
+# the StepTimer of the agent step running in this context, when it is traced
+# (see agent_trace.py), which is given the span of each call
+current_step = contextvars.ContextVar("current_step", default=None)
+# the Spending of the agent run in this context, when it has a budget (see
+# agent_budget.py), which counts each call's requests and tokens
+current_spending = contextvars.ContextVar("current_spending", default=None)
+
+sinks = []
+
+JSONL_PATH = os.environ.get("AI_TELEMETRY_JSONL")
+
+
+def add_sink(sink):
+    sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    sinks.remove(sink)
+
+
+@contextlib.contextmanager
+def action(agent, name):
+    """Calls made inside are attributed to this agent action"""
+
+    token = current_action.set((agent, name))
+    try:
+        yield
+    finally:
+        current_action.reset(token)
+
+
+class Call:
+    """A call being measured; the API functions add their usage to it"""
+
+    def __init__(self, model, schema, prompt_bytes, stream):
+        self.agent, self.action = current_action.get()
+        self.model = model
+        self.schema = schema
+        self.prompt_bytes = prompt_bytes
+        self.stream = stream
+        self.requests = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.cached_tokens = None
+        self.time_to_first_token = None
+        self.retries = 0
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+
+    def add_usage(self, usage):
+        # every completed request, including both of a hedged pair if both finish
+        self.requests += 1
+        if usage is None:
+            return
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        self.prompt_tokens = (self.prompt_tokens or 0) + usage.prompt_tokens
+        self.completion_tokens = (self.completion_tokens or 0) + usage.completion_tokens
+        self.cached_tokens = (self.cached_tokens or 0) + cached_tokens
+
+    def add_retry(self):
+        self.retries += 1
+
+    def first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.start
+
+    def finish(self, error=None):
+        end = time.perf_counter()
+        timer = current_step.get()
+        if timer is not None:
+            timer.add("llm", self.start, end)
+        spending = current_spending.get()
+        if spending is not None:
+            spending.add_call(self)
+        if not sinks:
+            return
+
+        call_record = CallRecord(
+            time=self.start_time,
+            agent=self.agent,
+            action=self.action,
+            model=self.model,
+            schema=self.schema,
+            stream=self.stream,
+            cached=self.requests == 0 and error is None,
+            prompt_bytes=self.prompt_bytes,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            cached_tokens=self.cached_tokens,
+            latency=end - self.start,
+            time_to_first_token=self.time_to_first_token,
+            retries=self.retries,
+            error=type(error).__name__ if error is not None else None,
+        )
+        for sink in sinks:
+            sink.record(call_record)
+
+
+@contextlib.contextmanager
+def measure(messages, model, schema=None, stream=False):
+    """A Call for the block, recorded when it ends"""
+
+    prompt_bytes = sum(len(message["content"].encode("utf-8")) for message in messages)
+    call = Call(model, schema.__name__ if schema is not None else None, prompt_bytes, stream)
+    try:
+        yield call
+    except BaseException as error:
+        call.finish(error)
+        raise
+    call.finish()
+
+
+class JsonlSink:
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+        self.lock = threading.Lock()
+
+    def record(self, call_record):
+        line = json.dumps(call_record._asdict())
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+# latency histogram bucket bounds in seconds: 1 ms to about 10 minutes, each
+# 25% wider than the last, so a percentile is within 25% of the true value
+LATENCY_BUCKETS = [0.001 * 1.25**i for i in range(60)]
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last counts values above every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percent):
+        # the upper bound of the bucket the percentile falls in
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Totals:
+    def __init__(self):
+        self.calls = 0
+        self.cached = 0
+        self.errors = 0
+        self.retries = 0
+        self.prompt_bytes = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latency = Histogram()
+
+    def add(self, call_record):
+        self.calls += 1
+        self.cached += call_record.cached
+        self.errors += call_record.error is not None
+        self.retries += call_record.retries
+        self.prompt_bytes += call_record.prompt_bytes
+        self.prompt_tokens += call_record.prompt_tokens or 0
+        self.completion_tokens += call_record.completion_tokens or 0
+        self.cached_tokens += call_record.cached_tokens or 0
+        self.latency.add(call_record.latency)
+
+
+class Aggregator:
+    """Totals and a latency histogram for each agent, action, model and schema"""
+
+    LABELS = ["agent", "action", "model", "schema"]
+
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def record(self, call_record):
+        key = tuple(getattr(call_record, label) for label in self.LABELS)
+        with self.lock:
+            if key not in self.totals:
+                self.totals[key] = Totals()
+            self.totals[key].add(call_record)
+
+    def report(self):
+        """A table of the actions, most total time first"""
+
+        with self.lock:
+            rows = sorted(self.totals.items(), key=lambda item: -item[1].latency.sum)
+            lines = [
+                f"{'agent':<22} {'action':<26} {'calls':>6} {'cached':>6} {'p50 s':>7} "
+                f"{'p99 s':>7} {'total s':>8} {'prompt tok':>10} {'compl tok':>9}"
+            ]
+            for (agent, action, _model, _schema), totals in rows:
+                lines.append(
+                    f"{str(agent):<22} {str(action):<26} {totals.calls:>6} {totals.cached:>6} "
+                    f"{totals.latency.percentile(50):>7.3f} {totals.latency.percentile(99):>7.3f} "
+                    f"{totals.latency.sum:>8.2f} {totals.prompt_tokens:>10} "
+                    f"{totals.completion_tokens:>9}"
+                )
+        return "\n".join(lines)
+
+
+def _labels(names, values, extra=""):
+    pairs = [
+        f'{name}="{escape(str(value)) if value is not None else ""}"'
+        for name, value in zip(names, values)
+    ]
+    return "{" + ",".join(pairs + ([extra] if extra else [])) + "}"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class PrometheusExporter(Aggregator):
+    """An Aggregator rendered in the Prometheus text exposition format, e.g. for
+    node_exporter's textfile collector"""
+
+    COUNTERS = [
+        ("ai_calls_total", "calls", "AI calls"),
+        ("ai_cached_calls_total", "cached", "AI calls answered from the response cache"),
+        ("ai_errors_total", "errors", "AI calls that failed"),
+        ("ai_retries_total", "retries", "Retried AI requests"),
+        ("ai_prompt_bytes_total", "prompt_bytes", "UTF-8 bytes of prompts"),
+        ("ai_prompt_tokens_total", "prompt_tokens", "Prompt tokens used"),
+        ("ai_completion_tokens_total", "completion_tokens", "Completion tokens used"),
+        ("ai_cached_tokens_total", "cached_tokens", "Prompt tokens served from the prompt cache"),
+    ]
+
+    def render(self):
+        lines = []
+        with self.lock:
+            totals = list(self.totals.items())
+
+            for metric, attribute, description in self.COUNTERS:
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} counter")
+                for key, key_totals in totals:
+                    lines.append(
+                        f"{metric}{_labels(self.LABELS, key)} {getattr(key_totals, attribute)}"
+                    )
+
+            metric = "ai_call_latency_seconds"
+            lines.append(f"# HELP {metric} Latency of AI calls")
+            lines.append(f"# TYPE {metric} histogram")
+            for key, key_totals in totals:
+                histogram = key_totals.latency
+                seen = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    seen += count
+                    labels = _labels(self.LABELS, key, f'le="{bound:.6g}"')
+                    lines.append(f"{metric}_bucket{labels} {seen}")
+                labels = _labels(self.LABELS, key, 'le="+Inf"')
+                lines.append(f"{metric}_bucket{labels} {histogram.count}")
+                lines.append(f"{metric}_sum{_labels(self.LABELS, key)} {histogram.sum}")
+                lines.append(f"{metric}_count{_labels(self.LABELS, key)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # replaced atomically, so a scrape never sees half a file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temporary_path, path)
+
+
+if JSONL_PATH:
+    add_sink(JsonlSink(JSONL_PATH))
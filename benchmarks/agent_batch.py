@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+
+import ai_mock
+from agent_batch import report, run_sessions
+from agent_io import load_scripts
+
+# Scripted sessions of the book questions demo, run in bulk by agent_batch with
+# more and more processes, against one mock backend they all share
+#
+# The script is written as JSON lines and read back with load_scripts. Every
+# session with the same questions must print the same transcript.
+#
+# Run from the repository root:
+#   python -m benchmarks.agent_batch
+
+MODULE = "demos.simple_rag.agent"
+SESSIONS = 96
+QUESTIONS = [
+    "Who is the Cheshire Cat?",
+    "Why is the Hatter mad?",
+    "What does Alice drink?",
+    "Who stole the tarts?",
+]
+TURNS = 2
+LATENCY = "fixed:0.1"
+PROCESSES = [1, 2, 4]
+
+
+def write_script(path):
+    with open(path, "w", encoding="utf-8") as file:
+        # turn by turn, as the users would give them
+        for turn in range(TURNS):
+            for session in range(SESSIONS):
+                question = QUESTIONS[(session + turn) % len(QUESTIONS)]
+                file.write(json.dumps({"session": f"user-{session}", "input": question}) + "\n")
+
+
+def main():
+    server = ai_mock.start_server(latency=LATENCY)
+    # read by ai.py in each worker process
+    os.environ["AI_BACKEND"] = "mock"
+    os.environ["AI_MOCK_URL"] = server.url
+    os.environ["AI_CACHE_MODE"] = "off"
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.jsonl")
+        write_script(path)
+        scripts = load_scripts(path)
+
+    for processes in PROCESSES:
+        results, seconds = run_sessions(MODULE, scripts, processes)
+        print(f"processes: {processes}")
+        print(report(results, seconds))
+        print()
+
+        assert all(result.error is None for result in results)
+        transcripts = {}
+        for result in results:
+            turns = tuple(scripts[result.session])
+            assert transcripts.setdefault(turns, result.transcript) == result.transcript
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import time
+
+import ai
+import ai_telemetry
+from agent import Agent
+from agent_trace import Tracer
+from ai_cache import ResponseCache
+from benchmarks.mock_demos import LATENCY, PLANNER_SCRIPT, QUESTIONING_SCRIPT, demo_runs, run_demo
+
+# Traces of the three demos run end to end against the mock backend, and the
+# cost of tracing a step
+#
+# The report shows where each demo's time went, action by action, and the
+# Chrome trace must have an event for every step and every AI call. Every AI
+# call made must have its span in the step that made it. The overhead is timed
+# on an agent whose actions do nothing.
+#
+# Run from the repository root:
+#   python -m benchmarks.agent_trace
+
+RUNS = 3
+OVERHEAD_STEPS = 100000
+
+
+def overhead_agent():
+    agent = Agent(name="overhead")
+
+    @agent.add_action
+    def start(state, steps):
+        state["steps"] = steps
+        return "step", None
+
+    @agent.add_action
+    def step(state, _input):
+        state["steps"] -= 1
+        return ("step" if state["steps"] else "end"), None
+
+    return agent
+
+
+def step_time(agent, tracer):
+    start = time.perf_counter()
+    agent.run(OVERHEAD_STEPS, tracer=tracer)
+    return (time.perf_counter() - start) / OVERHEAD_STEPS
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY, script=PLANNER_SCRIPT + QUESTIONING_SCRIPT)
+    ai.set_response_cache(ResponseCache([], "off"))
+    calls = ai_telemetry.add_sink(ai_telemetry.Aggregator())
+
+    tracer = Tracer()
+    for _name, agent, user in demo_runs():
+        for _ in range(RUNS):
+            user_io = user()
+            # the same run as run_demo, traced
+            run_demo(TracedAgent(agent, tracer), user_io)
+
+    print(tracer.report())
+
+    steps = tracer.steps
+    spans = [span for step in steps for span in step.spans]
+    assert sum(kind == "llm" for kind, _start, _end in spans) == sum(
+        totals.calls for totals in calls.totals.values()
+    )
+    for step in steps:
+        assert step.llm + step.io + step.compute <= step.wall + 1e-6
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.json")
+        tracer.write_chrome_trace(path)
+        with open(path, encoding="utf-8") as file:
+            events = json.load(file)["traceEvents"]
+        assert sum(event["ph"] == "X" for event in events) == len(steps) + len(spans)
+        print(f"chrome trace: {len(events)} events, {os.path.getsize(path) / 1024:.0f} KiB")
+
+    agent = overhead_agent()
+    untraced = step_time(agent, None)
+    traced = step_time(agent, Tracer())
+    print(
+        f"overhead: {untraced * 1e6:.1f} us per step untraced, {traced * 1e6:.1f} us traced"
+    )
+
+    ai_telemetry.remove_sink(calls)
+    ai.mock_server.shutdown()
+
+
+class TracedAgent:
+    # an agent whose runs are traced by tracer
+    def __init__(self, agent, tracer):
+        self.agent = agent
+        self.tracer = tracer
+
+    def run(self, input=None, io=None):
+        return self.agent.run(input, io=io, tracer=self.tracer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import random
+import threading
+import time
+
+import openai
+from openai import OpenAI
+
+import ai
+import ai_rate_limit
+from ai_cache import ResponseCache
+from benchmarks.async_requests import FakeHandler, FakeServer
+from demos.simple_rag.structured_outputs import Excerpts
+
+# A batch of requests against a local fake API with RPM and TPM limits, sent all
+# at once and retried, against paced by ai.run_batch's token buckets
+#
+# The fake API answers 429 with a Retry-After once a limit is exceeded, and fails
+# a few requests with a 500 at random, so both runs must retry. Responses must
+# come back in the order the requests were given, and when paced, every request
+# must succeed. Requests larger than a bucket holds must be paced to the limit
+# too, checked on a simulated clock.
+#
+# Run from the repository root:
+#   python -m benchmarks.ai_batch
+
+NUM_REQUESTS = 200
+SERVER_RPM = 1200
+SERVER_TPM = 600_000
+FAILURE_RATE = 0.03
+MAX_RETRIES = 10
+LARGE_REQUEST_TPM = 60_000
+LARGE_REQUEST_TOKENS = 3000
+LARGE_REQUESTS = 100
+
+
+class LimitedServer(FakeServer):
+    def __init__(self):
+        super().__init__()
+        self.RequestHandlerClass = LimitedHandler
+        self.random_state = random.Random(0)
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        with self.lock:
+            self.requests = ai_rate_limit.TokenBucket(SERVER_RPM)
+            self.tokens = ai_rate_limit.TokenBucket(SERVER_TPM)
+            self.sent = 0
+            self.rate_limited = 0
+            self.failed = 0
+
+
+class LimitedHandler(FakeHandler):
+    def answer(self, request):
+        characters = sum(len(message["content"]) for message in request["messages"])
+        if "response_format" in request:
+            characters += len(json.dumps(request["response_format"]["json_schema"]["schema"]))
+        tokens = (
+            characters // ai_rate_limit.CHARACTERS_PER_TOKEN
+            + ai_rate_limit.MESSAGE_TOKENS * len(request["messages"])
+            + ai_rate_limit.RESPONSE_TOKENS_ESTIMATE
+        )
+
+        server = self.server
+        with server.lock:
+            server.sent += 1
+            now = time.monotonic()
+            wait = max(server.requests.wait_time(1, now), server.tokens.wait_time(tokens, now))
+            if wait <= 0:
+                server.requests.take(1)
+                server.tokens.take(tokens)
+            else:
+                server.rate_limited += 1
+            fail = wait <= 0 and server.random_state.random() < FAILURE_RATE
+            if fail:
+                server.failed += 1
+
+        if wait > 0:
+            self.send_error_response(429, {"retry-after-ms": str(int(wait * 1000) + 1)})
+        elif fail:
+            self.send_error_response(500, {})
+        else:
+            super().answer(request)
+
+    def send_error_response(self, status, headers):
+        body = json.dumps({"error": {"message": "fake error", "code": str(status)}}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def paced_tokens_per_minute(tpm, tokens, requests):
+    # the rate a TPM bucket lets requests through at, one after another
+    bucket = ai_rate_limit.TokenBucket(tpm)
+    bucket.updated = now = 0.0
+    for _ in range(requests):
+        now += bucket.wait_time(tokens, now)
+        bucket.take(tokens)
+    return tokens * requests / now * 60
+
+
+def main():
+    server = LimitedServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ai.API_TYPE = "openai"
+    ai.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    # the async client is built from these too, and an empty key is an invalid header
+    ai.API_KEY = "fake"
+    ai.client = OpenAI(api_key=ai.API_KEY, base_url=ai.BASE_URL)
+    ai.MAX_CONCURRENT_REQUESTS = 64
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    requests = [
+        {"user": f"question {number}", "response_format": Excerpts} if number % 2
+        else {"user": f"question {number}"}
+        for number in range(NUM_REQUESTS)
+    ]
+
+    print(f"{'run':>8} {'seconds':>8} {'sent':>6} {'429s':>6} {'500s':>6} {'failed':>7}")
+
+    for name, rpm, tpm in [("unpaced", None, None), ("paced", SERVER_RPM, SERVER_TPM)]:
+        server.reset()
+        start = time.perf_counter()
+        responses = ai.run_batch(
+            requests, rpm=rpm, tpm=tpm, max_retries=MAX_RETRIES, return_exceptions=True
+        )
+        seconds = time.perf_counter() - start
+        failed = sum(isinstance(message, Exception) for message in responses)
+
+        print(
+            f"{name:>8} {seconds:>8.2f} {server.sent:>6} "
+            f"{server.rate_limited:>6} {server.failed:>6} {failed:>7}"
+        )
+
+        if rpm is not None:
+            assert failed == 0
+        for number, message in enumerate(responses):
+            if isinstance(message, Exception):
+                assert isinstance(message, openai.APIStatusError)
+            elif number % 2:
+                assert message.parsed == Excerpts(excerpts=[f"An excerpt about question {number}"])
+            else:
+                assert message.content == f"An answer to question {number}"
+
+    server.shutdown()
+
+    paced = paced_tokens_per_minute(LARGE_REQUEST_TPM, LARGE_REQUEST_TOKENS, LARGE_REQUESTS)
+    print(
+        f"{LARGE_REQUEST_TOKENS}-token requests paced at {paced:.0f} TPM "
+        f"against a {LARGE_REQUEST_TPM} TPM limit"
+    )
+    # over the limit only by the bucket's first second, spread over the requests
+    assert paced <= LARGE_REQUEST_TPM * 1.02
+
+
+if __name__ == "__main__":
+    main()
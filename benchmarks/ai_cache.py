@@ -0,0 +1,88 @@
+import os
+import tempfile
+import time
+
+from openai.types.chat import ParsedChatCompletionMessage
+
+import ai
+from ai_cache import CacheMiss, MemoryCache, ResponseCache, SQLiteCache
+from demos.simple_rag.structured_outputs import Excerpts
+
+# Record an "agent run" of AI requests against a slow fake API, then replay it
+# from the response cache, from memory and from SQLite
+#
+# The fake API stands in for Azure OpenAI, so this runs offline. Replayed
+# responses must equal the recorded ones, parsed objects included, and a request
+# that was never recorded must fail in replay mode.
+#
+# Run from the repository root:
+#   python -m benchmarks.ai_cache
+
+API_LATENCY = 0.05
+NUM_PROMPTS = 20
+RUN_REPEATS = 3  # each prompt is asked this many times per run, as agents re-ask
+
+
+def fake_completion(messages, response_format, call=None):
+    time.sleep(API_LATENCY)
+    question = messages[-1]["content"]
+    excerpts = Excerpts(excerpts=[f"An excerpt about {question}", "Another excerpt"])
+    return ParsedChatCompletionMessage[Excerpts](
+        role="assistant", content=excerpts.model_dump_json(), parsed=excerpts
+    )
+
+
+def run(prompts):
+    start = time.perf_counter()
+    responses = [
+        ai.request_ai_response(user=prompt, system="system", response_format=Excerpts)
+        for prompt in prompts
+    ]
+    return time.perf_counter() - start, responses
+
+
+def main():
+    ai.create_completion = fake_completion
+    prompts = [f"question {number}" for number in range(NUM_PROMPTS)] * RUN_REPEATS
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "responses.sqlite")
+
+        print(f"{'run':>24} {'seconds':>8} {'ms/request':>11}")
+
+        def report(name, seconds):
+            print(f"{name:>24} {seconds:>8.3f} {seconds / len(prompts) * 1000:>11.3f}")
+
+        ai.set_response_cache(ResponseCache([], "off"))
+        seconds, _ = run(prompts)
+        report("no cache", seconds)
+
+        ai.set_response_cache(ResponseCache([MemoryCache(), SQLiteCache(path)], "record"))
+        seconds, recorded = run(prompts)
+        report("record", seconds)
+
+        ai.set_response_cache(ResponseCache([MemoryCache(), SQLiteCache(path)], "use"))
+        seconds, _ = run(prompts)
+        report("use (cold memory)", seconds)
+
+        seconds, _ = run(prompts)
+        report("use (warm memory)", seconds)
+
+        ai.set_response_cache(ResponseCache([SQLiteCache(path)], "replay"))
+        seconds, replayed = run(prompts)
+        report("replay (SQLite only)", seconds)
+
+        for recorded_message, replayed_message in zip(recorded, replayed):
+            assert replayed_message.content == recorded_message.content
+            assert replayed_message.parsed == recorded_message.parsed
+
+        try:
+            run(["a question that was never asked"])
+        except CacheMiss:
+            pass
+        else:
+            raise AssertionError("replay mode answered a request that was never recorded")
+
+
+if __name__ == "__main__":
+    main()
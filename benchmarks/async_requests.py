@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+import ai
+from ai_cache import ResponseCache
+from demos.simple_rag.structured_outputs import Excerpts
+
+# Throughput of blocking requests one after another against concurrent
+# arequest_ai_response calls, through a local fake chat completions server
+#
+# The server answers every request after API_LATENCY seconds, and counts the
+# connections opened and the most requests it had in flight at once: the
+# concurrency limit must hold, and the pool must reuse its connections rather
+# than open one per request (above MAX_KEEPALIVE_CONNECTIONS, the pool closes
+# some idle connections and opens new ones).
+#
+# Run from the repository root:
+#   python -m benchmarks.async_requests
+
+API_LATENCY = 0.05
+NUM_REQUESTS = 200
+CONCURRENCY_LIMITS = [1, 4, 16, 64]
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.max_in_flight = 0
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.answer(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+
+    def answer(self, request):
+        question = request["messages"][-1]["content"]
+
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(self.latency())
+        with self.server.lock:
+            self.server.in_flight -= 1
+
+        if "response_format" in request:
+            content = Excerpts(excerpts=[f"An excerpt about {question}"]).model_dump_json()
+        else:
+            content = f"An answer to {question}"
+
+        body = json.dumps(
+            {
+                "id": "fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+            }
+        ).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def latency(self):
+        return API_LATENCY
+
+    def log_message(self, *args):
+        pass
+
+
+def request_kwargs(number):
+    # alternate the plain and structured output paths
+    if number % 2:
+        return {"user": f"question {number}", "response_format": Excerpts}
+    return {"user": f"question {number}"}
+
+
+async def run_async(limit):
+    ai.MAX_CONCURRENT_REQUESTS = limit
+    try:
+        return await asyncio.gather(
+            *[ai.arequest_ai_response(**request_kwargs(number)) for number in range(NUM_REQUESTS)]
+        )
+    finally:
+        await ai.close_async_client()
+
+
+def check(responses):
+    for number, message in enumerate(responses):
+        if number % 2:
+            assert message.parsed == Excerpts(excerpts=[f"An excerpt about question {number}"])
+        else:
+            assert message.content == f"An answer to question {number}"
+
+
+def main():
+    server = FakeServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ai.API_TYPE = "openai"
+    ai.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    # the async client is built from these too, and an empty key is an invalid header
+    ai.API_KEY = "fake"
+    ai.client = OpenAI(api_key=ai.API_KEY, base_url=ai.BASE_URL)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    print(f"{'client':>14} {'limit':>6} {'req/s':>7} {'in flight':>10} {'connections':>12}")
+
+    def report(name, limit, seconds):
+        print(
+            f"{name:>14} {limit:>6} {NUM_REQUESTS / seconds:>7.0f} "
+            f"{server.max_in_flight:>10} {server.connections:>12}"
+        )
+
+    server.reset()
+    start = time.perf_counter()
+    responses = [ai.request_ai_response(**request_kwargs(number)) for number in range(NUM_REQUESTS)]
+    report("sync", 1, time.perf_counter() - start)
+    check(responses)
+
+    for limit in CONCURRENCY_LIMITS:
+        server.reset()
+        start = time.perf_counter()
+        responses = asyncio.run(run_async(limit))
+        report("async", limit, time.perf_counter() - start)
+        check(responses)
+
+        assert server.max_in_flight <= limit
+        if limit <= ai.MAX_KEEPALIVE_CONNECTIONS:
+            # every connection stays in the pool between requests
+            assert server.connections <= limit
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from demos.simple_rag.index import build_index
+from demos.simple_rag.search import (
+    BM25_PARAMETERS,
+    BOOK_PATH,
+    get_scores,
+    read_books,
+    tokenize,
+)
+
+# Compare rank_bm25's get_scores with the inverted-index scorer as the corpus grows
+#
+# The corpus is Alice in Wonderland repeated, which keeps the vocabulary fixed
+# while the postings grow linearly. The query is a long fabricated-excerpts
+# query like the ones the RAG agent sends.
+#
+# Run from the repository root:
+#   python -m benchmarks.bm25_scoring
+
+REPLICAS = [1, 4, 16, 64]
+REPEATS = 20
+
+QUERY = "\n".join(
+    [
+        "Oh dear! Oh dear! I shall be late!",
+        "The White Rabbit took a watch out of its waistcoat-pocket, and looked at it, and then hurried on.",
+        "Alice started to her feet, for it flashed across her mind that she had never before seen a rabbit with either a waistcoat-pocket, or a watch to take out of it.",
+        "Burning with curiosity, she ran across the field after it, and fortunately was just in time to see it pop down a large rabbit-hole under the hedge.",
+        "The Queen turned crimson with fury, and screamed 'Off with her head! Off with her head!'",
+        "'Curiouser and curiouser!' cried Alice.",
+    ]
+)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function(*args)
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+def main():
+    paragraphs = list(read_books([BOOK_PATH]))
+    tokenized_corpus = [tokens for _, tokens in paragraphs]
+    tokenized_query = tokenize(QUERY)
+
+    print(f"Query terms: {len(tokenized_query)}")
+    print(
+        f"{'docs':>8} {'postings':>10} {'rank_bm25 ms':>14} {'index ms':>10} {'speedup':>8} {'max diff':>10}"
+    )
+
+    for replicas in REPLICAS:
+        bm25 = BM25Okapi(tokenized_corpus * replicas, **BM25_PARAMETERS)
+        index = build_index(
+            None, [BOOK_PATH], paragraphs * replicas, **BM25_PARAMETERS
+        )
+
+        baseline_time, expected = timed(bm25.get_scores, tokenized_query)
+        index_time, scores = timed(get_scores, index, tokenized_query)
+
+        assert np.allclose(expected, scores, rtol=1e-12, atol=0)
+
+        print(
+            f"{index.num_docs:>8} {len(index.postings_docs):>10} {baseline_time * 1000:>14.2f} "
+            f"{index_time * 1000:>10.3f} {baseline_time / index_time:>7.0f}x "
+            f"{np.abs(expected - scores).max():>10.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+
+import ai
+from agent import Agent
+from agent_branches import BRANCH_WORKERS, MergeConflict, fork, merge_changes
+from ai_cache import ResponseCache
+from demos.function_planner.structured_outputs import ConsolidatedInformation, MenuDecision, Venue
+
+# Wall-clock time of an agent run making three independent structured requests,
+# one after another and as branches of a fork, against the mock backend
+#
+# Every branch appends to the same list in the state, merged with the "extend"
+# rule, so the forked runs must end with the same state as the serial one. A fork
+# with more branches than Agent.run has threads for, each forking again, must
+# finish too. Branches that agree on a key must merge without a rule, and a key
+# one branch removed and another extended must be a MergeConflict.
+#
+# Run from the repository root:
+#   python -m benchmarks.branches
+
+RUNS = 10
+LATENCY = "lognormal:0.2,0.3"
+NESTED_BRANCHES = 4 * BRANCH_WORKERS  # more than Agent.run has threads for
+NESTED_SECONDS = 0.05
+NESTED_TIMEOUT = 30
+DESCRIPTION = "A garden party for 30 people in Oxford on the 4th of July"
+EXTRACTIONS = [("details", ConsolidatedInformation), ("venues", Venue), ("menus", MenuDecision)]
+
+
+def extraction(key, response_format, next_action):
+    def extract(state, description):
+        response = ai.request_ai_response(
+            user=f"Suggest the {key} for this event: {description}",
+            response_format=response_format,
+        )
+        state[key] = response.parsed.model_dump()
+        state["extracted"].append(key)
+        return next_action, description
+
+    extract.__name__ = f"extract_{key}"
+    return extract
+
+
+def build_agent(forked):
+    agent = Agent(name="branches_benchmark")
+
+    @agent.add_action
+    def start(state, description):
+        state["extracted"] = []
+        if forked:
+            return fork(
+                [(f"extract_{key}", description) for key, _format in EXTRACTIONS],
+                join="finish",
+                merge={"extracted": "extend"},
+            )
+        return f"extract_{EXTRACTIONS[0][0]}", description
+
+    for number, (key, response_format) in enumerate(EXTRACTIONS):
+        if forked or number == len(EXTRACTIONS) - 1:
+            next_action = "finish"
+        else:
+            next_action = f"extract_{EXTRACTIONS[number + 1][0]}"
+        agent.add_action(extraction(key, response_format, next_action))
+
+    @agent.add_action
+    def finish(state, _description):
+        state["finished"] = True
+        return "end", None
+
+    return agent
+
+
+def nested_agent():
+    agent = Agent(name="nested_branches")
+
+    @agent.add_action
+    def start(state, _input):
+        state["done"] = []
+        branches = [("outer", number) for number in range(NESTED_BRANCHES)]
+        return fork(branches, join="end", merge={"done": "extend"})
+
+    @agent.add_action
+    def outer(state, number):
+        return fork([("inner", (number, 0)), ("inner", (number, 1))], "joined", {"done": "extend"})
+
+    @agent.add_action
+    def inner(state, branch):
+        time.sleep(NESTED_SECONDS)
+        state["done"].append(branch)
+        return "joined", None
+
+    @agent.add_action
+    def joined(state, _inputs):
+        return "end", None
+
+    return agent
+
+
+def nested_forks():
+    states = []
+    thread = threading.Thread(target=lambda: states.append(nested_agent().run()), daemon=True)
+    thread.start()
+    thread.join(NESTED_TIMEOUT)
+    assert not thread.is_alive(), "nested forks did not finish"
+    expected = [(number, branch) for number in range(NESTED_BRANCHES) for branch in (0, 1)]
+    assert states[0]["done"] == expected
+
+
+def merges():
+    state = {"venue": None, "menus": ["soup"]}
+    merge_changes(state, [{"venue": "garden", "menus": ["soup"]}] * 2, {})
+    assert state == {"venue": "garden", "menus": ["soup"]}
+
+    branches = [{"venue": "garden"}, {"venue": "garden", "menus": ["soup", "cake"]}]
+    try:
+        merge_changes(state, branches, {"menus": "extend"})
+    except MergeConflict:
+        pass
+    else:
+        raise AssertionError("a removed key was extended")
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    serial_agent = build_agent(forked=False)
+    forked_agent = build_agent(forked=True)
+    runs = [
+        ("serial", lambda: serial_agent.run(DESCRIPTION)),
+        ("fork, threads", lambda: forked_agent.run(DESCRIPTION)),
+        ("fork, event loop", lambda: asyncio.run(forked_agent.arun(DESCRIPTION))),
+    ]
+
+    print(f"{'run':>18} {'s/run':>7} {'requests/run':>13}")
+
+    states = {}
+    for name, run in runs:
+        requests = ai.mock_server.requests
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            states[name] = run()
+        seconds = time.perf_counter() - start
+        requests = ai.mock_server.requests - requests
+        print(f"{name:>18} {seconds / RUNS:>7.3f} {requests / RUNS:>13.1f}")
+
+    assert states["serial"]["extracted"] == [key for key, _format in EXTRACTIONS]
+    assert all(state == states["serial"] for state in states.values())
+
+    nested_forks()
+    merges()
+
+    ai.mock_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
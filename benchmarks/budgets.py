@@ -0,0 +1,98 @@
+import time
+
+import ai
+from agent import Agent
+from agent_budget import Budget
+from ai_cache import ResponseCache
+from benchmarks.agent_trace import OVERHEAD_STEPS, overhead_agent
+from benchmarks.mock_demos import PlannerUser
+from demos.function_planner.agent import agent as planner_agent
+
+# Budgets stopping runs that would never end, and what checking them costs
+#
+# Against a mock backend that always has the function planner gather more
+# information, the planner goes round gather_information -> ask_questions ->
+# consolidate_information -> choose_next_step until it runs out of one of its
+# budgets, then stops at its fallback. An agent that goes back and forth without
+# changing its state is stopped as a cycle. The overhead is timed on an agent
+# whose actions do nothing.
+#
+# Run from the repository root:
+#   python -m benchmarks.budgets
+
+RUNS = 3
+LATENCY = "fixed:0.02"
+LOOPING_SCRIPT = [
+    {"response_format": "NextAction", "content": {"next_action": "gather_information"}},
+]
+BUDGETS = [
+    Budget(max_steps=20, fallback="stop_planning"),
+    Budget(max_llm_calls=10, fallback="stop_planning"),
+    Budget(max_tokens=20000, fallback="stop_planning"),
+    Budget(max_seconds=1.0, fallback="stop_planning"),
+]
+
+
+def cycling_agent():
+    # waits for something that never happens
+    agent = Agent(name="cycling")
+
+    @agent.add_action
+    def start(state, _input):
+        state["ready"] = False
+        return "check", None
+
+    @agent.add_action
+    def check(state, _input):
+        return ("end" if state["ready"] else "wait"), None
+
+    @agent.add_action
+    def wait(state, _input):
+        return "check", None
+
+    return agent
+
+
+def step_time(agent, budget):
+    start = time.perf_counter()
+    agent.run(OVERHEAD_STEPS, budget=budget)
+    return (time.perf_counter() - start) / OVERHEAD_STEPS
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY, script=LOOPING_SCRIPT)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    for budget in BUDGETS:
+        for _ in range(RUNS):
+            user = PlannerUser()
+            planner_agent.run(io=user, budget=budget)
+            assert "Stopping the planning after" in user.transcript.getvalue()
+        print(budget.report())
+        print()
+
+        for spending in budget.runs:
+            assert spending.exhausted is not None
+            # the fallback is the one step over the limit
+            assert budget.max_steps is None or spending.steps == budget.max_steps + 1
+
+    budget = Budget(max_repeats=2)
+    state = cycling_agent().run(budget=budget)
+    print(budget.report())
+    print()
+    assert not state["ready"] and budget.runs[0].exhausted.startswith("a cycle")
+
+    agent = overhead_agent()
+    unbudgeted = step_time(agent, None)
+    limits = step_time(agent, Budget(max_steps=OVERHEAD_STEPS * 2, max_repeats=None))
+    cycles = step_time(agent, Budget(max_steps=OVERHEAD_STEPS * 2))
+    print(
+        f"overhead: {unbudgeted * 1e6:.1f} us per step without a budget, "
+        f"{limits * 1e6:.1f} us with limits, {cycles * 1e6:.1f} us also checking for cycles"
+    )
+
+    ai.mock_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import itertools
+import os
+import tempfile
+import time
+
+import ai
+from agent import Agent
+from agent_checkpoint import Checkpoint, FileStore, SQLiteStore
+from agent_io import EndOfScript, ScriptedIO
+from ai_cache import ResponseCache
+from benchmarks.agent_trace import overhead_agent
+from benchmarks.mock_demos import LATENCY, QUESTIONING_SCRIPT
+from demos.effective_questioning.agent import agent as question_agent
+
+# The cost of checkpointing every step of an agent run, and a session resumed
+# from its checkpoint
+#
+# The overhead is timed on an agent whose actions do nothing, and on one whose
+# state keeps a growing history, as a conversation's does, saved as changes and
+# as a snapshot of the whole state every step. The questioning demo, cut short
+# by its user after a few answers and resumed, must end with the state of a run
+# that never stopped, having made fewer AI requests than starting again, and
+# show the user again the question they were answering. A resource kept in the
+# state must come back as the resource itself, and a session whose last record
+# was cut short by a crash must go on saving after it.
+#
+# Run from the repository root:
+#   python -m benchmarks.checkpoint
+
+OVERHEAD_STEPS = 20000
+HISTORY_STEPS = 2000
+HISTORY_ENTRY = "The user said something about their problem, and the agent asked why. " * 3
+ANSWERS_BEFORE_CRASH = 4
+# the questioning demo asks question after question, until it has asked 8
+LONG_QUESTIONING_SCRIPT = QUESTIONING_SCRIPT + [
+    {"response_format": "NextAction", "content": {"next_action": "ask_question"}},
+]
+
+
+def history_agent():
+    agent = Agent(name="history")
+
+    @agent.add_action
+    def start(state, steps):
+        state["steps"] = steps
+        state["history"] = []
+        return "step", None
+
+    @agent.add_action
+    def step(state, _input):
+        state["steps"] -= 1
+        state["history"].append(f"{len(state['history'])}: {HISTORY_ENTRY}")
+        return ("step" if state["steps"] else "end"), None
+
+    return agent
+
+
+class CountedStore:
+    # counts the bytes of every record appended to store, including those
+    # dropped once a snapshot follows them
+    def __init__(self, store):
+        self.store = store
+        self.bytes = 0
+
+    def append(self, session, record, snapshot):
+        self.bytes += len(record)
+        self.store.append(session, record, snapshot)
+
+    def records(self, session):
+        return self.store.records(session)
+
+    def delete(self, session):
+        self.store.delete(session)
+
+
+def step_time(agent, steps, checkpoint):
+    start = time.perf_counter()
+    agent.run(steps, checkpoint=checkpoint)
+    return (time.perf_counter() - start) / steps
+
+
+def overhead():
+    print(f"{'agent':>8} {'store':>8} {'saves':>9} {'us/step':>8} {'bytes/step':>11}")
+    for name, agent, steps in [
+        ("empty", overhead_agent(), OVERHEAD_STEPS),
+        ("history", history_agent(), HISTORY_STEPS),
+    ]:
+        print(f"{name:>8} {'none':>8} {'':>9} {step_time(agent, steps, None) * 1e6:>8.1f}")
+        for store_name, store in [("file", FileStore), ("sqlite", SQLiteStore)]:
+            for saves, snapshot_every in [("changes", 100), ("snapshots", 1)]:
+                with tempfile.TemporaryDirectory() as directory:
+                    if store is FileStore:
+                        opened = FileStore(directory)
+                    else:
+                        opened = SQLiteStore(os.path.join(directory, "checkpoints.sqlite"))
+                    counted = CountedStore(opened)
+                    seconds = step_time(agent, steps, Checkpoint(counted, "session", snapshot_every))
+                    print(
+                        f"{'':>8} {store_name:>8} {saves:>9} {seconds * 1e6:>8.1f} "
+                        f"{counted.bytes / steps:>11.0f}"
+                    )
+
+                    state = agent.resume(Checkpoint(opened, "session"))
+                    assert state == agent.run(steps)
+                    if store is SQLiteStore:
+                        opened.close()
+
+
+def torn_write():
+    # a crash while a record is appended, then a resume that saves more steps
+    agent = history_agent()
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = Checkpoint(FileStore(directory), "session")
+        checkpoint.load(agent)
+        for steps in range(3):
+            checkpoint.save("step", None, {"steps": steps})
+        path = checkpoint.store.path("session")
+        os.truncate(path, os.path.getsize(path) - 5)
+
+        checkpoint = Checkpoint(FileStore(directory), "session")
+        assert checkpoint.load(agent)[2] == {"steps": 1}
+        for steps in range(3, 6):
+            checkpoint.save("step", None, {"steps": steps})
+        assert Checkpoint(FileStore(directory), "session").load(agent)[2] == {"steps": 5}
+
+
+def resource_agent():
+    agent = Agent(name="resources")
+
+    @agent.add_resource
+    def index():
+        return object()
+
+    @agent.add_action
+    def start(state, _input):
+        state["index"] = agent.resource("index")
+        return "wait", None
+
+    @agent.add_action
+    def wait(state, _input):
+        return "end", None
+
+    return agent
+
+
+def resume():
+    ai.use_backend("mock", latency=LATENCY, script=LONG_QUESTIONING_SCRIPT)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    requests = ai.mock_server.requests
+    expected = question_agent.run(io=ScriptedIO(itertools.repeat("I am not sure")))
+    full_requests = ai.mock_server.requests - requests
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = Checkpoint(FileStore(directory), "session")
+
+        requests = ai.mock_server.requests
+        try:
+            question_agent.run(
+                io=ScriptedIO(["I am not sure"] * ANSWERS_BEFORE_CRASH), checkpoint=checkpoint
+            )
+        except EndOfScript:
+            pass
+        before = ai.mock_server.requests - requests
+
+        action_name, question, _state = Checkpoint(FileStore(directory), "session").load(
+            question_agent
+        )
+        requests = ai.mock_server.requests
+        user = ScriptedIO(itertools.repeat("I am not sure"))
+        state = question_agent.resume(Checkpoint(FileStore(directory), "session"), io=user)
+        after = ai.mock_server.requests - requests
+
+    assert len(state["history"]) == 8 and state == expected
+    # cut short while the user answered, the question is asked again
+    assert action_name == "receive_answer" and question
+    assert question in user.transcript.getvalue().split("> ")[0]
+    assert after < full_requests
+    print(
+        f"questioning: {full_requests} requests uninterrupted; cut short after "
+        f"{before}, resumed with {after} more, instead of {full_requests} from the start"
+    )
+
+    ai.mock_server.shutdown()
+
+    agent = resource_agent()
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = Checkpoint(FileStore(directory), "session")
+        agent.run(checkpoint=checkpoint)
+        state = agent.resume(Checkpoint(FileStore(directory), "session"))
+        assert state["index"] is agent.resource("index")
+
+
+def main():
+    overhead()
+    print()
+    resume()
+    torn_write()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import time
+
+from demos.simple_rag.search import FUSIONS, digest_book, search_excerpts
+
+# Offline relevance of the RAG agent's search: one concatenated query, its
+# default, against per-excerpt queries fused into one ranking
+#
+# Each case is a question, the excerpts a model might fabricate for it (loosely
+# remembered, partly made up) and phrases that only occur in the paragraphs that
+# answer it. Recall@n and MRR@n are measured against those paragraphs.
+#
+# Run from the repository root:
+#   python -m benchmarks.excerpt_fusion
+
+N = 5
+REPEATS = 20
+
+CASES = [
+    (
+        "What does the Cheshire Cat say about madness?",
+        [
+            "We're all mad here. I'm mad. You're mad.",
+            "How do you know I'm mad? said Alice. You must be, said the Cat, or you wouldn't have come here.",
+            "The Cat grinned when it saw Alice and asked her which way she wanted to go.",
+        ],
+        ["all mad here"],
+    ),
+    (
+        "What was written on the little bottle Alice found?",
+        [
+            "There was a little bottle on the table with a paper label that said DRINK ME in large letters.",
+            "It was all very well to say drink me, but wise little Alice was not going to do that in a hurry.",
+            "Alice ventured to taste it, and finding it very nice she very soon finished it off.",
+        ],
+        ["DRINK ME"],
+    ),
+    (
+        "What riddle does the Hatter ask at the tea party?",
+        [
+            "Why is a raven like a writing-desk?",
+            "Have you guessed the riddle yet? the Hatter said, turning to Alice again.",
+            "The table was a large one, but the three were all crowded together at one corner of it: No room! No room!",
+        ],
+        ["raven like a writing", "guessed the riddle"],
+    ),
+    (
+        "What does the Queen of Hearts shout when she is angry?",
+        [
+            "Off with her head! the Queen shouted at the top of her voice.",
+            "The Queen had only one way of settling all difficulties, great or small.",
+            "The Queen turned crimson with fury and screamed Off with his head!",
+        ],
+        ["Off with her head", "Off with his head"],
+    ),
+    (
+        "Why are they called lessons, according to the Mock Turtle?",
+        [
+            "That's the reason they're called lessons, because they lessen from day to day.",
+            "How many hours a day did you do lessons? said Alice. Ten hours the first day, said the Mock Turtle.",
+        ],
+        ["lessen from day"],
+    ),
+    (
+        "How does Alice fall down the rabbit hole?",
+        [
+            "Down, down, down. Would the fall never come to an end?",
+            "Either the well was very deep, or she fell very slowly, for she had plenty of time as she went down.",
+            "The rabbit-hole went straight on like a tunnel for some way, and then dipped suddenly down.",
+        ],
+        ["Down, down, down", "rabbit-hole went straight"],
+    ),
+    (
+        "What does the White Rabbit say when Alice first sees him?",
+        [
+            "Oh dear! Oh dear! I shall be late!",
+            "The Rabbit actually took a watch out of its waistcoat-pocket, and looked at it, and then hurried on.",
+        ],
+        ["I shall be late", "waistcoat-pocket"],
+    ),
+    (
+        "What happens to Alice when she eats the cake?",
+        [
+            "She found a very small cake, on which the words EAT ME were beautifully marked in currants.",
+            "Curiouser and curiouser! cried Alice, now I'm opening out like the largest telescope that ever was!",
+        ],
+        ["EAT ME", "Curiouser and curiouser"],
+    ),
+    (
+        "What song do the Gryphon and the Mock Turtle sing about the Lobster Quadrille?",
+        [
+            "Will you walk a little faster? said a whiting to a snail.",
+            "There's a porpoise close behind us, and he's treading on my tail.",
+            "Will you, won't you, will you, won't you, will you join the dance?",
+        ],
+        ["walk a little faster"],
+    ),
+    (
+        "Who is accused of stealing the tarts?",
+        [
+            "The Queen of Hearts, she made some tarts, all on a summer day.",
+            "The Knave of Hearts, he stole those tarts, and took them quite away!",
+            "Herald, read the accusation! said the King.",
+        ],
+        ["stole those tarts"],
+    ),
+    (
+        "What does the King say about how the trial should end?",
+        [
+            "No, no! said the Queen. Sentence first, verdict afterwards.",
+            "Let the jury consider their verdict, the King said, for about the twentieth time that day.",
+            "Stuff and nonsense! said Alice loudly. The idea of having the sentence first!",
+        ],
+        ["Sentence first"],
+    ),
+    (
+        "What does Alice say about the Cat's grin?",
+        [
+            "Well! I've often seen a cat without a grin, thought Alice; but a grin without a cat!",
+            "It vanished quite slowly, beginning with the end of the tail, and ending with the grin.",
+        ],
+        ["grin without a cat"],
+    ),
+    (
+        "How does Alice wake up from her dream?",
+        [
+            "Who cares for you? said Alice. You're nothing but a pack of cards!",
+            "Wake up, Alice dear! said her sister. Why, what a long sleep you've had!",
+        ],
+        ["nothing but a pack of cards", "Wake up, Alice dear"],
+    ),
+    (
+        "What poem does Alice recite to the Caterpillar?",
+        [
+            "You are old, Father William, the young man said, and your hair has become very white.",
+            "Repeat You are old, Father William, said the Caterpillar.",
+            "That is not said right, said the Caterpillar. It is wrong from beginning to end.",
+        ],
+        ["You are old, Father William", "wrong from beginning to end"],
+    ),
+]
+
+
+def relevant_documents(index, phrases):
+    relevant = set()
+    for doc in range(index.num_docs):
+        paragraph = " ".join(index.paragraph(doc).split())
+        if any(phrase in paragraph for phrase in phrases):
+            relevant.add(doc)
+    return relevant
+
+
+def evaluate(rankings, relevant_sets):
+    recall = 0.0
+    reciprocal_rank = 0.0
+    for ranking, relevant in zip(rankings, relevant_sets):
+        docs = [doc for doc, _score in ranking]
+        recall += len(relevant.intersection(docs)) / min(len(relevant), N)
+        reciprocal_rank += next(
+            (1 / rank for rank, doc in enumerate(docs, start=1) if doc in relevant), 0.0
+        )
+    return recall / len(rankings), reciprocal_rank / len(rankings)
+
+
+def main():
+    index = digest_book()
+    relevant_sets = [relevant_documents(index, phrases) for _, _, phrases in CASES]
+    assert all(relevant_sets), "every case needs at least one relevant paragraph"
+
+    methods = {
+        "concatenated": lambda excerpts: search_excerpts(index, excerpts, n=N, fusion=None),
+    }
+    for fusion in FUSIONS:
+        methods[fusion] = lambda excerpts, fusion=fusion: search_excerpts(
+            index, excerpts, n=N, fusion=fusion
+        )
+
+    print(f"{len(CASES)} questions, {index.num_docs} paragraphs, top {N}")
+    print(f"{'method':>13} {'recall':>7} {'mrr':>6} {'ms/question':>12}")
+
+    for name, method in methods.items():
+        rankings = [method(excerpts) for _, excerpts, _ in CASES]
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            for _, excerpts, _ in CASES:
+                method(excerpts)
+        elapsed = (time.perf_counter() - start) / (REPEATS * len(CASES))
+
+        recall, mrr = evaluate(rankings, relevant_sets)
+        print(f"{name:>13} {recall:>7.3f} {mrr:>6.3f} {elapsed * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+from openai import OpenAI
+
+import ai
+from ai_cache import ResponseCache
+from ai_hedge import HedgePolicy, percentile
+from benchmarks.async_requests import FakeHandler, FakeServer
+from demos.simple_rag.structured_outputs import Excerpts
+
+# Tail latency of structured requests with and without hedging, against a local
+# fake API where a few responses take 5-10x the median
+#
+# Each attempt draws its own latency, as a duplicate request to Azure would.
+# Hedged responses must be the same as unhedged ones.
+#
+# Run from the repository root:
+#   python -m benchmarks.hedging
+
+NUM_REQUESTS = 5000
+MEDIAN_LATENCY = 0.01
+SLOW_FRACTION = 0.05
+SLOW_FACTOR = (5, 10)
+
+
+class TailServer(FakeServer):
+    def __init__(self):
+        super().__init__()
+        self.RequestHandlerClass = TailHandler
+        self.random_state = random.Random(0)
+        self.attempts = 0
+
+    def handle_error(self, request, client_address):
+        # the client hung up on an attempt it no longer needed
+        pass
+
+
+class TailHandler(FakeHandler):
+    def latency(self):
+        server = self.server
+        with server.lock:
+            server.attempts += 1
+            latency = server.random_state.lognormvariate(0, 0.3) * MEDIAN_LATENCY
+            if server.random_state.random() < SLOW_FRACTION:
+                latency *= server.random_state.uniform(*SLOW_FACTOR)
+        return latency
+
+
+def main():
+    server = TailServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ai.API_TYPE = "openai"
+    ai.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    # the async client is built from these too, and an empty key is an invalid header
+    ai.API_KEY = "fake"
+    ai.client = OpenAI(api_key=ai.API_KEY, base_url=ai.BASE_URL)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    print(f"{'hedging':>8} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'attempts/call':>14}")
+
+    responses = {}
+    for name, hedge in [("off", False), ("on", HedgePolicy())]:
+        server.attempts = 0
+        latencies = []
+        responses[name] = []
+        for number in range(NUM_REQUESTS):
+            start = time.perf_counter()
+            message = ai.request_ai_response(
+                user=f"question {number}", response_format=Excerpts, hedge=hedge
+            )
+            latencies.append(time.perf_counter() - start)
+            responses[name].append(message.parsed)
+
+        print(
+            f"{name:>8} "
+            + " ".join(f"{percentile(latencies, p) * 1000:>8.1f}" for p in [50, 99, 99.9])
+            + f" {server.attempts / NUM_REQUESTS:>14.3f}"
+        )
+
+    assert responses["on"] == responses["off"]
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import json
+import statistics
+import subprocess
+import sys
+
+# Import time of the entry point, ai.py and each demo's agent, each measured in a
+# fresh interpreter with -X importtime
+#
+# Heavy dependencies must only be imported by what needs them: the demo menu
+# imports none of them, ai.py defers openai and httpx to the first request, and
+# a demo imports only its own. An import of one of them where it does not
+# belong fails the run, so a regression is caught however fast this machine is.
+# The table shows the median milliseconds of RUNS fresh imports, and the
+# slowest modules each imports directly, in milliseconds.
+#
+# Run from the repository root:
+#   python -m benchmarks.import_time
+
+RUNS = 5
+SLOWEST = 3
+HEAVY = ["openai", "httpx", "pydantic", "numpy", "nltk"]
+
+# what is imported, and which heavy dependencies it may import
+TARGETS = [
+    ("main", []),
+    ("ai", []),
+    ("demos.function_planner.agent", ["pydantic"]),
+    ("demos.effective_questioning.agent", ["pydantic"]),
+    ("demos.simple_rag.agent", ["pydantic", "numpy"]),
+    # for comparison, what the first request pays
+    ("openai", ["openai", "httpx", "pydantic"]),
+]
+
+
+def import_once(module):
+    """Microseconds to import module, of each module it imports directly, and
+    the names of every module imported"""
+
+    code = f"import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # "import time: self [us] | cumulative | name", the name indented two more
+    # spaces for each level of nesting, and a module after the ones it imports
+    children = {}
+    for line in result.stderr.splitlines()[1:]:
+        _self, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                return int(cumulative), children, json.loads(result.stdout)
+            children = {}
+
+
+def main():
+    print(f"{'import':>34} {'ms':>7}  slowest imports")
+
+    for module, allowed in TARGETS:
+        totals = []
+        for _ in range(RUNS):
+            total, children, modules = import_once(module)
+            totals.append(total)
+
+        heavy = {name.partition(".")[0] for name in modules} & set(HEAVY)
+        unexpected = sorted(heavy - set(allowed))
+        assert not unexpected, f"import {module} imports {', '.join(unexpected)}"
+
+        slowest = sorted(children.items(), key=lambda item: -item[1])[:SLOWEST]
+        print(
+            f"{module:>34} {statistics.median(totals) / 1000:>7.1f}  "
+            + ", ".join(f"{name} {us / 1000:.0f}" for name, us in slowest)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import random
+import time
+
+from demos.simple_rag.index import build_index
+from demos.simple_rag.ingest import Paragraph, iter_paragraphs
+from demos.simple_rag.search import (
+    BM25_PARAMETERS,
+    BOOK_PATH,
+    get_scores,
+    read_books,
+    search_many,
+    search_maxscore,
+    tokenize_query,
+    top_n,
+)
+
+# Latency of MaxScore top-n against exhaustive scoring, for long queries
+#
+# Each query joins several sentences from the book, like the fabricated excerpts
+# the RAG agent searches with. Both must return exactly the same results, on the
+# book and on random corpora and queries, which reach cases the book does not.
+#
+# Run from the repository root:
+#   python -m benchmarks.maxscore
+
+REPLICAS = [1, 16, 64]
+EXCERPTS_PER_QUERY = [1, 5, 20]
+NUM_QUERIES = 50
+N = 5
+RANDOM_CORPORA = 150
+RANDOM_QUERIES = 30
+RANDOM_VOCABULARY = 1000
+RANDOM_DOCS = 400
+RANDOM_MIN_SCORE = 0.1
+
+
+def random_corpora():
+    # corpora of random words, from skewed to uniform word frequencies, with
+    # short to long documents, and random queries of up to 200 words
+    words = [f"w{number}" for number in range(RANDOM_VOCABULARY)]
+    mismatches = 0
+    for seed in range(RANDOM_CORPORA):
+        random_state = random.Random(seed)
+        skew = random_state.choice([0, 0.5, 1, 1.5])
+        weights = [1 / (rank + 1) ** skew for rank in range(RANDOM_VOCABULARY)]
+        shortest = random_state.choice([3, 10, 50])
+        longest = shortest * random_state.choice([1, 3, 10])
+        paragraphs = [
+            (
+                Paragraph(0, 0, doc, 0, 1),
+                random_state.choices(words, weights, k=random_state.randint(shortest, longest)),
+            )
+            for doc in range(RANDOM_DOCS)
+        ]
+        index = build_index(None, [BOOK_PATH], paragraphs, **BM25_PARAMETERS)
+
+        for _ in range(RANDOM_QUERIES):
+            query_weights = weights if random_state.random() < 0.5 else None
+            query = tuple(
+                random_state.choices(words, query_weights, k=random_state.randint(1, 200))
+            )
+            expected = top_n(get_scores(index, query)[None], N, RANDOM_MIN_SCORE)[0]
+            mismatches += search_maxscore(index, query, N, RANDOM_MIN_SCORE) != expected
+
+    print(
+        f"random corpora: {mismatches} of {RANDOM_CORPORA * RANDOM_QUERIES} queries "
+        "differ from exhaustive scoring"
+    )
+    assert mismatches == 0
+
+
+def main():
+    paragraphs = list(read_books([BOOK_PATH]))
+    corpus = [text for _, text in iter_paragraphs([BOOK_PATH])]
+
+    sentences = [
+        sentence.strip()
+        for paragraph in corpus
+        for sentence in paragraph.replace("\n", " ").split(". ")
+        if len(sentence.split()) > 4
+    ]
+    random_state = random.Random(0)
+
+    print(
+        f"{'docs':>8} {'excerpts':>9} {'terms':>6} {'exhaustive ms':>14} {'maxscore ms':>12} {'speedup':>8}"
+    )
+
+    for replicas in REPLICAS:
+        index = build_index(
+            None, [BOOK_PATH], paragraphs * replicas, **BM25_PARAMETERS
+        )
+
+        for excerpts in EXCERPTS_PER_QUERY:
+            queries = [
+                "\n".join(random_state.sample(sentences, excerpts))
+                for _ in range(NUM_QUERIES)
+            ]
+            tokenized_queries = [tokenize_query(query) for query in queries]
+
+            start = time.perf_counter()
+            expected = [search_many(index, [query], n=N)[0] for query in queries]
+            exhaustive_time = (time.perf_counter() - start) / NUM_QUERIES
+
+            start = time.perf_counter()
+            results = [search_maxscore(index, query, n=N) for query in tokenized_queries]
+            maxscore_time = (time.perf_counter() - start) / NUM_QUERIES
+
+            assert results == expected
+
+            terms = sum(len(query) for query in tokenized_queries) / NUM_QUERIES
+            print(
+                f"{index.num_docs:>8} {excerpts:>9} {terms:>6.0f} {exhaustive_time * 1000:>14.2f} "
+                f"{maxscore_time * 1000:>12.2f} {exhaustive_time / maxscore_time:>7.1f}x"
+            )
+
+    print()
+    random_corpora()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import itertools
+import random
+import time
+
+import ai
+from agent_io import EndOfScript, ScriptedIO
+from ai_cache import ResponseCache
+from demos.effective_questioning.agent import agent as question_agent
+from demos.function_planner.agent import agent as planner_agent
+from demos.simple_rag.agent import agent as book_agent
+
+# End-to-end runs of the three demo agents against the local mock backend
+#
+# The mock answers with schema-valid responses derived from each request, and a
+# script steers the function planner through every step. The user's answers are
+# scripted too. Each demo is run several times: every run must print exactly the
+# same transcript, and the table shows how long a run takes and how many AI
+# requests it makes.
+#
+# Run from the repository root:
+#   python -m benchmarks.mock_demos
+
+RUNS = 5
+LATENCY = "lognormal:0.05,0.5"
+
+# the function planner checks the weather, then picks a venue and a menu from
+# the ones offered, then sends the invitations
+PLANNER_SCRIPT = [
+    {
+        "match": '"weather": null',
+        "response_format": "NextAction",
+        "content": {"next_action": "get_weather"},
+    },
+    {
+        "match": '"venue": null',
+        "response_format": "NextAction",
+        "content": {"next_action": "decide_venue"},
+    },
+    {
+        "match": '"menu": null',
+        "response_format": "NextAction",
+        "content": {"next_action": "decide_menu"},
+    },
+    {
+        "match": "send_invitations",
+        "response_format": "NextAction",
+        "content": {"next_action": "send_invitations"},
+    },
+    {
+        "response_format": "Venue",
+        "content": {"venues": ["The Tea Party", "The Croquet Lawn"], "missing_information": ""},
+    },
+    {
+        "response_format": "MenuDecision",
+        "content": {
+            "menus": [{"appetizer": ["Tarts"], "main_course": ["Mock turtle soup"], "dessert": ["Cake"]}],
+            "missing_information": "",
+        },
+    },
+]
+
+# effective questioning ends by itself, but never after more than 8 questions
+QUESTIONING_SCRIPT = [
+    {
+        "match": r"\b([89]|\d\d+) total questions",
+        "response_format": "NextAction",
+        "content": {"next_action": "end_conversation"},
+    },
+]
+
+
+class PlannerUser(ScriptedIO):
+    def reply(self, prompt):
+        # picks the first venue and menu offered
+        return "1" if "(number)" in prompt else "A birthday party"
+
+
+def run_demo(agent, user):
+    # user is the ScriptedIO standing in for the user
+    # the planner's weather forecast is random
+    random.seed(0)
+    try:
+        agent.run(io=user)
+    except EndOfScript:
+        pass
+    return user.transcript.getvalue()
+
+
+def demo_runs():
+    """(name, agent, user) for each demo, where user() makes a new scripted user"""
+
+    return [
+        ("function planner", planner_agent, PlannerUser),
+        ("questioning", question_agent, lambda: ScriptedIO(itertools.repeat("I am not sure"))),
+        (
+            "book questions",
+            book_agent,
+            lambda: ScriptedIO(["Who is the Cheshire Cat?", "Why is the Hatter mad?"]),
+        ),
+    ]
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY, script=PLANNER_SCRIPT + QUESTIONING_SCRIPT)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    print(f"{'demo':>16} {'s/run':>7} {'requests/run':>13}")
+
+    # each run gets a new user, from user()
+    for name, agent, user in demo_runs():
+        transcripts = []
+        requests = ai.mock_server.requests
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            transcripts.append(run_demo(agent, user()))
+        seconds = time.perf_counter() - start
+        requests = ai.mock_server.requests - requests
+
+        assert all(transcript == transcripts[0] for transcript in transcripts)
+        print(f"{name:>16} {seconds / RUNS:>7.3f} {requests / RUNS:>13.1f}")
+
+    ai.mock_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
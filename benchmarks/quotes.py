@@ -0,0 +1,56 @@
+import random
+import time
+
+from demos.simple_rag.search import digest_book, find_near, find_quote
+
+# Latency of exact-quote and proximity lookups in the positional index
+#
+# Each quote is a run of words cut from a random paragraph of the book, so it
+# must be found in that paragraph, at the span it was cut from.
+#
+# Run from the repository root:
+#   python -m benchmarks.quotes
+
+NUM_QUOTES = 2000
+QUOTE_WORDS = [2, 4, 8, 16]
+
+
+def main():
+    index = digest_book(with_positions=True)
+    positions = index.positions
+    random_state = random.Random(0)
+
+    print(f"{'words':>6} {'phrase us':>10} {'near us':>8} {'matches':>8}")
+
+    for words in QUOTE_WORDS:
+        quotes = []
+        while len(quotes) < NUM_QUOTES:
+            doc = random_state.randrange(index.num_docs)
+            first = int(positions.span_offsets[doc])
+            count = int(positions.span_offsets[doc + 1]) - first
+            if count < words:
+                continue
+            position = random_state.randrange(count - words + 1)
+            start, end = positions.span(doc, position, position + words - 1)
+            quotes.append((doc, start, end, index.paragraph(doc)[start:end]))
+
+        start_time = time.perf_counter()
+        results = [find_quote(index, quote) for _doc, _start, _end, quote in quotes]
+        phrase_time = (time.perf_counter() - start_time) / NUM_QUOTES
+
+        for (doc, start, end, _quote), matches in zip(quotes, results):
+            assert (doc, start, end) in matches
+
+        start_time = time.perf_counter()
+        for _doc, _start, _end, quote in quotes:
+            find_near(index, quote)
+        near_time = (time.perf_counter() - start_time) / NUM_QUOTES
+
+        matches = sum(len(matches) for matches in results) / NUM_QUOTES
+        print(
+            f"{words:>6} {phrase_time * 1e6:>10.0f} {near_time * 1e6:>8.0f} {matches:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
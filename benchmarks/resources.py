@@ -0,0 +1,92 @@
+import asyncio
+import time
+import tracemalloc
+
+import ai
+from agent import Agent
+from agent_io import EndOfScript, ScriptedIO
+from agent_sessions import SessionManager
+from ai_cache import ResponseCache
+from demos.simple_rag.agent import agent as book_agent
+from demos.simple_rag.search import digest_book
+
+# Sessions of the book questions demo, all at once in one process, with the book's
+# index as a resource they share and, as the demo used to, with each session
+# digesting the book in its start action and keeping the index in its state
+#
+# The table gives the time the sessions took and the memory Python allocated for
+# them at the peak, per session (the index's memory-mapped files are not
+# counted). Sharing the resource must build it once, and keep it out of the
+# sessions' state.
+#
+# Run from the repository root:
+#   python -m benchmarks.resources
+
+LATENCY = "fixed:0.05"
+SESSIONS = 200
+QUESTION = "Who is the Cheshire Cat?"
+
+
+def per_session_agent():
+    # the demo with the index digested again by every session
+    agent = Agent(name="simple_rag")
+    agent.actions = dict(book_agent.actions)
+    agent.io_actions = set(book_agent.io_actions)
+    agent.resources = book_agent.resources
+
+    @agent.add_action
+    def start(state, _input, io):
+        io.print("Agent Thoughts: Ingesting Alice in Wonderland")
+        state["search_engine"] = digest_book(with_positions=True)
+        return "ask_question", None
+
+    return agent
+
+
+async def run_sessions(agent):
+    # each session asks one question, and ends when it asks for another
+    users = [ScriptedIO([QUESTION]) for _ in range(SESSIONS)]
+    async with SessionManager(agent) as sessions:
+        for number, user in enumerate(users):
+            sessions.start(number, io=user)
+        results = await sessions.wait()
+    assert all(isinstance(result, EndOfScript) for result in results.values())
+    return [user.transcript.getvalue() for user in users]
+
+
+def measure(agent):
+    tracemalloc.start()
+    start = time.perf_counter()
+    transcripts = asyncio.run(run_sessions(agent))
+    seconds = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return transcripts, seconds, peak
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY)
+    ai.set_response_cache(ResponseCache([], "off"))
+    # the index files are written once, before anything is timed
+    digest_book(with_positions=True)
+
+    resource = book_agent.resources["search_engine"]
+    runs = [("per session", per_session_agent()), ("shared resource", book_agent)]
+
+    print(f"{'index':>16} {'sessions':>9} {'s':>7} {'KiB/session':>12}")
+    transcripts = {}
+    for name, agent in runs:
+        # the other actions look the index up as a resource, built in each run
+        resource.reset()
+        builds = resource.builds
+        transcripts[name], seconds, peak = measure(agent)
+        print(f"{name:>16} {SESSIONS:>9} {seconds:>7.2f} {peak / 1024 / SESSIONS:>12.1f}")
+        assert resource.builds == builds + 1
+    assert transcripts["per session"] == transcripts["shared resource"]
+    assert len(set(transcripts["shared resource"])) == 1
+
+    ai.mock_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import time
+
+from demos.simple_rag.index import build_index
+from demos.simple_rag.ingest import iter_paragraphs
+from demos.simple_rag.search import (
+    BM25_PARAMETERS,
+    BOOK_PATH,
+    get_scores,
+    read_books,
+    search_many,
+    tokenize,
+)
+
+# Query throughput of search_many against one-at-a-time scoring with a full sort
+#
+# Queries are sentences taken from the book itself, so every query has hits.
+#
+# Run from the repository root:
+#   python -m benchmarks.search_many
+
+REPLICAS = [1, 16]
+NUM_QUERIES = 2000
+
+
+def search_one_at_a_time(index, queries, n=5, min_score=0.75):
+    # how search() used to select results: score, sort every document, filter
+    results = []
+    for query in queries:
+        doc_scores = get_scores(index, tokenize(query))
+        top_n_indices = sorted(
+            range(len(doc_scores)), key=lambda i: doc_scores[i], reverse=True
+        )[:n]
+        results.append(
+            [(i, doc_scores[i]) for i in top_n_indices if doc_scores[i] > min_score]
+        )
+    return results
+
+
+def main():
+    paragraphs = list(read_books([BOOK_PATH]))
+    corpus = [text for _, text in iter_paragraphs([BOOK_PATH])]
+
+    sentences = [
+        sentence.strip()
+        for paragraph in corpus
+        for sentence in paragraph.replace("\n", " ").split(". ")
+        if len(sentence.split()) > 4
+    ]
+    queries = (sentences * (NUM_QUERIES // len(sentences) + 1))[:NUM_QUERIES]
+
+    print(f"{'docs':>8} {'loop q/s':>10} {'batched q/s':>12} {'speedup':>8}")
+
+    for replicas in REPLICAS:
+        index = build_index(
+            None, [BOOK_PATH], paragraphs * replicas, **BM25_PARAMETERS
+        )
+
+        start = time.perf_counter()
+        expected = search_one_at_a_time(index, queries)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = search_many(index, queries)
+        batch_time = time.perf_counter() - start
+
+        # ties may be ordered differently, but the scores must agree
+        for expected_top, top in zip(expected, results):
+            assert [round(score, 9) for _, score in expected_top] == [
+                round(score, 9) for _, score in top
+            ]
+
+        print(
+            f"{index.num_docs:>8} {len(queries) / loop_time:>10.0f} "
+            f"{len(queries) / batch_time:>12.0f} {loop_time / batch_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from demos.simple_rag.index import build_index
+from demos.simple_rag.ingest import chapter_bounds, iter_paragraphs, open_source, text_bounds
+from demos.simple_rag.search import (
+    BM25_PARAMETERS,
+    BOOK_PATH,
+    add_books,
+    open_segments,
+    read_books,
+    remove_books,
+    search_many,
+)
+
+# Incremental updates with a segmented index against rebuilding from scratch
+#
+# The corpus is a directory of "books", each made of a different selection of
+# Alice's chapters. Books are added one at a time, some are removed, and the
+# segments are merged; after every step the top n of a set of queries must match
+# an index rebuilt from the books that are left.
+#
+# Run from the repository root:
+#   python -m benchmarks.segments
+
+NUM_BOOKS = 24
+CHAPTERS_PER_BOOK = 6
+NUM_QUERIES = 100
+N = 10
+
+
+def write_books(directory, random_state):
+    buffer = open_source(BOOK_PATH)
+    start, end = text_bounds(buffer)
+    chapters = [bytes(buffer[start:end]) for start, end in chapter_bounds(buffer, start, end)]
+
+    paths = []
+    for book in range(NUM_BOOKS):
+        path = os.path.join(directory, f"book-{book:03d}.txt")
+        with open(path, "wb") as f:
+            f.write(b"\n\n".join(random_state.sample(chapters, CHAPTERS_PER_BOOK)))
+        paths.append(path)
+    return paths
+
+
+def check(snapshot, paths, queries):
+    start = time.perf_counter()
+    rebuilt = build_index(None, paths, read_books(paths), **BM25_PARAMETERS)
+    rebuild_time = time.perf_counter() - start
+
+    expected = search_many(rebuilt, queries, n=N)
+    results = search_many(snapshot, queries, n=N)
+
+    for expected_ranking, ranking in zip(expected, results):
+        assert [rebuilt.source(doc) for doc, _ in expected_ranking] == [
+            snapshot.source(doc) for doc, _ in ranking
+        ]
+        assert [rebuilt.paragraph(doc) for doc, _ in expected_ranking] == [
+            snapshot.paragraph(doc) for doc, _ in ranking
+        ]
+        assert np.allclose(
+            [score for _, score in expected_ranking],
+            [score for _, score in ranking],
+            rtol=1e-12,
+            atol=0,
+        )
+
+    return rebuild_time
+
+
+def main():
+    random_state = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_books(directory, random_state)
+
+        paragraphs = [text for _record, text in iter_paragraphs([BOOK_PATH])]
+        queries = [
+            " ".join(random_state.choice(paragraphs).split()[:12]) for _ in range(NUM_QUERIES)
+        ]
+
+        segments = open_segments(os.path.join(directory, "segments"))
+        live = []
+
+        print(f"{'step':>24} {'segments':>9} {'docs':>6} {'update ms':>10} {'rebuild ms':>11}")
+
+        def report(step, update_time):
+            snapshot = segments.snapshot()
+            rebuild_time = check(snapshot, live, queries)
+            print(
+                f"{step:>24} {len(snapshot.segments):>9} {snapshot.live_docs:>6} "
+                f"{update_time * 1000:>10.1f} {rebuild_time * 1000:>11.1f}"
+            )
+
+        for book, path in enumerate(paths):
+            start = time.perf_counter()
+            add_books(segments, [path])
+            live.append(path)
+            if book % 4 == 3:
+                report(f"add {os.path.basename(path)}", time.perf_counter() - start)
+
+        removed = random_state.sample(live, NUM_BOOKS // 4)
+        start = time.perf_counter()
+        remove_books(segments, removed)
+        live = [path for path in live if path not in removed]
+        report(f"remove {len(removed)} books", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        segments.merge()
+        report("merge all", time.perf_counter() - start)
+
+        segments.close()
+
+
+if __name__ == "__main__":
+    main()
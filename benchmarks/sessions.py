@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import ai
+import agent_io
+from agent import Agent
+from agent_io import QueueIO, TooManySyncInputs
+from agent_sessions import SessionManager
+from ai_cache import ResponseCache
+
+# Many sessions of one agent at once, against the mock backend, in one process
+#
+# In each session a user takes THINK_SECONDS to ask a question about a topic,
+# and the agent asks the API for the answer, keeping both in its state. The
+# coroutine version of the agent waits on the event loop; the same actions
+# written as plain functions hold one of the session manager's threads while
+# they wait; and for comparison, a few sessions run one after another with
+# Agent.run, as one process per user does. Every session must end with its own
+# topic, question and answer. Sessions whose plain function actions wait on
+# their users through QueueIO must, past agent_io.MAX_SYNC_INPUTS of them, fail
+# rather than hold the manager's last thread.
+#
+# Run from the repository root:
+#   python -m benchmarks.sessions
+
+LATENCY = "fixed:0.1"
+THINK_SECONDS = 1.0
+SESSIONS = 2000
+SEQUENTIAL_SESSIONS = 10
+# enough requests in flight for every waiting session
+MAX_CONCURRENT_REQUESTS = 100
+
+
+async_agent = Agent(name="sessions_benchmark")
+sync_agent = Agent(name="sessions_benchmark")
+
+
+@async_agent.add_action
+async def start(state, topic):
+    state["topic"] = topic
+    # the user takes a while to ask
+    await asyncio.sleep(THINK_SECONDS)
+    state["question"] = f"What is there to know about {topic}?"
+    return "answer", None
+
+
+@async_agent.add_action
+async def answer(state, _input):
+    response = await ai.arequest_ai_response(user=state["question"])
+    state["answer"] = response.content
+    return "end", None
+
+
+@sync_agent.add_action
+def start(state, topic):  # noqa: F811
+    state["topic"] = topic
+    time.sleep(THINK_SECONDS)
+    state["question"] = f"What is there to know about {topic}?"
+    return "answer", None
+
+
+@sync_agent.add_action
+def answer(state, _input):  # noqa: F811
+    state["answer"] = ai.request_ai_response(user=state["question"]).content
+    return "end", None
+
+
+input_agent = Agent(name="sessions_benchmark")
+
+
+@input_agent.add_action
+def start(state, _input, io):  # noqa: F811
+    state["question"] = io.input("Your question? ")
+    return "end", None
+
+
+def check(states):
+    for topic, state in states.items():
+        assert state["topic"] == topic and state["question"] and state["answer"]
+
+
+async def run_sessions(agent, topics):
+    async with SessionManager(agent) as sessions:
+        for topic in topics:
+            sessions.start(topic, topic)
+        return await sessions.wait(return_exceptions=False)
+
+
+async def waiting_sessions():
+    # one more session waiting on its user than may wait, then the users reply
+    ios = [QueueIO() for _ in range(agent_io.MAX_SYNC_INPUTS + 1)]
+    async with SessionManager(input_agent) as sessions:
+        for number, io in enumerate(ios):
+            sessions.start(number, io=io)
+        # the others wait for their replies
+        (failed,), _ = await asyncio.wait(
+            sessions.sessions.values(), return_when=asyncio.FIRST_COMPLETED
+        )
+        assert isinstance(failed.exception(), TooManySyncInputs)
+
+        for number, io in enumerate(ios):
+            await io.send(f"question {number}")
+        states = await sessions.wait()
+    assert sum(isinstance(state, TooManySyncInputs) for state in states.values()) == 1
+    for number, state in states.items():
+        assert state == {"question": f"question {number}"} or state is failed.exception()
+    assert QueueIO.sync_inputs == 0
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY)
+    ai.set_response_cache(ResponseCache([], "off"))
+    ai.MAX_CONCURRENT_REQUESTS = MAX_CONCURRENT_REQUESTS
+
+    print(f"{'sessions':>24} {'count':>6} {'s':>7} {'sessions/s':>11}")
+
+    topics = [f"topic {number}" for number in range(SEQUENTIAL_SESSIONS)]
+    start_time = time.perf_counter()
+    check({topic: sync_agent.run(topic) for topic in topics})
+    seconds = time.perf_counter() - start_time
+    print(f"{'one after another':>24} {len(topics):>6} {seconds:>7.2f} {len(topics) / seconds:>11.1f}")
+
+    topics = [f"topic {number}" for number in range(SESSIONS)]
+    for name, agent in [("thread pool", sync_agent), ("coroutines", async_agent)]:
+        start_time = time.perf_counter()
+        check(asyncio.run(run_sessions(agent, topics)))
+        seconds = time.perf_counter() - start_time
+        print(f"{name:>24} {len(topics):>6} {seconds:>7.2f} {len(topics) / seconds:>11.1f}")
+
+    asyncio.run(waiting_sessions())
+
+    ai.mock_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from demos.simple_rag.ingest import iter_paragraphs
+from demos.simple_rag.search import BOOK_PATH, digest_books, search_many
+from demos.simple_rag.shards import ShardedSearch
+
+# Query throughput of one process against the same index split into shards, each
+# searched by its own worker process
+#
+# The corpus is a directory of copies of the book. Sharded results must be exactly
+# those of the unsharded index. Throughput only scales with shards up to the
+# number of cores.
+#
+# Run from the repository root:
+#   python -m benchmarks.shards
+
+COPIES = 64
+SHARDS = [1, 2, 4]
+NUM_QUERIES = 2000
+
+
+def main():
+    print(f"Cores: {os.cpu_count()}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for copy in range(COPIES):
+            path = os.path.join(directory, f"alice-{copy:03d}.txt")
+            shutil.copyfile(BOOK_PATH, path)
+            paths.append(path)
+
+        index = digest_books(paths, os.path.join(directory, "index.bm25"))
+
+        random_state = random.Random(0)
+        paragraphs = [text for _record, text in iter_paragraphs([BOOK_PATH])]
+        queries = [
+            " ".join(random_state.choice(paragraphs).split()[:12]) for _ in range(NUM_QUERIES)
+        ]
+
+        start = time.perf_counter()
+        expected = search_many(index, queries)
+        single_time = time.perf_counter() - start
+
+        print(f"{'docs':>8} {'shards':>7} {'q/s':>8} {'speedup':>8}")
+        print(f"{index.num_docs:>8} {'-':>7} {NUM_QUERIES / single_time:>8.0f} {1:>7.1f}x")
+
+        for num_shards in SHARDS:
+            with ShardedSearch(index, num_shards) as sharded:
+                # the first call starts the workers and maps the shards
+                sharded.search_many(queries[:1])
+
+                start = time.perf_counter()
+                results = sharded.search_many(queries)
+                sharded_time = time.perf_counter() - start
+
+            assert results == expected
+
+            print(
+                f"{index.num_docs:>8} {num_shards:>7} {NUM_QUERIES / sharded_time:>8.0f} "
+                f"{single_time / sharded_time:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
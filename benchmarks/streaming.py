@@ -0,0 +1,147 @@
+import json
+import statistics
+import threading
+import time
+
+from openai import OpenAI
+
+import ai
+from ai_cache import MemoryCache, ResponseCache
+from benchmarks.async_requests import FakeHandler, FakeServer
+
+# Perceived latency of free-text responses: a blocking request shows nothing
+# until the whole completion has arrived, a streamed one shows its first words
+# after the time to first token
+#
+# A local fake API writes its answer one word at a time, after a delay before
+# the first. Streamed content must equal the blocking response, and a cached
+# response must stream back the same content.
+#
+# Run from the repository root:
+#   python -m benchmarks.streaming
+
+FIRST_TOKEN_LATENCY = 0.3
+TOKEN_INTERVAL = 0.01
+ANSWER_WORDS = 150
+NUM_REQUESTS = 10
+
+
+def answer_words(question):
+    return [f"{question}-word-{number} " for number in range(ANSWER_WORDS)]
+
+
+class StreamingHandler(FakeHandler):
+    def answer(self, request):
+        words = answer_words(request["messages"][-1]["content"])
+
+        if not request.get("stream"):
+            time.sleep(FIRST_TOKEN_LATENCY + TOKEN_INTERVAL * len(words))
+            self.send_json(
+                {
+                    "id": "fake",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": request["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": "".join(words)},
+                        }
+                    ],
+                }
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(FIRST_TOKEN_LATENCY)
+        for word in words:
+            self.send_event({"content": word})
+            time.sleep(TOKEN_INTERVAL)
+        self.send_event({}, finish_reason="stop")
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+    def send_json(self, response):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event(self, delta, finish_reason=None):
+        chunk = {
+            "id": "fake",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    server = FakeServer()
+    server.RequestHandlerClass = StreamingHandler
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ai.API_TYPE = "openai"
+    ai.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    ai.client = OpenAI(api_key="fake", base_url=ai.BASE_URL)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    questions = [f"question-{number}" for number in range(NUM_REQUESTS)]
+
+    blocking = []
+    expected = []
+    for question in questions:
+        start = time.perf_counter()
+        expected.append(ai.request_ai_response(user=question).content)
+        blocking.append(time.perf_counter() - start)
+
+    def stream_all():
+        ai.stream_metrics.clear()
+        for question, content in zip(questions, expected):
+            stream = ai.request_ai_response(user=question, stream=True)
+            assert "".join(stream) == content
+            assert stream.message.content == content
+        return list(ai.stream_metrics)
+
+    streamed = stream_all()
+
+    ai.set_response_cache(ResponseCache([MemoryCache()], "use"))
+    stream_all()
+    cached = stream_all()
+    assert all(metrics.cached for metrics in cached)
+
+    print(f"{'requests':>16} {'first words s':>14} {'complete s':>11}")
+
+    def report(name, first, total):
+        print(f"{name:>16} {statistics.median(first):>14.3f} {statistics.median(total):>11.3f}")
+
+    report("blocking", blocking, blocking)
+    report(
+        "streamed",
+        [metrics.time_to_first_token for metrics in streamed],
+        [metrics.total_time for metrics in streamed],
+    )
+    report(
+        "streamed, cached",
+        [metrics.time_to_first_token for metrics in cached],
+        [metrics.total_time for metrics in cached],
+    )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
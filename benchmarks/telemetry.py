@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+
+import ai
+import ai_telemetry
+from ai_cache import MemoryCache, ResponseCache
+from benchmarks.mock_demos import LATENCY, PLANNER_SCRIPT, QUESTIONING_SCRIPT, demo_runs, run_demo
+
+# Telemetry of the three demos run end to end against the mock backend, and the
+# cost of recording it
+#
+# Every call goes to a JSON lines trace, an aggregator and a Prometheus exporter;
+# the aggregator's table shows where the time and tokens went. The overhead is
+# timed on response cache hits, the cheapest calls there are.
+#
+# Run from the repository root:
+#   python -m benchmarks.telemetry
+
+RUNS = 3
+OVERHEAD_CALLS = 20000
+
+
+def cache_hit_time():
+    start = time.perf_counter()
+    for _ in range(OVERHEAD_CALLS):
+        ai.request_ai_response(user="a question asked before")
+    return (time.perf_counter() - start) / OVERHEAD_CALLS
+
+
+def main():
+    ai.use_backend("mock", latency=LATENCY, script=PLANNER_SCRIPT + QUESTIONING_SCRIPT)
+    ai.set_response_cache(ResponseCache([], "off"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        trace_path = os.path.join(directory, "calls.jsonl")
+        metrics_path = os.path.join(directory, "ai.prom")
+
+        trace = ai_telemetry.add_sink(ai_telemetry.JsonlSink(trace_path))
+        exporter = ai_telemetry.add_sink(ai_telemetry.PrometheusExporter())
+
+        requests = ai.mock_server.requests
+        for _name, agent, user in demo_runs():
+            for _ in range(RUNS):
+                run_demo(agent, user())
+        requests = ai.mock_server.requests - requests
+
+        trace.close()
+        exporter.write(metrics_path)
+
+        print(exporter.report())
+        print()
+
+        with open(trace_path, encoding="utf-8") as file:
+            assert sum(1 for _line in file) == requests
+        with open(metrics_path, encoding="utf-8") as file:
+            calls = sum(
+                float(line.split()[-1])
+                for line in file
+                if line.startswith("ai_calls_total{")
+            )
+        assert calls == requests
+
+        ai_telemetry.remove_sink(trace)
+
+        # a free-text call is cached, then asked again and again
+        ai.set_response_cache(ResponseCache([MemoryCache()], "use"))
+        ai.request_ai_response(user="a question asked before")
+
+        with_sinks = cache_hit_time()
+        ai_telemetry.remove_sink(exporter)
+        without_sinks = cache_hit_time()
+
+    print(f"{'sinks':>8} {'us/cache hit':>13}")
+    print(f"{'none':>8} {without_sinks * 1e6:>13.1f}")
+    print(f"{'exporter':>8} {with_sinks * 1e6:>13.1f}")
+
+    ai.mock_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import time
+
+from demos.simple_rag.ingest import iter_paragraphs
+from demos.simple_rag.search import BOOK_PATH, LANGUAGE
+from demos.simple_rag.tokenizer import tokenize, tokenize_many
+
+# Check the fast tokenizer against nltk's word_tokenize on every paragraph of the
+# book, and time both modes, with and without a process pool
+#
+# Run from the repository root:
+#   python -m benchmarks.tokenizer
+
+REPLICAS = 32
+PROCESSES = [1, 2, 4]
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    corpus = [text for _, text in iter_paragraphs([BOOK_PATH])]
+
+    mismatches = [
+        paragraph
+        for paragraph in corpus
+        if tokenize(paragraph, "fast", LANGUAGE) != tokenize(paragraph, "nltk", LANGUAGE)
+    ]
+    print(f"Paragraphs where fast != nltk: {len(mismatches)} of {len(corpus)}")
+
+    paragraphs = corpus * REPLICAS
+    print(f"\nTokenizing {len(paragraphs)} paragraphs")
+    print(f"{'mode':>6} {'processes':>10} {'seconds':>9} {'paragraphs/s':>14}")
+
+    for mode in ["nltk", "fast"]:
+        for processes in PROCESSES:
+            seconds, tokenized = timed(
+                tokenize_many, paragraphs, mode, LANGUAGE, processes=processes
+            )
+            assert tokenized[: len(corpus)] == tokenize_many(corpus, mode, LANGUAGE)
+            print(
+                f"{mode:>6} {processes:>10} {seconds:>9.2f} {len(paragraphs) / seconds:>14.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 import re
 
 from agent import Agent
-from ai import request_ai_response
+from ai import print_stream, request_ai_response
 from demos.effective_questioning.structured_outputs import NextAction, TypeOfQuestioning
 
-agent = Agent()
+agent = Agent(name="effective_questioning")
 
 TAG_RE = re.compile("<.*?>")
 
@@ -46,9 +46,16 @@ def phase_description(phase):
     return prompt
 
 
+def stream_question(prompt, io):
+    # the question is printed as it streams in, rather than once it is complete
+    io.print()
+    stream = request_ai_response(user=prompt, system=SYSTEM_PROMPT, stream=True)
+    return print_stream(stream, io).strip()
+
+
 @agent.add_action
-def start(state, _input):
-    print("Agent Thoughts: Let's start")
+def start(state, _input, io):
+    io.print("Agent Thoughts: Let's start")
 
     state["history"] = []
     state["summary"] = []
@@ -58,8 +65,8 @@ def start(state, _input):
 
 
 @agent.add_action
-def decide_questioning(state, _input):
-    print("Agent Thoughts: Deciding on the type of questioning to use")
+def decide_questioning(state, _input, io):
+    io.print("Agent Thoughts: Deciding on the type of questioning to use")
 
     phase = state["phase"]
 
@@ -96,6 +103,7 @@ def decide_questioning(state, _input):
         user=prompt,
         system=SYSTEM_PROMPT,
         response_format=TypeOfQuestioning,
+        hedge=True,
     )
 
     response_data = response.parsed
@@ -106,8 +114,8 @@ def decide_questioning(state, _input):
 
 
 @agent.add_action
-def ask_open_question(state, _input):
-    print("Agent Thoughts: Asking an open question")
+def ask_open_question(state, _input, io):
+    io.print("Agent Thoughts: Asking an open question")
 
     prompt = "Ask an open question to gather information and encourage the user to talk about their problem.\n"
     prompt += "For example, ask 'What is the main issue you are facing?', 'Can you describe the problem you are experiencing?' or 'What are the concerns that you have?'\n"
@@ -115,19 +123,14 @@ def ask_open_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def ask_probing_question(state, _input):
-    print("Agent Thoughts: Asking a probing question")
+def ask_probing_question(state, _input, io):
+    io.print("Agent Thoughts: Asking a probing question")
 
     prompt = "Ask a probing question to clarify and explore the user's problem, gaining more detail.\n"
     prompt += "For example, ask 'Can you provide more information about that?', 'What happened next?', 'Why does that exactly matter?' or 'Can you explain that in more detail?'\n"
@@ -135,19 +138,14 @@ def ask_probing_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def ask_hypothetical_question(state, _input):
-    print("Agent Thoughts: Asking a hypothetical question")
+def ask_hypothetical_question(state, _input, io):
+    io.print("Agent Thoughts: Asking a hypothetical question")
 
     prompt = "Ask a hypothetical question to encourage the user to think about alternative scenarios.\n"
     prompt += "For example, ask 'What would happen if...?', 'How would you handle...?', 'If there was a way to do that, what impact would it have?' or 'What could be the outcome if...?'\n"
@@ -155,19 +153,14 @@ def ask_hypothetical_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def ask_reflective_question(state, _input):
-    print("Agent Thoughts: Asking a reflective question")
+def ask_reflective_question(state, _input, io):
+    io.print("Agent Thoughts: Asking a reflective question")
 
     prompt = "Ask a reflective question to encourage the user to think about their problem from a different perspective, or to challenge their current thinking.\n"
     prompt += "For example, ask 'How do you feel/think about that?', 'What is the priority of...?', 'What would someone else say about that?' or 'What could be the reasons behind...?'\n"
@@ -175,19 +168,14 @@ def ask_reflective_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def ask_leading_question(state, _input):
-    print("Agent Thoughts: Asking a leading question")
+def ask_leading_question(state, _input, io):
+    io.print("Agent Thoughts: Asking a leading question")
 
     prompt = "Ask a leading question to guide the user towards a particular solution.\n"
     prompt += "For example, ask 'Have you considered...?', 'What do you think about...?', 'Would you agree that...?' or 'Could you imagine...?'\n"
@@ -195,19 +183,14 @@ def ask_leading_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def ask_closing_question(state, _input):
-    print("Agent Thoughts: Asking a closing question")
+def ask_closing_question(state, _input, io):
+    io.print("Agent Thoughts: Asking a closing question")
 
     prompt = "Ask a closing question to bring agreement, commitment, and decide on actions.\n"
     prompt += "For example, ask 'What do you think we should do next?', 'How do you feel about the solution?', 'Can we agree on...?' or 'What are the next steps?'\n"
@@ -215,19 +198,14 @@ def ask_closing_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def ask_deflective_question(state, _input):
-    print("Agent Thoughts: Asking a deflective question")
+def ask_deflective_question(state, _input, io):
+    io.print("Agent Thoughts: Asking a deflective question")
 
     prompt = "Ask a deflective question to improve the mood of the conversation and alleviate dissatisfaction by keeping the conversation on track.\n"
     prompt += "For example, ask 'How can we make this conversation more helpful?', 'What would you like to focus on?', 'What do you think we should do next?' or 'What are your thoughts on...?'\n"
@@ -235,31 +213,37 @@ def ask_deflective_question(state, _input):
 
     prompt += "\n" + state_summary(state)
 
-    response = request_ai_response(
-        user=prompt,
-        system=SYSTEM_PROMPT,
-    )
-
-    question = response.content.strip()
+    question = stream_question(prompt, io)
 
     return "receive_answer", question
 
 
 @agent.add_action
-def receive_answer(state, question):
-    print("Agent Thoughts: Receive input from the user")
+def receive_answer(state, question, io):
+    io.print("Agent Thoughts: Receive input from the user")
 
-    print()
-    print(question)
-    answer = input("> ")
-    print()
+    # the question was printed as it was asked
+    answer = io.input("> ")
+    io.print()
 
     return "consolidate_information", (question, answer)
 
 
 @agent.add_action
-def consolidate_information(state, question_answer):
-    print(
+def repeat_question(state, question, io):
+    # a session resumed waiting for an answer: its question was printed before it stopped
+    io.print()
+    io.print(question)
+
+    return "receive_answer", question
+
+
+agent.resume_actions["receive_answer"] = "repeat_question"
+
+
+@agent.add_action
+def consolidate_information(state, question_answer, io):
+    io.print(
         "Agent Thoughts: Consolidating the information gathered (phase "
         + str(state["phase"])
         + ")"
@@ -299,9 +283,9 @@ def consolidate_information(state, question_answer):
 
     summary = remove_tags(response.content).strip()
 
-    print("Agent Thoughts: Summary for phase " + str(phase) + ":")
-    print(summary)
-    print()
+    io.print("Agent Thoughts: Summary for phase " + str(phase) + ":")
+    io.print(summary)
+    io.print()
 
     if len(state["summary"]) < phase:
         state["summary"].append(summary)
@@ -312,8 +296,8 @@ def consolidate_information(state, question_answer):
 
 
 @agent.add_action
-def decide_next_action(state, _input):
-    print("Agent Thoughts: Deciding on the next action")
+def decide_next_action(state, _input, io):
+    io.print("Agent Thoughts: Deciding on the next action")
     phase = state["phase"]
 
     prompt = "Based on the information collected and the type of questioning used, decide on the next action to take.\n"
@@ -335,6 +319,7 @@ def decide_next_action(state, _input):
         user=prompt,
         system=SYSTEM_PROMPT,
         response_format=NextAction,
+        hedge=True,
     )
 
     next_action = response.parsed.next_action
@@ -349,14 +334,14 @@ def decide_next_action(state, _input):
 
 
 @agent.add_action
-def end_conversation(state, _input):
-    print("Agent Thoughts: Ending the conversation")
-
-    print()
-    print("The conversation has ended.")
-    print("The following is a summary of the conversation:")
-    print()
-    print(state_summary(state))
-    print()
+def end_conversation(state, _input, io):
+    io.print("Agent Thoughts: Ending the conversation")
+
+    io.print()
+    io.print("The conversation has ended.")
+    io.print("The following is a summary of the conversation:")
+    io.print()
+    io.print(state_summary(state))
+    io.print()
 
     return "end", None
@@ -1,7 +1,8 @@
 import json
 
 from agent import Agent
-from ai import request_ai_response
+from agent_budget import Budget
+from ai import print_stream, request_ai_response
 from demos.function_planner.structured_outputs import (
     ConsolidatedInformation,
     MenuDecision,
@@ -10,7 +11,11 @@ from demos.function_planner.structured_outputs import (
     Venue,
 )
 
-agent = Agent()
+# a confused model can send the planner back to gather_information forever
+agent = Agent(
+    name="function_planner",
+    budget=Budget(max_steps=60, max_llm_calls=40, max_seconds=30 * 60, fallback="stop_planning"),
+)
 
 """ And example agent for planning a function """
 
@@ -19,10 +24,10 @@ REQUIRED_INFORMATION = ["date", "guests", "city", "venue", "weather", "menu"]
 
 
 @agent.add_action
-def start(state, input_data):
+def start(state, input_data, io):
     # Starting state of the agent
 
-    print("Agent Thoughts: Starting the function planning agent")
+    io.print("Agent Thoughts: Starting the function planning agent")
 
     # Initialize the state with each value as None
     for info in REQUIRED_INFORMATION:
@@ -36,10 +41,10 @@ def start(state, input_data):
 
 
 @agent.add_action
-def gather_information(state, input_data):
+def gather_information(state, input_data, io):
     """Identify the requirements for the function"""
 
-    print("Agent Thoughts: Gathering information for the function")
+    io.print("Agent Thoughts: Gathering information for the function")
 
     prompt = "Gather some information from the user to plan the event by asking a few brief questions, e.g. type of function."
     prompt += "\nDo not ask very specific questions about the exact venue or exact menu items, as these will be decided later."
@@ -66,25 +71,25 @@ def gather_information(state, input_data):
 
 
 @agent.add_action
-def ask_questions(state, input_data):
+def ask_questions(state, input_data, io):
     # This action doesn't use the AI model, it directly asks the user the questions
 
-    print("Agent Thoughts: Asking the user some questions.\n")
+    io.print("Agent Thoughts: Asking the user some questions.\n")
 
     for question in input_data:
-        answer = input(question + " > ")
+        answer = io.input(question + " > ")
         state["information_gathered"].append({question: answer})
 
     return "consolidate_information", None
 
 
 @agent.add_action
-def consolidate_information(state, input_data):
+def consolidate_information(state, input_data, io):
     """Consolidate the information gathered"""
 
     # This action takes all the information gathered and consolidates it into structured state data
 
-    print("Agent Thoughts: Consolidating the information gathered")
+    io.print("Agent Thoughts: Consolidating the information gathered")
 
     prompt = "Consolidate the information gathered from the user.\n"
 
@@ -104,7 +109,7 @@ def consolidate_information(state, input_data):
 
     response_dict = response_data.model_dump()
 
-    print("Agent Thoughts: Consolidated Information", response_dict, "\n")
+    io.print("Agent Thoughts: Consolidated Information", response_dict, "\n")
 
     for key, value in response_dict.items():
         if value is not None:
@@ -114,16 +119,16 @@ def consolidate_information(state, input_data):
 
 
 @agent.add_action
-def choose_next_step(state, input_data):
+def choose_next_step(state, input_data, io):
     """Decide on the next planning step"""
 
     # This action is a decision point based on the current state of the function planning
     # The AI model is used to decide on the next step based on the current state
 
-    print("Agent Thoughts: Choosing the next planning step")
+    io.print("Agent Thoughts: Choosing the next planning step")
     if input_data is not None:
-        print("   Specific input data:", input_data)
-    print()
+        io.print("   Specific input data:", input_data)
+    io.print()
 
     prompt = "Given the requirements for the function, choose one of the following actions to perform next:\n"
     prompt += "1. Gather more information (gather_information)\n"
@@ -143,11 +148,13 @@ def choose_next_step(state, input_data):
         user=prompt,
         system=SYSTEM_PROMPT,
         response_format=NextAction,
+        # every step waits on this decision, so a slow answer is hedged
+        hedge=True,
     )
 
     response_data = response.parsed
 
-    print("Agent Thoughts: Next Action", response_data.next_action, "\n")
+    io.print("Agent Thoughts: Next Action", response_data.next_action, "\n")
 
     next_action = response_data.next_action
 
@@ -155,31 +162,31 @@ def choose_next_step(state, input_data):
 
 
 @agent.add_action
-def get_weather(state, input_data):
+def get_weather(state, input_data, io):
     """Get the weather forecast for the date of the function"""
 
     # This action demonstrates calling an external API to get the weather forecast
     # Agents can interact with external services to gather information
 
-    print("Agent Thoughts: Getting the weather forecast")
+    io.print("Agent Thoughts: Getting the weather forecast")
 
     import random
 
     if state["date"] is None or state["city"] is None:
-        print("Agent Thoughts: Missing information to get the weather forecast")
+        io.print("Agent Thoughts: Missing information to get the weather forecast")
         return "gather_information", "date, city"
 
     # TODO call an API to get the weather forecast for the date and city
     state["weather"] = random.choice(["sunny", "rainy", "cloudy", "snowy"])
 
-    print("Agent Thoughts: Weather Forecast is", state["weather"], "\n")
+    io.print("Agent Thoughts: Weather Forecast is", state["weather"], "\n")
 
     return "choose_next_step", None
 
 
 @agent.add_action
-def decide_venue(state, input_data):
-    print("Agent Thoughts: Deciding on the venue for the function")
+def decide_venue(state, input_data, io):
+    io.print("Agent Thoughts: Deciding on the venue for the function")
 
     """Decide on the venue for the function"""
 
@@ -204,7 +211,7 @@ def decide_venue(state, input_data):
     response_data = response.parsed
 
     if response_data.missing_information:
-        print(
+        io.print(
             "Agent Thoughts: Missing information to decide the venue",
             response_data.missing_information,
             "\n",
@@ -212,15 +219,15 @@ def decide_venue(state, input_data):
 
         return "gather_information", response_data.missing_information
     else:
-        print("Agent Thoughts: Listing Recommended Venues")
-        print("\n")
+        io.print("Agent Thoughts: Listing Recommended Venues")
+        io.print("\n")
 
         for venue_index, venue in enumerate(response_data.venues):
-            print(f"{venue_index + 1}. {venue}")
+            io.print(f"{venue_index + 1}. {venue}")
 
-        print(f"{len(response_data.venues) + 1}. None of the above")
+        io.print(f"{len(response_data.venues) + 1}. None of the above")
 
-        venue_choice = int(input("Choose a venue (number)> "))
+        venue_choice = int(io.input("Choose a venue (number)> "))
 
         if venue_choice <= len(response_data.venues):
             state["venue"] = response_data.venues[venue_choice - 1]
@@ -231,8 +238,8 @@ def decide_venue(state, input_data):
 
 
 @agent.add_action
-def decide_menu(state, input_data):
-    print("Agent Thoughts: Deciding on the menu for the function")
+def decide_menu(state, input_data, io):
+    io.print("Agent Thoughts: Deciding on the menu for the function")
 
     """Decide on the menu for the function"""
 
@@ -257,20 +264,20 @@ def decide_menu(state, input_data):
     response_data = response.parsed
 
     if response_data.missing_information:
-        print(
+        io.print(
             "Agent Thoughts: Missing information to decide the menu",
             response_data.missing_information,
             "\n",
         )
         return "gather_information", response_data.missing_information
     else:
-        print("Agent Thoughts: Listing Menu Options\n")
+        io.print("Agent Thoughts: Listing Menu Options\n")
         for menu_index, menu in enumerate(response_data.menus):
-            print(f"{menu_index + 1}.\n{menu}\n\n")
+            io.print(f"{menu_index + 1}.\n{menu}\n\n")
 
-        print(f"{len(response_data.menus) + 1}. None of the above")
+        io.print(f"{len(response_data.menus) + 1}. None of the above")
 
-        menu_choice = int(input("Choose a menu (number)> "))
+        menu_choice = int(io.input("Choose a menu (number)> "))
 
         if menu_choice <= len(response_data.menus):
             state["menu"] = response_data.menus[menu_choice - 1].model_dump()
@@ -281,8 +288,8 @@ def decide_menu(state, input_data):
 
 
 @agent.add_action
-def send_invitations(state, input_data):
-    print("Agent Thoughts: Sending invitations to the guests\n\n")
+def send_invitations(state, input_data, io):
+    io.print("Agent Thoughts: Sending invitations to the guests\n\n")
 
     """Send invitations to the guests"""
 
@@ -291,8 +298,23 @@ def send_invitations(state, input_data):
     prompt += json.dumps(state, indent=2)
 
     # Note: The AI model is used to generate text here, not a structured output
-    response = request_ai_response(user=prompt, system=SYSTEM_PROMPT)
+    # streamed, so the invitation is printed as it is written
+    print_stream(request_ai_response(user=prompt, system=SYSTEM_PROMPT, stream=True), io)
+
+    return "end", None
+
 
-    print(response.content)
+@agent.add_action
+def stop_planning(state, input_data, io):
+    # The fallback when the planning has used up its budget, see agent_budget.py
+
+    io.print("Agent Thoughts: Stopping the planning after", input_data, "\n")
+
+    for info in REQUIRED_INFORMATION:
+        if state.get(info) is not None:
+            io.print(f"{info}: {state[info]}")
+    missing = [info for info in REQUIRED_INFORMATION if state.get(info) is None]
+    if missing:
+        io.print("Still to decide:", ", ".join(missing))
 
     return "end", None
@@ -1,46 +1,49 @@
 import re
 from agent import Agent
 from ai import request_ai_response
-from demos.simple_rag.search import digest_book, search
+from demos.simple_rag.search import digest_book, find_quote, search_excerpts
 from demos.simple_rag.structured_outputs import Excerpts
 
 # Example RAG using BM25 search and a simple state machine
 
-agent = Agent()
+agent = Agent(name="simple_rag")
 
 SYSTEM_PROMPT = (
     "You are an AI agent performing tasks relating to the book Alice in Wonderland."
 )
 
 
-@agent.add_action
-def start(state, input):
-    print("Agent Thoughts: Ingesting Alice in Wonderland")
+@agent.add_resource(warm=True)
+def search_engine():
+    # with positions, quotes in answers can be checked against the text
+    return digest_book(with_positions=True)
+
 
-    search_engine, chapters, mapping = digest_book()
+@agent.add_action
+def start(state, input, io):
+    io.print("Agent Thoughts: Ingesting Alice in Wonderland")
 
-    state["search_engine"] = search_engine
-    state["chapters"] = chapters
-    state["mapping"] = mapping
+    # built once, by the first session, and shared by them all
+    agent.resource("search_engine")
 
     return "ask_question", None
 
 
 @agent.add_action
-def ask_question(state, _inputs):
-    print("Agent Thoughts: The user needs to ask a question")
+def ask_question(state, _inputs, io):
+    io.print("Agent Thoughts: The user needs to ask a question")
 
-    print("Ask a question about Alice in Wonderland:\n")
-    print("e.g. - ask for quotes, summaries, or questions about characters")
+    io.print("Ask a question about Alice in Wonderland:\n")
+    io.print("e.g. - ask for quotes, summaries, or questions about characters")
 
-    question = input("Your question: ")
+    question = io.input("Your question: ")
 
     return "fabricate_excerpts", question
 
 
 @agent.add_action
-def fabricate_excerpts(state, question):
-    print(
+def fabricate_excerpts(state, question, io):
+    io.print(
         "Agent Thoughts: The user asked a question, I'm going to imagine what some relevant excerpts might look like"
     )
 
@@ -57,39 +60,37 @@ def fabricate_excerpts(state, question):
         response_format=Excerpts,
     )
 
-    excerpts = "\n".join(response.parsed.excerpts)
+    excerpts = response.parsed.excerpts
 
-    print("Agent Thoughts: Generated excerpts:")
-    print(excerpts)
-    print()
+    io.print("Agent Thoughts: Generated excerpts:")
+    io.print("\n".join(excerpts))
+    io.print()
 
     return "search_text", (excerpts, question)
 
 
 @agent.add_action
-def search_text(state, query_question):
-    query, question = query_question
+def search_text(state, query_question, io):
+    excerpts, question = query_question
 
-    print(f"Agent Thoughts: Searching for relevant information in the text")
+    io.print(f"Agent Thoughts: Searching for relevant information in the text")
 
-    mapping = state["mapping"]
-    search_engine = state["search_engine"]
-    chapters = state["chapters"]
+    search_engine = agent.resource("search_engine")
 
-    top_n = search(search_engine, query)
+    top_n = search_excerpts(search_engine, excerpts)
 
-    print("Agent Thoughts: Found relevant information in the text")
+    io.print("Agent Thoughts: Found relevant information in the text")
     for index, score in top_n:
-        chapter_index, paragraph_index = mapping[index]
-        print(
-            f"                - Chapter {chapter_index + 1}, Paragraph {paragraph_index + 1}: {score:.2f}"
+        chapter_index, paragraph_index = search_engine.location(index)
+        io.print(
+            f"                - Chapter {chapter_index + 1}, Paragraph {paragraph_index + 1}: {score:.3f}"
         )
 
     excerpts = {}
     for index, score in top_n:
-        chapter_index, paragraph_index = mapping[index]
+        chapter_index, paragraph_index = search_engine.location(index)
 
-        paragraph = chapters[chapter_index][paragraph_index]
+        paragraph = search_engine.paragraph(index)
         excerpts[f"chapter-{chapter_index+1}-p-{paragraph_index}"] = paragraph
 
     # Note: the agent could also evaluate the results and then
@@ -99,8 +100,8 @@ def search_text(state, query_question):
 
 
 @agent.add_action
-def answer_question(state, question_context):
-    print("Agent Thoughts: Generating an answer to the user's question")
+def answer_question(state, question_context, io):
+    io.print("Agent Thoughts: Generating an answer to the user's question")
 
     question, excerpts = question_context
 
@@ -121,27 +122,74 @@ def answer_question(state, question_context):
     prompt += "Context:\n"
     prompt += excerpts_formatted
 
-    response = request_ai_response(user=prompt, system=SYSTEM_PROMPT)
+    stream = request_ai_response(user=prompt, system=SYSTEM_PROMPT, stream=True)
+
+    io.print()
+    io.print("-" * 50)
+
+    # the answer is printed as it streams in, and each reference is looked up as
+    # soon as its link is complete, and marked with its footnote number
+    answer = ""
+    searched = 0
+    references = []
+    for delta in stream:
+        io.print(delta, end="", flush=True)
+        answer += delta
+
+        for match in REFERENCES_REGEX.finditer(answer, searched):
+            searched = match.end()
+            reference = match.group(1)
+            if reference not in excerpts:
+                io.print(" [?]", end="", flush=True)
+                continue
+            if reference not in references:
+                references.append(reference)
+            io.print(f" [{references.index(reference) + 1}]", end="", flush=True)
+
+    io.print()
+    io.print("-" * 50)
+    io.print("Excerpts:")
+
+    for number, reference in enumerate(references):
+        io.print("-" * 50)
+        io.print(f"[{number + 1}] {reference}:")
+        io.print("" * 50)
+        io.print(excerpts[reference])
+        io.print("" * 50)
+        io.print("-" * 50)
+        io.print()
+    io.print()
+
+    verify_quotes(agent.resource("search_engine"), answer, io)
+
+    return "ask_question", None
 
-    answer = response.content
 
-    print()
-    print("-" * 50)
-    print(answer)
-    print("-" * 50)
-    print("Excerpts:")
+# Markdown links to excerpts, e.g. (#chapter-1-p-2)
+REFERENCES_REGEX = re.compile(r"\(#([\w-]+)\)")
 
-    references_regex = r"\(#([\w-]+)\)"
-    references = re.findall(references_regex, answer)
+# quotations in double quotes, straight or curly, of at least three words
+QUOTES_REGEX = r"[“\"]([^”\"]+?\s[^”\"]+?\s[^”\"]+?)[”\"]"
+ELLIPSIS_REGEX = r"\.\.\.|…"
 
-    for reference in references:
-        print("-" * 50)
-        print(f"{reference}:")
-        print("" * 50)
-        print(excerpts[reference.strip("#")])
-        print("" * 50)
-        print("-" * 50)
-        print()
-    print()
 
-    return "ask_question", None
+def verify_quotes(search_engine, answer, io):
+    quotes = re.findall(QUOTES_REGEX, answer)
+    if not quotes:
+        return
+
+    io.print("Agent Thoughts: Checking the quotes in my answer against the book")
+    for quote in quotes:
+        # a quote with an ellipsis is verified if every part of it is in the book
+        parts = [part for part in re.split(ELLIPSIS_REGEX, quote) if part.strip()]
+        matches = [find_quote(search_engine, part) for part in parts]
+
+        if parts and all(matches):
+            doc, _start, _end = matches[0][0]
+            chapter_index, paragraph_index = search_engine.location(doc)
+            io.print(
+                f'                - "{quote}": Chapter {chapter_index + 1}, Paragraph {paragraph_index + 1}'
+            )
+        else:
+            io.print(f'                - "{quote}": not found in the book')
+    io.print()
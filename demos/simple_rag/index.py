@@ -0,0 +1,291 @@
+import copy
+import json
+import mmap
+import os
+from collections import Counter
+
+import numpy as np
+
+from demos.simple_rag.ingest import Paragraph, open_source
+from demos.simple_rag.tokenizer import Vocabulary
+
+# On-disk BM25 index, written once by digest_book and memory-mapped on later runs
+#
+# Layout:
+#   MAGIC | header length (uint64) | JSON header | padding | sections...
+#
+# Each section is a flat array aligned to ALIGNMENT bytes, described in the
+# header by its dtype, byte offset (relative to the start of the data) and
+# element count. Loading maps the file read-only and wraps each section with
+# np.frombuffer, so no array data is copied until it is touched.
+#
+# Paragraph text is not stored: each document records its byte range in one of
+# the source files listed in the header, and is sliced from a memory map of that
+# file when it is needed.
+
+MAGIC = b"BM25IDX\x00"
+FORMAT_VERSION = 4
+ALIGNMENT = 8
+
+SECTIONS = {
+    "idf": np.float64,  # per term, with BM25Okapi's epsilon floor applied
+    "max_impacts": np.float64,  # per term, the highest score any one posting contributes
+    "postings_offsets": np.int64,  # per term + 1, into postings_docs/postings_tfs
+    "postings_docs": np.int32,  # doc ids, ascending within each term
+    "postings_tfs": np.int32,  # term frequency for each posting
+    "forward_offsets": np.int64,  # per document + 1, into forward_terms/forward_tfs
+    "forward_terms": np.int32,  # term ids, ascending within each document
+    "forward_tfs": np.int32,  # term frequency for each forward entry
+    "doc_lengths": np.int32,  # tokens per document
+    "doc_books": np.int32,  # per document, index into the header's sources
+    "paragraph_offsets": np.int64,  # per document, byte offset in its source file
+    "paragraph_lengths": np.int64,  # per document, byte length in its source file
+    "corpus_mapping": np.int32,  # (chapter_index, paragraph_index) per document
+    "terms": np.uint8,  # UTF-8 terms separated by newlines, in term id order
+}
+
+
+class BM25Index:
+    def __init__(self, header, arrays):
+        self.header = header
+        self.key = header["key"]
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.epsilon = header["epsilon"]
+        self.avgdl = header["avgdl"]
+        self.num_docs = header["num_docs"]
+        self.sources = header["sources"]
+        self.buffers = {}
+        # the file the index was loaded from, if any
+        self.path = None
+        # the positional index, when one was asked for (see search.digest_positions)
+        self.positions = None
+
+        for name in SECTIONS:
+            setattr(self, name, arrays[name])
+
+        terms = self.terms.tobytes().decode("utf-8")
+        self.vocabulary = Vocabulary(terms.split("\n") if terms else [])
+
+        # the length normalisation part of BM25's denominator, per document
+        self.doc_norms = self.k1 * (
+            1 - self.b + self.b * self.doc_lengths / self.avgdl
+        )
+
+    def location(self, doc):
+        return int(self.corpus_mapping[2 * doc]), int(self.corpus_mapping[2 * doc + 1])
+
+    def record(self, doc):
+        chapter, paragraph = self.location(doc)
+        return Paragraph(
+            int(self.doc_books[doc]),
+            chapter,
+            paragraph,
+            int(self.paragraph_offsets[doc]),
+            int(self.paragraph_lengths[doc]),
+        )
+
+    def source(self, doc):
+        return self.sources[self.doc_books[doc]]
+
+    def paragraph(self, doc):
+        book = int(self.doc_books[doc])
+        # sources are mapped on first use, so only the pages of paragraphs that
+        # are actually read become resident
+        if book not in self.buffers:
+            self.buffers[book] = open_source(self.sources[book])
+
+        start = self.paragraph_offsets[doc]
+        end = start + self.paragraph_lengths[doc]
+        return self.buffers[book][start:end].decode("utf-8", errors="replace")
+
+    def postings(self, term_id):
+        start = self.postings_offsets[term_id]
+        end = self.postings_offsets[term_id + 1]
+        return self.postings_docs[start:end], self.postings_tfs[start:end]
+
+    def forward(self, docs):
+        """The (term id, frequency) entries of each given document, in term id order,
+        with the position in docs that each entry belongs to"""
+
+        starts = self.forward_offsets[docs]
+        lengths = self.forward_offsets[docs + 1] - starts
+        owners = np.repeat(np.arange(len(docs)), lengths)
+        positions = np.arange(lengths.sum()) + np.repeat(
+            starts - (np.cumsum(lengths) - lengths), lengths
+        )
+        return owners, self.forward_terms[positions], self.forward_tfs[positions]
+
+    def with_statistics(self, idf, avgdl):
+        """A view of this index that scores with the given idf (per term id) and
+        average document length, e.g. those of a larger corpus it is part of"""
+
+        view = copy.copy(self)
+        view.idf = idf
+        view.avgdl = avgdl
+        view.doc_norms = view.k1 * (1 - view.b + view.b * view.doc_lengths / avgdl)
+        # the stored bounds were computed with this index's own statistics
+        view.max_impacts = None
+        return view
+
+    def impacts(self, term_ids, docs, tfs):
+        # the BM25 score each term contributes to its document
+        return self.idf[term_ids] * (
+            tfs * (self.k1 + 1) / (tfs + self.doc_norms[docs])
+        )
+
+
+def inverse_document_frequencies(document_frequencies, num_docs, epsilon):
+    # BM25Okapi's idf: terms in more than half of the documents would get a
+    # negative idf, so they are floored to epsilon * the average idf instead
+    idf = np.log(num_docs - document_frequencies + 0.5) - np.log(
+        document_frequencies + 0.5
+    )
+    if len(idf):
+        idf[idf < 0] = epsilon * (sum(idf.tolist()) / len(idf))
+    return idf
+
+
+def build_index(key, sources, tokenized_paragraphs, k1, b, epsilon):
+    """Build an index from (Paragraph, tokens) pairs, such as those streamed by
+    ingest.ingest; the paragraphs' book numbers index into sources"""
+
+    vocabulary = Vocabulary()
+    postings = []
+    doc_lengths = []
+    records = []
+
+    for doc, (record, tokens) in enumerate(tokenized_paragraphs):
+        records.append(record)
+        doc_lengths.append(len(tokens))
+        for term, frequency in Counter(tokens).items():
+            term_id = vocabulary.intern(term)
+            if term_id == len(postings):
+                postings.append([])
+            postings[term_id].append((doc, frequency))
+
+    num_docs = len(doc_lengths)
+    document_frequencies = np.array([len(term_postings) for term_postings in postings])
+
+    postings_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    postings_offsets[1:] = np.cumsum(document_frequencies)
+    flat_postings = [posting for term_postings in postings for posting in term_postings]
+
+    postings_docs = np.array([doc for doc, _ in flat_postings], dtype=np.int64)
+    postings_tfs = np.array([frequency for _, frequency in flat_postings])
+    idf = inverse_document_frequencies(document_frequencies, num_docs, epsilon)
+
+    # the same postings ordered by document, so a document's terms can be looked up
+    posting_terms = np.repeat(np.arange(len(vocabulary)), document_frequencies)
+    forward_order = np.argsort(postings_docs, kind="stable")
+    forward_offsets = np.zeros(num_docs + 1, dtype=np.int64)
+    forward_offsets[1:] = np.cumsum(np.bincount(postings_docs, minlength=num_docs))
+
+    # upper bound of each term's contribution to any document, used to prune queries
+    doc_lengths = np.array(doc_lengths)
+    avgdl = int(doc_lengths.sum()) / num_docs
+    doc_norms = k1 * (1 - b + b * doc_lengths / avgdl)
+    impacts = idf[posting_terms] * (
+        postings_tfs * (k1 + 1) / (postings_tfs + doc_norms[postings_docs])
+    )
+    max_impacts = (
+        np.maximum.reduceat(impacts, postings_offsets[:-1]) if len(impacts) else idf
+    )
+
+    arrays = {
+        "idf": idf,
+        "max_impacts": max_impacts,
+        "postings_offsets": postings_offsets,
+        "postings_docs": postings_docs,
+        "postings_tfs": postings_tfs,
+        "forward_offsets": forward_offsets,
+        "forward_terms": posting_terms[forward_order],
+        "forward_tfs": postings_tfs[forward_order],
+        "doc_lengths": doc_lengths,
+        "doc_books": [record.book for record in records],
+        "paragraph_offsets": [record.offset for record in records],
+        "paragraph_lengths": [record.length for record in records],
+        "corpus_mapping": np.array(
+            [(record.chapter, record.paragraph) for record in records]
+        ).reshape(-1),
+        "terms": np.frombuffer(
+            "\n".join(vocabulary.terms).encode("utf-8"), dtype=np.uint8
+        ),
+    }
+
+    header = {
+        "key": key,
+        "k1": k1,
+        "b": b,
+        "epsilon": epsilon,
+        "avgdl": avgdl,
+        "num_docs": num_docs,
+        "sources": [os.path.abspath(source) for source in sources],
+    }
+
+    return BM25Index(
+        header,
+        {name: np.asarray(arrays[name], dtype=dtype) for name, dtype in SECTIONS.items()},
+    )
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_index(path, index, index_sections=SECTIONS):
+    sections = {}
+    offset = 0
+    for name, dtype in index_sections.items():
+        array = getattr(index, name)
+        sections[name] = [np.dtype(dtype).str, offset, len(array)]
+        offset = _align(offset + array.nbytes)
+
+    header = dict(index.header, version=FORMAT_VERSION, sections=sections)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # write to a temporary file and rename, so a crash never leaves a partial index behind
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name in index_sections:
+            f.write(b"\0" * (data_start + sections[name][1] - f.tell()))
+            f.write(getattr(index, name).tobytes())
+    os.replace(temporary_path, path)
+
+
+def load_index(path, key, index_class=BM25Index):
+    """Memory-map the index at path, or return None if it is missing or stale"""
+
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if buffer[: len(MAGIC)] != MAGIC:
+        return None
+
+    header_length = int.from_bytes(buffer[len(MAGIC) : len(MAGIC) + 8], "little")
+    header_start = len(MAGIC) + 8
+    header = json.loads(buffer[header_start : header_start + header_length])
+
+    if header.get("version") != FORMAT_VERSION or header.get("key") != key:
+        return None
+
+    data_start = _align(header_start + header_length)
+    arrays = {
+        name: np.frombuffer(
+            buffer, dtype=np.dtype(dtype), count=count, offset=data_start + offset
+        )
+        for name, (dtype, offset, count) in header["sections"].items()
+    }
+
+    index = index_class(header, arrays)
+    index.path = path
+    return index
@@ -0,0 +1,166 @@
+import glob
+import mmap
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from demos.simple_rag import tokenizer
+
+# Streaming ingestion of Project Gutenberg books
+#
+# Each source file is memory-mapped and split into paragraphs without reading
+# it into a Python string; only one batch of paragraphs is decoded at a time,
+# for tokenization. Paragraphs are described by where they are in the source
+# file, so the index never has to store their text.
+
+# the Project Gutenberg header and footer lines, in any of their common forms
+GUTENBERG_START_RE = re.compile(
+    rb"^\*\*\*\s*START OF (?:THE|THIS) PROJECT GUTENBERG E-?(?:BOOK|TEXT)[^\n]*$",
+    re.MULTILINE | re.IGNORECASE,
+)
+GUTENBERG_END_RE = re.compile(
+    rb"^\*\*\*\s*END OF (?:THE|THIS) PROJECT GUTENBERG E-?(?:BOOK|TEXT)",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# chapter headings start a line; table of contents entries are indented
+CHAPTER_RE = re.compile(rb"^CHAPTER\b", re.MULTILINE)
+PARAGRAPH_SEPARATOR_RE = re.compile(rb"\r?\n\r?\n")
+
+MIN_PARAGRAPH_LENGTH = 180
+DIALOGUE_MARKERS = ["“", "”", '"']
+BATCH_SIZE = 1024
+
+# where a paragraph is: the index of its book in the list of sources, its
+# chapter and paragraph numbers, and its byte range in the source file
+Paragraph = namedtuple("Paragraph", ["book", "chapter", "paragraph", "offset", "length"])
+
+
+def book_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, "*.txt")))
+
+
+def open_source(path):
+    """Memory-map a source file read-only"""
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def text_bounds(buffer):
+    # the book's own text, without the Project Gutenberg header and footer
+    start = GUTENBERG_START_RE.search(buffer)
+    start = start.end() if start else 0
+
+    end = GUTENBERG_END_RE.search(buffer, start)
+    end = end.start() if end else len(buffer)
+
+    return start, end
+
+
+def _strip(buffer, start, end):
+    while start < end and buffer[start : start + 1].isspace():
+        start += 1
+    while end > start and buffer[end - 1 : end].isspace():
+        end -= 1
+    return start, end
+
+
+def chapter_bounds(buffer, start, end):
+    """The byte range of every chapter; a book without chapter headings is one chapter"""
+
+    starts = [match.start() for match in CHAPTER_RE.finditer(buffer, start, end)]
+    if not starts:
+        return [_strip(buffer, start, end)]
+
+    # anything before the first chapter (preface, table of contents) is skipped
+    ends = starts[1:] + [end]
+    return [_strip(buffer, start, end) for start, end in zip(starts, ends)]
+
+
+def _short_or_dialogue(text):
+    # carriage returns are not counted, so CRLF files split like LF ones
+    length = len(text) - text.count("\r")
+    return length < MIN_PARAGRAPH_LENGTH or text[:1] in DIALOGUE_MARKERS
+
+
+def paragraph_bounds(buffer, start, end):
+    """Byte ranges of a chapter's paragraphs, with short paragraphs and dialogue
+    joined onto the paragraph before them"""
+
+    if start == end:
+        return
+
+    pieces = []
+    piece_start = start
+    for separator in PARAGRAPH_SEPARATOR_RE.finditer(buffer, start, end):
+        pieces.append((piece_start, separator.start()))
+        piece_start = separator.end()
+    pieces.append((piece_start, end))
+
+    current = None
+    for piece_start, piece_end in pieces:
+        text = buffer[piece_start:piece_end].decode("utf-8", errors="replace")
+        if _short_or_dialogue(text):
+            current = (piece_start if current is None else current[0], piece_end)
+        else:
+            if current is not None:
+                yield current
+            current = (piece_start, piece_end)
+    if current is not None:
+        yield current
+
+
+def iter_paragraphs(paths):
+    """Yield (Paragraph, text) for every paragraph of every book, one book mapped at a time"""
+
+    for book, path in enumerate(paths):
+        buffer = open_source(path)
+        try:
+            start, end = text_bounds(buffer)
+            for chapter, (chapter_start, chapter_end) in enumerate(
+                chapter_bounds(buffer, start, end)
+            ):
+                for paragraph, (offset, paragraph_end) in enumerate(
+                    paragraph_bounds(buffer, chapter_start, chapter_end)
+                ):
+                    record = Paragraph(book, chapter, paragraph, offset, paragraph_end - offset)
+                    text = buffer[offset:paragraph_end].decode("utf-8", errors="replace")
+                    yield record, text
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+
+
+def ingest(paths, mode="fast", language="english", processes=1, batch_size=BATCH_SIZE):
+    """Yield (Paragraph, tokens) for every paragraph, tokenizing a batch at a time"""
+
+    # one pool for every batch, rather than worker processes started for each
+    with ProcessPoolExecutor(processes) if processes > 1 else nullcontext() as pool:
+        batch = []
+        for record, text in iter_paragraphs(paths):
+            batch.append((record, text))
+            if len(batch) == batch_size:
+                yield from _tokenize_batch(batch, mode, language, pool)
+                batch = []
+        yield from _tokenize_batch(batch, mode, language, pool)
+
+
+def _tokenize_batch(batch, mode, language, pool):
+    tokenized = tokenizer.tokenize_many([text for _, text in batch], mode, language, pool=pool)
+    return zip([record for record, _ in batch], tokenized)
+
+
+def paragraph_settings():
+    return {
+        "min_length": MIN_PARAGRAPH_LENGTH,
+        "dialogue_markers": DIALOGUE_MARKERS,
+        "start": GUTENBERG_START_RE.pattern.decode(),
+        "end": GUTENBERG_END_RE.pattern.decode(),
+        "chapter": CHAPTER_RE.pattern.decode(),
+        "separator": PARAGRAPH_SEPARATOR_RE.pattern.decode(),
+    }
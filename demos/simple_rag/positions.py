@@ -0,0 +1,157 @@
+import numpy as np
+
+from demos.simple_rag.tokenizer import Vocabulary, token_spans
+
+# Positional index for quotes: where every word occurs, and its character span
+#
+# Unlike the BM25 index, stopwords are kept, so a phrase such as "off with her
+# head" can be matched word for word. Each occurrence is stored as one int64
+# key, document << 32 | position, so a phrase is found by shifting the keys of
+# one word and intersecting them with the keys of the next.
+#
+# Stored next to the BM25 index it belongs to, in the same file format.
+
+POSITION_SECTIONS = {
+    "postings_offsets": np.int64,  # per term + 1, into postings_keys
+    "postings_keys": np.int64,  # document << 32 | position, ascending within each term
+    "span_offsets": np.int64,  # per document + 1, into span_starts/span_ends
+    "span_starts": np.int32,  # character offset where each word starts in its paragraph
+    "span_ends": np.int32,  # character offset where each word ends
+    "terms": np.uint8,  # UTF-8 terms separated by newlines, in term id order
+}
+
+POSITION_BITS = 32
+# part of the file's key, so a change to how words are split rebuilds it
+POSITIONS_VERSION = 1
+
+
+class PositionalIndex:
+    def __init__(self, header, arrays):
+        self.header = header
+        self.key = header["key"]
+
+        for name in POSITION_SECTIONS:
+            setattr(self, name, arrays[name])
+
+        terms = self.terms.tobytes().decode("utf-8")
+        self.vocabulary = Vocabulary(terms.split("\n") if terms else [])
+        self.path = None
+
+    def occurrences(self, term_id):
+        return self.postings_keys[
+            self.postings_offsets[term_id] : self.postings_offsets[term_id + 1]
+        ]
+
+    def span(self, doc, first, last):
+        # the characters from the start of word first to the end of word last
+        offset = self.span_offsets[doc]
+        return int(self.span_starts[offset + first]), int(self.span_ends[offset + last])
+
+
+def build_positions(key, texts):
+    """Build the positional index of the paragraph texts, in document order"""
+
+    vocabulary = Vocabulary()
+    postings = []
+    span_offsets = [0]
+    span_starts = []
+    span_ends = []
+
+    for doc, text in enumerate(texts):
+        spans = token_spans(text)
+        for position, (token, start, end) in enumerate(spans):
+            term_id = vocabulary.intern(token)
+            if term_id == len(postings):
+                postings.append([])
+            postings[term_id].append(doc << POSITION_BITS | position)
+            span_starts.append(start)
+            span_ends.append(end)
+        span_offsets.append(len(span_starts))
+
+    postings_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    postings_offsets[1:] = np.cumsum([len(term_postings) for term_postings in postings])
+
+    arrays = {
+        "postings_offsets": postings_offsets,
+        "postings_keys": [key for term_postings in postings for key in term_postings],
+        "span_offsets": span_offsets,
+        "span_starts": span_starts,
+        "span_ends": span_ends,
+        "terms": np.frombuffer("\n".join(vocabulary.terms).encode("utf-8"), dtype=np.uint8),
+    }
+
+    return PositionalIndex(
+        {"key": key},
+        {
+            name: np.asarray(arrays[name], dtype=dtype)
+            for name, dtype in POSITION_SECTIONS.items()
+        },
+    )
+
+
+def _term_keys(positions, tokens):
+    term_ids = [positions.vocabulary.get(token) for token in tokens]
+    if not tokens or None in term_ids:
+        return None
+    return [positions.occurrences(term_id) for term_id in term_ids]
+
+
+def _matches(positions, keys, first, last):
+    docs = keys >> POSITION_BITS
+    first = first & ((1 << POSITION_BITS) - 1)
+    last = last & ((1 << POSITION_BITS) - 1)
+    return [
+        (int(doc), *positions.span(doc, int(start), int(end)))
+        for doc, start, end in zip(docs, first, last)
+    ]
+
+
+def _contains(keys, wanted):
+    # keys are sorted, and there are usually far fewer wanted keys than keys
+    found = np.searchsorted(keys, wanted)
+    return keys[np.minimum(found, len(keys) - 1)] == wanted
+
+
+def find_phrase(positions, tokens):
+    """(doc, start, end) character spans of every occurrence of the words in order"""
+
+    term_keys = _term_keys(positions, tokens)
+    if term_keys is None:
+        return []
+
+    # start from the rarest word, then keep the starts that every other word
+    # follows at the right distance
+    anchor = min(range(len(tokens)), key=lambda i: len(term_keys[i]))
+    starts = term_keys[anchor] - anchor
+    for offset, keys in enumerate(term_keys):
+        if offset != anchor:
+            starts = starts[_contains(keys, starts + offset)]
+
+    return _matches(positions, starts, starts, starts + len(tokens) - 1)
+
+
+def find_near(positions, tokens, window):
+    """(doc, start, end) spans where all the words occur, in any order, within
+    window words of the rarest one"""
+
+    term_keys = _term_keys(positions, tokens)
+    if term_keys is None:
+        return []
+
+    anchor = min(range(len(tokens)), key=lambda i: len(term_keys[i]))
+    anchors = term_keys[anchor]
+    first = anchors.copy()
+    last = anchors.copy()
+    found = np.ones(len(anchors), dtype=bool)
+
+    for keys in term_keys:
+        # the nearest occurrence at or after anchor - window, in the same document
+        # as long as it is within anchor + window
+        nearest = np.searchsorted(keys, anchors - window)
+        nearest_keys = keys[np.minimum(nearest, len(keys) - 1)]
+        found &= (nearest < len(keys)) & (nearest_keys <= anchors + window)
+        first = np.minimum(first, nearest_keys)
+        last = np.maximum(last, nearest_keys)
+
+    # a window never crosses documents: positions are far below 1 << POSITION_BITS
+    return _matches(positions, anchors[found], first[found], last[found])
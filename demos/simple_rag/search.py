@@ -1,91 +1,467 @@
+import hashlib
+import json
 import os
-import string
+from functools import lru_cache
 
-from nltk import word_tokenize
-from nltk.corpus import stopwords
+import numpy as np
 
-from rank_bm25 import BM25Okapi
+from demos.simple_rag import ingest, positions, tokenizer
+from demos.simple_rag.index import FORMAT_VERSION, build_index, load_index, write_index
+from demos.simple_rag.segments import SegmentedIndex, Snapshot
 
 FILENAME = "alice_in_wonderland.txt"
-START = "*** START OF THE PROJECT GUTENBERG EBOOK ALICE'S ADVENTURES IN WONDERLAND ***"
-END = "*** END OF THE PROJECT GUTENBERG EBOOK ALICE'S ADVENTURES IN WONDERLAND ***"
-START_CHAPTERS = "CHAPTER "
-MIN_PARAGRAPH_LENGTH = 180
-DIALOGUE_MARKERS = ["“", "”", '"']
-PARAGRAPH_SEPARATOR = "\n\n"
+BOOK_PATH = os.path.join(os.path.dirname(__file__), FILENAME)
+INDEX_DIR = os.path.join(os.path.dirname(__file__), ".index")
+SEGMENTS_DIR = os.path.join(INDEX_DIR, "segments")
+BM25_PARAMETERS = {"k1": 1.5, "b": 0.75, "epsilon": 0.25}
+MAX_BATCH_CELLS = 1 << 22
+PRUNING_SLACK = 1e-9  # relative tolerance on score bounds, so rounding never prunes a tie
+MAXSCORE_BLOCK_SIZE = 64  # candidates rescored in the first block, doubling after that
+# stop reading postings once the terms left could add less than this fraction of the
+# n-th best score; must be <= 1, lower reads more postings but leaves fewer candidates
+MAXSCORE_MARGIN = 0.25
 
+# excerpts are searched as one query; with FUSION set to one of FUSIONS, they
+# are searched one by one and their rankings fused into one top n instead, which
+# ranked them worse and took twice as long (benchmarks/excerpt_fusion.py)
+FUSION = None
+FUSION_DEPTH = 20  # results taken from each excerpt's ranking
+RRF_K = 60
 
-def digest_book():
-    path = os.path.join(os.path.dirname(__file__), FILENAME)
+# "fast" gives the same tokens as nltk's word_tokenize on the book, several times faster
+TOKENIZER_MODE = "fast"
+LANGUAGE = "english"
+QUERY_CACHE_SIZE = 1024  # queries whose tokens are cached; 0 disables the cache
+PROXIMITY_WINDOW = 10  # words either side of the rarest one, for find_near
 
-    with open(path) as f:
-        book = f.read()
 
-    # remove Project Gutenberg header and footer
-    start = book.find(START)
-    end = book.find(END)
+def settings_key():
+    # everything besides the source texts that changes what an index contains
+    settings = {
+        "format": FORMAT_VERSION,
+        "tokenizer": tokenizer.tokenizer_settings(TOKENIZER_MODE, LANGUAGE),
+        "paragraphs": ingest.paragraph_settings(),
+        "bm25": BM25_PARAMETERS,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
 
-    book = book[start + len(START) : end].strip()
 
-    preface_and_toc, chapters_text = book.split(START_CHAPTERS, 1)
+def index_key(paths):
+    # the index is only valid for the exact source texts and settings it was built with
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(os.path.abspath(path).encode("utf-8"))
+            digest.update(hashlib.file_digest(f, "sha256").digest())
 
-    # split the book into chapters, preserving the chapter titles
-    chapters = [
-        (START_CHAPTERS + chapter).strip()
-        for chapter in chapters_text.split(START_CHAPTERS)
-    ]
+    digest.update(settings_key().encode("utf-8"))
 
-    # split each chapter into paragraphs
-    all_paragraphs = [chapter.split(PARAGRAPH_SEPARATOR) for chapter in chapters]
+    return digest.hexdigest()
 
-    processed_chapters = []
 
-    # recombine short paragraphs into longer ones
-    for chapter in all_paragraphs:
-        processed_chapter = []
-        current_paragraph = ""
-        for paragraph in chapter:
-            # if the paragraph is too short or starts with a dialogue marker, add it to the previous paragraph
-            if (
-                len(paragraph) < MIN_PARAGRAPH_LENGTH
-                or paragraph[0] in DIALOGUE_MARKERS
-            ):
-                current_paragraph += PARAGRAPH_SEPARATOR + paragraph
-            else:
-                if current_paragraph:
-                    processed_chapter.append(current_paragraph)
-                current_paragraph = paragraph
-        processed_chapter.append(current_paragraph)
-        processed_chapters.append(processed_chapter)
+def digest_books(paths, index_path, processes=1, with_positions=False):
+    """Load the combined index of the books at paths, building it first if needed"""
 
-    corpus = [paragraph for chapter in processed_chapters for paragraph in chapter]
+    key = index_key(paths)
 
-    # chapter mapping, each index of the corpus corresponds to a chapter
-    corpus_mapping = [
-        (chapter_index, paragraph_index)
-        for chapter_index, chapter in enumerate(processed_chapters)
-        for paragraph_index, _paragraph in enumerate(chapter)
-    ]
+    index = load_index(index_path, key)
+    if index is None:
+        index = build_index(key, paths, read_books(paths, processes), **BM25_PARAMETERS)
+        write_index(index_path, index)
+        index = load_index(index_path, key)
 
-    tokenized_corpus = [tokenize(doc) for doc in corpus]
+    if with_positions:
+        index.positions = digest_positions(index)
 
-    bm25 = BM25Okapi(tokenized_corpus)
+    return index
 
-    return bm25, processed_chapters, corpus_mapping
+
+def digest_positions(index):
+    # the positional index is stored next to the BM25 index and rebuilt with it
+    key = f"{index.key}:positions:{positions.POSITIONS_VERSION}"
+    path = index.path + ".positions"
+
+    positional_index = load_index(path, key, positions.PositionalIndex)
+    if positional_index is None:
+        texts = (index.paragraph(doc) for doc in range(index.num_docs))
+        write_index(path, positions.build_positions(key, texts), positions.POSITION_SECTIONS)
+        positional_index = load_index(path, key, positions.PositionalIndex)
+
+    return positional_index
+
+
+def digest_directory(directory, processes=1, with_positions=False):
+    # one index for every .txt book in the directory
+    index_path = os.path.join(INDEX_DIR, os.path.basename(os.path.abspath(directory)) + ".bm25")
+    return digest_books(ingest.book_paths(directory), index_path, processes, with_positions)
+
+
+def digest_book(processes=1, with_positions=False):
+    index_path = os.path.join(INDEX_DIR, FILENAME + ".bm25")
+    return digest_books([BOOK_PATH], index_path, processes, with_positions)
+
+
+def open_segments(directory=SEGMENTS_DIR, merge_in_background=True):
+    """Open (or create) an incrementally updated index; search its snapshot()"""
+
+    segments = SegmentedIndex(directory, settings_key(), **BM25_PARAMETERS)
+    if merge_in_background:
+        segments.start_merging()
+    return segments
+
+
+def add_books(segments, paths, processes=1):
+    # only the new books are read and tokenized, into a segment of their own
+    return segments.add(paths, read_books(paths, processes))
+
+
+def remove_books(segments, paths):
+    # to update a book that changed, remove it and add it again
+    return segments.remove_sources(paths)
+
+
+def read_books(paths, processes=1):
+    """Stream (Paragraph, tokens) pairs for every paragraph of the books"""
+
+    return ingest.ingest(paths, TOKENIZER_MODE, LANGUAGE, processes=processes)
 
 
 def tokenize(text):
-    stop = set(stopwords.words("english") + list(string.punctuation))
-    return [token for token in word_tokenize(text.lower()) if token not in stop]
+    return tokenizer.tokenize(text, TOKENIZER_MODE, LANGUAGE)
+
+
+def tokenize_query(query):
+    # queries repeat (reformulations, re-asked questions), so their tokens are
+    # cached, by the tokenizer settings too; the settings are read at every call
+    if QUERY_CACHE_SIZE <= 0:
+        return tuple(tokenize(query))
+    return _query_cache(QUERY_CACHE_SIZE)(query, TOKENIZER_MODE, LANGUAGE)
+
+
+@lru_cache(maxsize=1)
+def _query_cache(size):
+    # a new cache when QUERY_CACHE_SIZE changes
+    @lru_cache(maxsize=size)
+    def tokenize_cached(query, mode, language):
+        return tuple(tokenizer.tokenize(query, mode, language))
+
+    return tokenize_cached
+
+
+def query_terms(index, tokenized_query):
+    # the distinct query terms that are in the index, and how often each occurs
+    term_ids, counts = np.unique(
+        index.vocabulary.encode(tokenized_query), return_counts=True
+    )
+    return term_ids, counts.astype(np.float64)
+
+
+def gather_postings(index, term_ids):
+    """Positions of every posting of every term, and which term each belongs to"""
+
+    starts = index.postings_offsets[term_ids]
+    lengths = index.postings_offsets[term_ids + 1] - starts
+
+    # concatenate the postings ranges without a Python loop over the terms
+    owners = np.repeat(np.arange(len(term_ids)), lengths)
+    positions = np.arange(lengths.sum()) + np.repeat(
+        starts - (np.cumsum(lengths) - lengths), lengths
+    )
+    return positions, owners
+
+
+def get_scores(index, tokenized_query):
+    return get_batch_scores(index, [tokenized_query])[0]
+
+
+def get_batch_scores(index, tokenized_queries):
+    if isinstance(index, Snapshot):
+        return get_snapshot_scores(index, tokenized_queries)
+
+    # BM25Okapi scores, accumulated only over the postings of the query terms:
+    # each posting contributes idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)),
+    # once for every time its term appears in the query.
+    # The whole (queries x documents) matrix is computed in a single bincount.
+
+    batch = [query_terms(index, tokenized_query) for tokenized_query in tokenized_queries]
+    return score_terms(index, batch)
+
+
+def score_terms(index, batch):
+    # batch holds the (term ids, frequencies) of each query, as from query_terms;
+    # each document's contributions are summed in the order the terms are given
+    term_ids = np.concatenate([terms for terms, _ in batch] + [np.zeros(0, np.int64)])
+    frequencies = np.concatenate([counts for _, counts in batch] + [np.zeros(0)])
+    query_ids = np.repeat(np.arange(len(batch)), [len(terms) for terms, _ in batch])
+
+    positions, owners = gather_postings(index, term_ids)
+
+    docs = index.postings_docs[positions]
+    tfs = index.postings_tfs[positions]
+
+    weights = frequencies[owners] * index.impacts(term_ids[owners], docs, tfs)
+
+    # each (query, document) pair gets its own bin in the flattened matrix
+    cells = query_ids[owners] * index.num_docs + docs
+    scores = np.bincount(
+        cells, weights=weights, minlength=len(batch) * index.num_docs
+    )
+    return scores.reshape(len(batch), index.num_docs)
+
+
+def get_snapshot_scores(snapshot, tokenized_queries):
+    # each segment scores its own documents with the statistics of the whole
+    # snapshot, and removed documents are ruled out of every top n. Terms are
+    # summed in the order of the snapshot's term ids, in every segment, so the
+    # scores are the same as those of one index built from all the documents
+    batch = [query_terms(snapshot, tokenized_query) for tokenized_query in tokenized_queries]
+
+    scores = [np.zeros((len(tokenized_queries), 0))]
+    for segment, local_ids in zip(snapshot.segments, snapshot.local_ids):
+        segment_batch = []
+        for term_ids, frequencies in batch:
+            term_ids = np.where(
+                term_ids < len(local_ids),
+                local_ids[np.minimum(term_ids, len(local_ids) - 1)],
+                -1,
+            )
+            segment_batch.append((term_ids[term_ids >= 0], frequencies[term_ids >= 0]))
+        scores.append(score_terms(segment, segment_batch))
+
+    scores = np.concatenate(scores, axis=1)
+    scores[:, snapshot.tombstones] = -np.inf
+    return scores
+
+
+def top_n(scores, n, min_score):
+    """The best n (index, score) pairs of each row, best first, above min_score"""
+
+    if n <= 0:
+        return [[] for _ in scores]
+
+    results = []
+    for row in scores:
+        # partial selection: only the documents that can make the top n are sorted,
+        # including every document that ties with the n-th best
+        if n < len(row):
+            nth_best = row[np.argpartition(-row, n - 1)[n - 1]]
+            candidates = np.flatnonzero(row >= nth_best)
+        else:
+            candidates = np.arange(len(row))
+        results.append(_ranked(row, candidates, n, min_score))
+    return results
+
+
+def _ranked(scores, candidates, n, min_score):
+    # highest score first, ties broken by document order, like a stable sort
+    candidates = candidates[scores[candidates] > min_score]
+    ranked = candidates[np.lexsort((candidates, -scores[candidates]))][:n]
+    return [(int(doc), float(scores[doc])) for doc in ranked]
+
+
+def search_many(index, queries, n=5, min_score=0.75):
+    tokenized_queries = [tokenize_query(query) for query in queries]
+
+    results = []
+    # bound the size of each score matrix, however many queries there are
+    batch_size = max(1, MAX_BATCH_CELLS // max(index.num_docs, 1))
+    for start in range(0, len(tokenized_queries), batch_size):
+        scores = get_batch_scores(index, tokenized_queries[start : start + batch_size])
+        results.extend(top_n(scores, n, min_score))
+
+    return results
+
+
+def _may_qualify(upper_bounds, threshold, min_score):
+    # a document is kept while its best possible score could still reach the top n;
+    # the slack keeps rounding differences from pruning a document that ties
+    upper_bounds = upper_bounds * (1 + PRUNING_SLACK)
+    return (upper_bounds >= threshold) & (upper_bounds > min_score)
+
+
+def exact_scores(index, docs, term_ids, frequencies):
+    # the scores of just the given documents, read from the forward index; each
+    # document's terms are summed in term id order, like get_batch_scores, so the
+    # scores are bit-for-bit those of exhaustive search. term_ids must be sorted.
+    owners, doc_terms, tfs = index.forward(docs)
+
+    positions = np.minimum(np.searchsorted(term_ids, doc_terms), len(term_ids) - 1)
+    matched = term_ids[positions] == doc_terms
+
+    weights = frequencies[positions[matched]] * index.impacts(
+        doc_terms[matched], docs[owners[matched]], tfs[matched]
+    )
+    return np.bincount(owners[matched], weights=weights, minlength=len(docs))
+
+
+def _scored_once(scored_docs, scored):
+    # every document scored so far, once, with its exact score; the best
+    # documents of each chunk are scored again by later chunks and blocks
+    docs, unique = np.unique(np.concatenate(scored_docs), return_index=True)
+    return docs, np.concatenate(scored)[unique]
+
+
+def search_maxscore(index, tokenized_query, n=5, min_score=0.75):
+    """The same top n as exhaustive BM25, skipping postings that cannot change it
+
+    MaxScore: the index stores the highest score each term can contribute to any
+    document. Terms are scored from the highest bound down, in chunks of doubling
+    size, until the bounds of the terms left over add up to less than a fraction
+    (MAXSCORE_MARGIN) of the n-th best score found so far. A document none of the
+    scored terms occur in can then not make the top n, so the postings of the
+    remaining terms are never read.
+    The candidates are scored exactly from the forward index, best bound first,
+    stopping as soon as no remaining candidate can reach the top n.
+    """
+
+    term_ids, frequencies = query_terms(index, tokenized_query)
+    upper_bounds = index.max_impacts[term_ids] * frequencies
+
+    # the bounds only hold while every contribution is positive, and documents that
+    # match no term only count when min_score lets a score of 0 through
+    if n <= 0 or min_score < 0 or (upper_bounds <= 0).any():
+        return top_n(get_scores(index, tokenized_query)[None], n, min_score)[0]
+
+    # rare terms with high bounds first: they carry the most score per posting,
+    # and the long postings of common terms are the ones worth skipping
+    lengths = index.postings_offsets[term_ids + 1] - index.postings_offsets[term_ids]
+    order = np.argsort(-upper_bounds / lengths, kind="stable")
+    # remaining[i] is the most that the terms after the first i can add
+    remaining = np.append(np.cumsum(upper_bounds[order][::-1])[::-1], 0.0)
+
+    partial_scores = np.zeros(index.num_docs)
+    scored_docs = [np.zeros(0, dtype=np.int64)]
+    scored = [np.zeros(0)]
+    threshold = -np.inf
+
+    essential = 0
+    while essential < len(order) and _may_qualify(
+        remaining[essential] / MAXSCORE_MARGIN, threshold, min_score
+    ):
+        chunk = order[essential : 2 * essential + 1]
+        positions, owners = gather_postings(index, term_ids[chunk])
+        docs = index.postings_docs[positions]
+        weights = frequencies[chunk][owners] * index.impacts(
+            term_ids[chunk][owners], docs, index.postings_tfs[positions]
+        )
+        partial_scores += np.bincount(docs, weights=weights, minlength=index.num_docs)
+        essential += len(chunk)
+
+        # the exact scores of the best documents so far give a threshold the final
+        # n-th best score cannot be below
+        best = np.argpartition(-partial_scores, n - 1)[:n] if n < index.num_docs else None
+        if best is not None:
+            scored_docs.append(best)
+            scored.append(exact_scores(index, best, term_ids, frequencies))
+            threshold = max(threshold, np.partition(scored[-1], 0)[0])
+
+    upper_bounds = partial_scores + remaining[essential]
+    candidates = np.flatnonzero(
+        (partial_scores > 0) & _may_qualify(upper_bounds, threshold, min_score)
+    )
+    candidates = candidates[np.argsort(-upper_bounds[candidates], kind="stable")]
+
+    # score the candidates best bound first, in blocks of doubling size, raising
+    # the threshold as better documents are found, until no remaining candidate
+    # can reach the top n
+    start, block_size = 0, MAXSCORE_BLOCK_SIZE
+    while start < len(candidates):
+        block = candidates[start : start + block_size]
+        block = block[_may_qualify(upper_bounds[block], threshold, min_score)]
+        if not len(block):
+            break
+        start += block_size
+        block_size *= 2
+
+        scored_docs.append(block)
+        scored.append(exact_scores(index, block, term_ids, frequencies))
+
+        # the n-th best of distinct documents: a duplicate would raise it too far
+        _docs, all_scores = _scored_once(scored_docs, scored)
+        if len(all_scores) >= n:
+            threshold = max(threshold, np.partition(all_scores, -n)[-n])
+
+    docs, doc_scores = _scored_once(scored_docs, scored)
+    scores = np.zeros(index.num_docs)
+    scores[docs] = doc_scores
+
+    return _ranked(scores, docs, n, min_score)
+
+
+def search(index, query, n=5, min_score=0.75, pruning=False):
+    # MaxScore pruning is opt-in: on the book, even 64 copies of it, it gives the
+    # same results as scoring every document, only slower (benchmarks/maxscore.py)
+    # a snapshot's segments have no term bounds for the corpus-wide statistics
+    if pruning and not isinstance(index, Snapshot):
+        return search_maxscore(index, tokenize_query(query), n=n, min_score=min_score)
+    return search_many(index, [query], n=n, min_score=min_score)[0]
+
+
+def fuse_rrf(rankings, k=RRF_K):
+    # reciprocal-rank fusion: a document gets 1 / (k + rank) from every ranking it
+    # is in, so agreement between excerpts counts for more than one high score
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc, _score) in enumerate(ranking, start=1):
+            fused[doc] = fused.get(doc, 0.0) + 1 / (k + rank)
+    return fused
+
+
+def _scaled(ranking):
+    # scores over the ranking's best, which is 0 when min_score lets 0 through
+    best = ranking[0][1] if ranking else 0.0
+    return [(doc, score / best if best > 0 else 0.0) for doc, score in ranking]
+
+
+def fuse_sum(rankings):
+    # CombSUM over scores scaled by each ranking's best, so long excerpts with
+    # higher raw BM25 scores do not drown out short ones
+    fused = {}
+    for ranking in rankings:
+        for doc, score in _scaled(ranking):
+            fused[doc] = fused.get(doc, 0.0) + score
+    return fused
+
+
+def fuse_max(rankings):
+    # CombMAX: a document is as good as its best match to any one excerpt
+    fused = {}
+    for ranking in rankings:
+        for doc, score in _scaled(ranking):
+            fused[doc] = max(fused.get(doc, 0.0), score)
+    return fused
+
+
+FUSIONS = {"rrf": fuse_rrf, "sum": fuse_sum, "max": fuse_max}
+
+
+def search_excerpts(index, excerpts, n=5, min_score=0.75, fusion=FUSION, depth=FUSION_DEPTH):
+    """The top n (index, score) pairs for the excerpts joined into one query, or
+    with fusion, for each excerpt as its own query, in one batched pass, fused
+    into a single ranking"""
+
+    if fusion is None:
+        return search_many(index, ["\n".join(excerpts)], n=n, min_score=min_score)[0]
+
+    rankings = search_many(index, excerpts, n=max(n, depth), min_score=min_score)
+    fused = FUSIONS[fusion](rankings)
+
+    # highest fused score first, ties broken by document order
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def _words(text):
+    return [token for token, _start, _end in tokenizer.token_spans(text)]
+
+
+def find_quote(index, quote):
+    """(doc, start, end) of every place the quote occurs word for word, ignoring case
+    and punctuation; start and end are character offsets in index.paragraph(doc)"""
+
+    return positions.find_phrase(index.positions, _words(quote))
 
 
-def search(bm25, query, n=5, min_score=0.75):
-    tokenized_query = tokenize(query)
-    doc_scores = bm25.get_scores(tokenized_query)
-    top_n_indices = sorted(
-        range(len(doc_scores)), key=lambda i: doc_scores[i], reverse=True
-    )[:n]
+def find_near(index, text, window=PROXIMITY_WINDOW):
+    """(doc, start, end) of every place where all the words of text occur close together"""
 
-    return [
-        (i, doc_scores[i]) for i in top_n_indices if doc_scores[i] > min_score
-    ]  # filter out low scoring results
+    return positions.find_near(index.positions, _words(text), window)
@@ -0,0 +1,446 @@
+import itertools
+import json
+import os
+import threading
+
+import numpy as np
+
+from demos.simple_rag.index import (
+    build_index,
+    inverse_document_frequencies,
+    load_index,
+    write_index,
+)
+from demos.simple_rag.tokenizer import Vocabulary
+
+# Incrementally updated BM25 index, made of immutable segments (log-structured merge)
+#
+# Each batch of new paragraphs is indexed into a new segment file, and nothing that
+# is already on disk is rebuilt. Removed paragraphs are marked in a per-segment
+# tombstone bitmap. A background thread merges runs of small segments, and
+# segments that are mostly tombstones, into one new segment without the removed
+# paragraphs.
+#
+# Scores use the statistics of every live paragraph across all segments (count,
+# average length, document frequencies), which are kept up to date as paragraphs
+# are added and removed, so they match an index rebuilt from the same paragraphs.
+#
+# Directory layout:
+#   manifest.json                      settings and the segment names, in order
+#   segment-000000.bm25                a segment, in the format of index.py
+#   segment-000000.tombstones          its removed documents, one bit each
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+MAX_SEGMENTS = 8  # more than this and the smallest adjacent run is merged
+MERGE_FACTOR = 4  # segments merged at a time
+MAX_REMOVED_FRACTION = 0.5  # a segment with more tombstones than this is rewritten
+
+
+class Segment:
+    def __init__(self, name, index, tombstones, term_ids):
+        self.name = name
+        self.index = index
+        # replaced, never modified in place, so snapshots keep the bitmap they saw
+        self.tombstones = tombstones
+        # this segment's term ids -> term ids across all segments, and back (-1 for
+        # terms the segment does not have)
+        self.term_ids = term_ids
+        self.local_ids = np.full(int(term_ids.max(initial=-1)) + 1, -1, dtype=np.int64)
+        self.local_ids[term_ids] = np.arange(len(term_ids))
+
+    @property
+    def live_docs(self):
+        return self.index.num_docs - int(self.tombstones.sum())
+
+
+class SegmentedIndex:
+    def __init__(self, directory, settings, k1, b, epsilon):
+        self.directory = directory
+        self.settings = settings
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        # held by whoever is merging, so at most one merge runs at a time
+        self.merge_lock = threading.Lock()
+        self.merger = None
+        self.closed = False
+
+        self.segments = []
+        self.next_segment = 0
+        self.version = 0
+        self.cached_snapshot = None
+
+        # statistics of the live documents across every segment
+        self.vocabulary = Vocabulary()
+        self.document_frequencies = np.zeros(0, dtype=np.int64)
+        self.live_docs = 0
+        self.live_length = 0
+
+        self._load()
+
+    def _path(self, name, extension):
+        return os.path.join(self.directory, name + extension)
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+
+        if manifest["version"] != MANIFEST_VERSION or manifest["settings"] != self.settings:
+            raise ValueError(
+                f"The segments in {self.directory} were built with other settings, "
+                "remove the directory to rebuild them"
+            )
+
+        self.next_segment = manifest["next_segment"]
+        for name in manifest["segments"]:
+            index = load_index(self._path(name, ".bm25"), name)
+            if index is None:
+                raise ValueError(f"Segment {name} in {self.directory} is missing or corrupt")
+
+            segment = self._add_segment(name, index)
+            tombstones = self._read_tombstones(segment)
+            self._remove_docs(segment, np.flatnonzero(tombstones))
+
+    def _new_name(self):
+        with self.lock:
+            name = f"segment-{self.next_segment:06d}"
+            self.next_segment += 1
+            return name
+
+    def _write_manifest(self):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "settings": self.settings,
+            "segments": [segment.name for segment in self.segments],
+            "next_segment": self.next_segment,
+        }
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _read_tombstones(self, segment):
+        try:
+            with open(self._path(segment.name, ".tombstones"), "rb") as f:
+                bits = np.frombuffer(f.read(), dtype=np.uint8)
+        except FileNotFoundError:
+            return np.zeros(segment.index.num_docs, dtype=bool)
+        return np.unpackbits(bits, count=segment.index.num_docs).astype(bool)
+
+    def _write_tombstones(self, segment):
+        path = self._path(segment.name, ".tombstones")
+        with open(path + ".tmp", "wb") as f:
+            f.write(np.packbits(segment.tombstones).tobytes())
+        os.replace(path + ".tmp", path)
+
+    def _term_ids(self, index):
+        term_ids = np.array(
+            [self.vocabulary.intern(term) for term in index.vocabulary.terms],
+            dtype=np.int64,
+        )
+        if len(self.vocabulary) > len(self.document_frequencies):
+            self.document_frequencies = np.concatenate(
+                [
+                    self.document_frequencies,
+                    np.zeros(
+                        len(self.vocabulary) - len(self.document_frequencies),
+                        dtype=np.int64,
+                    ),
+                ]
+            )
+        return term_ids
+
+    def _add_segment(self, name, index):
+        # a new segment's documents are all live until tombstones are applied
+        term_ids = self._term_ids(index)
+        self.document_frequencies[term_ids] += np.diff(index.postings_offsets)
+        self.live_docs += index.num_docs
+        self.live_length += int(index.doc_lengths.sum())
+
+        segment = Segment(name, index, np.zeros(index.num_docs, dtype=bool), term_ids)
+        self.segments.append(segment)
+        return segment
+
+    def _remove_docs(self, segment, docs):
+        # docs must be live; their terms no longer count towards the statistics
+        if not len(docs):
+            return
+
+        _owners, terms, _tfs = segment.index.forward(docs)
+        np.subtract.at(self.document_frequencies, segment.term_ids[terms], 1)
+        self.live_docs -= len(docs)
+        self.live_length -= int(segment.index.doc_lengths[docs].sum())
+
+        tombstones = segment.tombstones.copy()
+        tombstones[docs] = True
+        segment.tombstones = tombstones
+
+    def _changed(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    def add(self, sources, tokenized_paragraphs):
+        """Index (Paragraph, tokens) pairs from the given sources as a new segment,
+        returning its name, or None if there were no paragraphs"""
+
+        tokenized_paragraphs = iter(tokenized_paragraphs)
+        first = next(tokenized_paragraphs, None)
+        if first is None:
+            return None
+
+        name = self._new_name()
+        index = build_index(
+            name,
+            sources,
+            itertools.chain([first], tokenized_paragraphs),
+            self.k1,
+            self.b,
+            self.epsilon,
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        write_index(self._path(name, ".bm25"), index)
+        index = load_index(self._path(name, ".bm25"), name)
+
+        with self.lock:
+            self._add_segment(name, index)
+            self._write_manifest()
+            self._changed()
+
+        return name
+
+    def remove_sources(self, sources):
+        """Tombstone every live paragraph that was read from one of the sources,
+        returning how many were removed"""
+
+        sources = {os.path.abspath(source) for source in sources}
+        removed = 0
+
+        with self.lock:
+            for segment in self.segments:
+                books = [
+                    book
+                    for book, source in enumerate(segment.index.sources)
+                    if source in sources
+                ]
+                if not books:
+                    continue
+
+                docs = np.flatnonzero(
+                    np.isin(segment.index.doc_books, books) & ~segment.tombstones
+                )
+                if len(docs):
+                    self._remove_docs(segment, docs)
+                    self._write_tombstones(segment)
+                    removed += len(docs)
+
+            if removed:
+                self._changed()
+
+        return removed
+
+    def snapshot(self):
+        """The current segments, tombstones and statistics, unaffected by later changes"""
+
+        with self.lock:
+            if self.cached_snapshot is None or self.cached_snapshot.version != self.version:
+                # terms that no live document contains are not part of the corpus,
+                # just as they would not be in a rebuilt index
+                live_terms = self.document_frequencies > 0
+                idf = np.zeros(len(self.document_frequencies))
+                idf[live_terms] = inverse_document_frequencies(
+                    self.document_frequencies[live_terms], self.live_docs, self.epsilon
+                )
+                avgdl = self.live_length / self.live_docs if self.live_docs else 1.0
+
+                self.cached_snapshot = Snapshot(
+                    self.version,
+                    list(self.segments),
+                    self.vocabulary,
+                    idf,
+                    avgdl,
+                    self.live_docs,
+                )
+            return self.cached_snapshot
+
+    def _merge_plan(self):
+        # segments that are mostly tombstones are rewritten on their own
+        for segment in self.segments:
+            if segment.live_docs < (1 - MAX_REMOVED_FRACTION) * segment.index.num_docs:
+                return [segment]
+
+        # otherwise, with too many segments, the adjacent run with the fewest live
+        # documents is merged; merging adjacent segments keeps documents in order
+        if len(self.segments) <= MAX_SEGMENTS:
+            return None
+
+        start = min(
+            range(len(self.segments) - MERGE_FACTOR + 1),
+            key=lambda start: sum(
+                segment.live_docs for segment in self.segments[start : start + MERGE_FACTOR]
+            ),
+        )
+        return self.segments[start : start + MERGE_FACTOR]
+
+    def merge(self, segments=None):
+        """Merge adjacent segments into one, dropping their tombstoned documents;
+        all of them by default"""
+
+        with self.merge_lock:
+            with self.lock:
+                segments = list(self.segments if segments is None else segments)
+                if not segments:
+                    return
+                tombstones = [segment.tombstones for segment in segments]
+                name = self._new_name()
+
+            # the live documents as of now; removals during the merge are carried over
+            sources = []
+            for segment in segments:
+                sources.extend(
+                    source for source in segment.index.sources if source not in sources
+                )
+
+            if sum(int((~removed).sum()) for removed in tombstones):
+                index = build_index(
+                    name,
+                    sources,
+                    _live_paragraphs(segments, tombstones, sources),
+                    self.k1,
+                    self.b,
+                    self.epsilon,
+                )
+                write_index(self._path(name, ".bm25"), index)
+                index = load_index(self._path(name, ".bm25"), name)
+            else:
+                index = None
+
+            with self.lock:
+                position = self.segments.index(segments[0])
+                merged = []
+                if index is not None:
+                    # the statistics already count these documents, and already
+                    # exclude the ones removed since the merge started, which are
+                    # tombstoned in the merged segment too
+                    merged_tombstones = np.concatenate(
+                        [
+                            segment.tombstones[~removed]
+                            for segment, removed in zip(segments, tombstones)
+                        ]
+                    )
+                    merged = [
+                        Segment(name, index, merged_tombstones, self._term_ids(index))
+                    ]
+                    if merged_tombstones.any():
+                        self._write_tombstones(merged[0])
+
+                self.segments[position : position + len(segments)] = merged
+                self._write_manifest()
+                self._changed()
+
+            # open snapshots keep their memory maps of the old files
+            for segment in segments:
+                for extension in [".bm25", ".tombstones"]:
+                    try:
+                        os.remove(self._path(segment.name, extension))
+                    except FileNotFoundError:
+                        pass
+
+    def _merge_loop(self):
+        while True:
+            with self.lock:
+                plan = self._merge_plan()
+                while plan is None and not self.closed:
+                    self.changed.wait()
+                    plan = self._merge_plan()
+                if self.closed:
+                    return
+            self.merge(plan)
+
+    def start_merging(self):
+        """Merge segments in a background thread whenever the merge policy asks for it"""
+
+        self.merger = threading.Thread(
+            target=self._merge_loop, name="segment-merger", daemon=True
+        )
+        self.merger.start()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.changed.notify_all()
+        if self.merger is not None:
+            self.merger.join()
+
+
+def _live_paragraphs(segments, tombstones, sources):
+    # a merged segment is built from the forward index of each document: BM25 only
+    # needs each term's frequency, not the order of the tokens
+    for segment, removed in zip(segments, tombstones):
+        index = segment.index
+        books = [sources.index(source) for source in index.sources]
+
+        live = np.flatnonzero(~removed)
+        owners, terms, tfs = index.forward(live)
+        ends = np.cumsum(np.bincount(owners, minlength=len(live))).tolist()
+        terms = terms.tolist()
+        tfs = tfs.tolist()
+
+        start = 0
+        for doc, end in zip(live.tolist(), ends):
+            tokens = [
+                index.vocabulary.terms[term]
+                for term, tf in zip(terms[start:end], tfs[start:end])
+                for _ in range(tf)
+            ]
+            start = end
+            record = index.record(doc)
+            yield record._replace(book=books[record.book]), tokens
+
+
+class Snapshot:
+    """A read-only view of a SegmentedIndex at one point in time
+
+    Document ids run through the segments in order. A removed document keeps its
+    id, but never scores, until a merge drops it; ids are only meaningful within
+    the snapshot they came from.
+    """
+
+    def __init__(self, version, segments, vocabulary, idf, avgdl, live_docs):
+        self.version = version
+        self.live_docs = live_docs
+        # terms added to the vocabulary after the snapshot have ids past every
+        # segment's local_ids, so they match nothing
+        self.vocabulary = vocabulary
+        self.local_ids = [segment.local_ids for segment in segments]
+        self.segments = [
+            segment.index.with_statistics(idf[segment.term_ids], avgdl)
+            for segment in segments
+        ]
+        self.tombstones = np.concatenate(
+            [segment.tombstones for segment in segments] + [np.zeros(0, dtype=bool)]
+        )
+        self.offsets = np.cumsum([0] + [index.num_docs for index in self.segments])
+        self.num_docs = int(self.offsets[-1])
+
+    def _locate(self, doc):
+        segment = int(np.searchsorted(self.offsets, doc, side="right")) - 1
+        return self.segments[segment], doc - int(self.offsets[segment])
+
+    def location(self, doc):
+        index, doc = self._locate(doc)
+        return index.location(doc)
+
+    def source(self, doc):
+        index, doc = self._locate(doc)
+        return index.source(doc)
+
+    def paragraph(self, doc):
+        index, doc = self._locate(doc)
+        return index.paragraph(doc)
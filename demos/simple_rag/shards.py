@@ -0,0 +1,149 @@
+import heapq
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from demos.simple_rag.index import SECTIONS, BM25Index, load_index, write_index
+from demos.simple_rag.search import search_many
+
+# Search an index split into shards of consecutive documents, one worker process
+# per shard
+#
+# Each shard is written once as an index file of its own and memory-mapped by its
+# worker, so postings are shared through the page cache instead of being pickled.
+# Shards keep the whole index's idf and average document length, so a document
+# scores the same in its shard as in the whole index, and the global top n is
+# the best n of the shards' own top n.
+
+
+def shard_bounds(num_docs, num_shards):
+    return np.linspace(0, num_docs, num_shards + 1).astype(np.int64)
+
+
+def shard_index(index, start, end):
+    """The documents start..end of index, renumbered from 0, scored with the
+    statistics of the whole index"""
+
+    # postings are in document order within each term, so a shard keeps a
+    # contiguous part of every term's postings
+    in_shard = (index.postings_docs >= start) & (index.postings_docs < end)
+    counts = np.concatenate([[0], np.cumsum(in_shard)])
+    postings_offsets = counts[index.postings_offsets]
+
+    forward_start = index.forward_offsets[start]
+    forward_end = index.forward_offsets[end]
+
+    arrays = {
+        "idf": index.idf,
+        # the whole index's bounds still hold for any part of it
+        "max_impacts": index.max_impacts,
+        "postings_offsets": postings_offsets,
+        "postings_docs": index.postings_docs[in_shard] - start,
+        "postings_tfs": index.postings_tfs[in_shard],
+        "forward_offsets": index.forward_offsets[start : end + 1] - forward_start,
+        "forward_terms": index.forward_terms[forward_start:forward_end],
+        "forward_tfs": index.forward_tfs[forward_start:forward_end],
+        "doc_lengths": index.doc_lengths[start:end],
+        "doc_books": index.doc_books[start:end],
+        "paragraph_offsets": index.paragraph_offsets[start:end],
+        "paragraph_lengths": index.paragraph_lengths[start:end],
+        "corpus_mapping": index.corpus_mapping[2 * start : 2 * end],
+        "terms": index.terms,
+    }
+
+    header = dict(
+        index.header,
+        key=shard_key(index, start, end),
+        num_docs=int(end - start),
+    )
+
+    return BM25Index(
+        header,
+        {name: np.asarray(arrays[name], dtype=dtype) for name, dtype in SECTIONS.items()},
+    )
+
+
+def shard_key(index, start, end):
+    return f"{index.key}:{start}-{end}"
+
+
+def shard_path(index, start, end):
+    return f"{index.path}.{start}-{end}"
+
+
+def write_shards(index, num_shards):
+    """Write the shard files of an index loaded from disk, unless they are up to date,
+    returning the (start, end, path, key) of each shard"""
+
+    if index.path is None:
+        raise ValueError("Only an index loaded from disk can be sharded")
+
+    shards = []
+    for start, end in itertools.pairwise(shard_bounds(index.num_docs, num_shards).tolist()):
+        path = shard_path(index, start, end)
+        key = shard_key(index, start, end)
+        if load_index(path, key) is None:
+            write_index(path, shard_index(index, start, end))
+        shards.append((start, end, path, key))
+    return shards
+
+
+# the shard each worker process holds
+_shard = None
+
+
+def _open_shard(path, key):
+    global _shard
+    _shard = load_index(path, key)
+
+
+def _search_shard(queries, n, min_score):
+    return search_many(_shard, queries, n=n, min_score=min_score)
+
+
+class ShardedSearch:
+    """search_many over the shards of an index, each in its own process
+
+    Use as a context manager, or call close() to stop the workers.
+    """
+
+    def __init__(self, index, num_shards):
+        self.shards = write_shards(index, num_shards)
+
+        # one single-process pool per shard, so each worker only ever maps its shard
+        self.pools = [
+            ProcessPoolExecutor(1, initializer=_open_shard, initargs=(path, key))
+            for _start, _end, path, key in self.shards
+        ]
+
+    def search_many(self, queries, n=5, min_score=0.75):
+        queries = list(queries)
+        futures = [pool.submit(_search_shard, queries, n, min_score) for pool in self.pools]
+
+        shard_results = []
+        for (start, _end, _path, _key), future in zip(self.shards, futures):
+            shard_results.append(
+                [[(start + doc, score) for doc, score in ranking] for ranking in future.result()]
+            )
+
+        # each shard's ranking is already best first, ties in document order
+        return [
+            list(
+                itertools.islice(
+                    heapq.merge(*rankings, key=lambda result: (-result[1], result[0])),
+                    max(n, 0),
+                )
+            )
+            for rankings in zip(*shard_results)
+        ]
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,164 @@
+import re
+import string
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache, partial
+
+import numpy as np
+
+# Tokenization shared by ingestion and queries
+#
+# Two modes produce the same tokens on the book:
+#   "nltk" - nltk's word_tokenize (sentence splitting with punkt, then ~20 regexes per sentence)
+#   "fast" - the same splitting rules, applied to the whole text with a few regexes
+#
+# Text is lower-cased and stopwords/punctuation are dropped in both modes.
+
+# word_tokenize pads these with spaces: quotes, dashes, brackets and most punctuation
+# always, ellipses, double hyphens, and commas/colons that are not inside numbers
+SEPARATOR_CHARACTERS = str.maketrans(
+    {character: f" {character} " for character in "“”‘’«»„‒–—―;@#$%&?!*()[]{}<>`\""}
+)
+SEPARATORS_RE = re.compile(r"(\.{2,}|--|[:,](?!\d))")
+
+# a full stop is split off when it ends a sentence: whitespace (or the end of the text)
+# follows, possibly after closing quotes or brackets
+FULL_STOP_RE = re.compile(r"(?<!\S)(\S*?[^.\s])\.(?=[\])}>\"'»”’]*(?:\s|$))")
+
+# MacIntyre contractions, e.g. "cannot" -> "can not"
+CONTRACTIONS_RE = re.compile(
+    r"\b(?:(can)(not)|(gim|lem)(me)|(gon|wan)(na)|(got)(ta)|(d)('ye)|(more)('n))\b"
+)
+
+# straight apostrophes: opening single quotes, and clitics such as "don't" -> "do n't"
+APOSTROPHES_RE = re.compile(
+    r"(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)"
+    r"|(?<=[^'\s])(?:n't|'s|'m|'d|'ll|'re|'ve|')(?=\s)"
+)
+
+# quotes that people type straight, for matching quotations; one character each,
+# so character offsets are unchanged
+STRAIGHT_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+
+
+@cache
+def stopword_set(language="english"):
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words(language) + list(string.punctuation))
+
+
+def _full_stop(match):
+    word = match.group(1)
+    # punkt does not end a sentence on an initial, e.g. "chapter i."
+    if len(word) == 1 and word.isalpha():
+        return match.group(0)
+    return word + " . "
+
+
+def _join_groups(match):
+    return " " + " ".join(group for group in match.groups() if group) + " "
+
+
+def fast_word_tokenize(text):
+    text = FULL_STOP_RE.sub(_full_stop, text)
+    text = text.translate(SEPARATOR_CHARACTERS)
+    text = SEPARATORS_RE.sub(r" \1 ", text)
+    text = CONTRACTIONS_RE.sub(_join_groups, text)
+    if "'" in text:
+        text = APOSTROPHES_RE.sub(r" \g<0> ", text + " ")
+    return text.split()
+
+
+def nltk_word_tokenize(text):
+    from nltk import word_tokenize
+
+    return word_tokenize(text)
+
+
+WORD_TOKENIZERS = {"nltk": nltk_word_tokenize, "fast": fast_word_tokenize}
+
+
+def tokenize(text, mode="fast", language="english"):
+    stop = stopword_set(language)
+    return [
+        token for token in WORD_TOKENIZERS[mode](text.lower()) if token not in stop
+    ]
+
+
+def tokenize_many(texts, mode="fast", language="english", processes=1, chunksize=32, pool=None):
+    """Tokenize texts in a process pool, returning the results in input order
+
+    A caller tokenizing many batches passes its own pool, so the worker
+    processes are started once rather than for every batch"""
+
+    tokenize_text = partial(tokenize, mode=mode, language=language)
+
+    if (pool is None and processes == 1) or len(texts) <= chunksize:
+        return [tokenize_text(text) for text in texts]
+
+    if pool is not None:
+        return list(pool.map(tokenize_text, texts, chunksize=chunksize))
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(tokenize_text, texts, chunksize=chunksize))
+
+
+def token_spans(text):
+    """Every word of the text with its character span, for positional lookups
+
+    Words are lower-cased and split like fast_word_tokenize, keeping stopwords;
+    punctuation and trailing full stops are dropped, and curly quotes count as
+    straight ones.
+    """
+
+    text = text.lower().translate(STRAIGHT_QUOTES)
+
+    spans = []
+    cursor = 0
+    for token in fast_word_tokenize(text):
+        # tokenizing only splits and pads the text, so each token is found in order
+        start = text.find(token, cursor)
+        if start < 0:
+            continue
+        cursor = start + len(token)
+        # a full stop stays attached when the tokenizer does not see a sentence
+        # end, e.g. before a closing quote in the middle of a paragraph
+        word = token.rstrip(".")
+        if any(character.isalnum() for character in word):
+            spans.append((word, start, start + len(word)))
+    return spans
+
+
+def tokenizer_settings(mode="fast", language="english"):
+    return {
+        "mode": mode,
+        "lowercase": True,
+        "stopwords": sorted(stopword_set(language)),
+    }
+
+
+class Vocabulary:
+    """Interning table from tokens to dense term ids, shared by ingestion and the index"""
+
+    def __init__(self, terms=()):
+        self.terms = list(terms)
+        self.ids = {term: term_id for term_id, term in enumerate(self.terms)}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def get(self, token):
+        return self.ids.get(token)
+
+    def intern(self, token):
+        term_id = self.ids.get(token)
+        if term_id is None:
+            term_id = self.ids[token] = len(self.terms)
+            self.terms.append(token)
+        return term_id
+
+    def encode(self, tokens):
+        # tokens that are not in the vocabulary are dropped
+        term_ids = (self.ids.get(token) for token in tokens)
+        return np.fromiter(
+            (term_id for term_id in term_ids if term_id is not None), dtype=np.int64
+        )
@@ -1,20 +1,41 @@
-from demos.function_planner.agent import agent as planner_agent
-from demos.effective_questioning.agent import agent as question_agent
-from demos.simple_rag.agent import agent as book_agent
-
-print("Choose a demo to run:")
-
-print("1. A Function Planner Agent")
-print("2. Help me think about a problem (Effective Questioning)")
-print("3. Ask a Question about a Book (Alice in Wonderland)")
-
-demo = input("Enter the number of the demo you would like to run: ")
-
-if demo == "1":
-    planner_agent.run()
-elif demo == "2":
-    question_agent.run()
-elif demo == "3":
-    book_agent.run()
-else:
-    print("Invalid choice. Please enter 1, 2, or 3.")
+import importlib
+
+# the module of each demo's agent, imported only once it is chosen, so starting
+# up does not wait for every demo's dependencies to load
+DEMOS = {
+    "1": ("A Function Planner Agent", "demos.function_planner.agent"),
+    "2": ("Help me think about a problem (Effective Questioning)", "demos.effective_questioning.agent"),
+    "3": ("Ask a Question about a Book (Alice in Wonderland)", "demos.simple_rag.agent"),
+}
+
+
+def main():
+    print("Choose a demo to run:")
+
+    for number, (title, _module) in DEMOS.items():
+        print(f"{number}. {title}")
+
+    demo = input("Enter the number of the demo you would like to run: ")
+
+    if demo not in DEMOS:
+        print("Invalid choice. Please enter 1, 2, or 3.")
+        return
+
+    agent = importlib.import_module(DEMOS[demo][1]).agent
+
+    # each step is saved, so a session cut short can be carried on next time
+    from agent_checkpoint import Checkpoint, FileStore
+
+    checkpoint = Checkpoint(FileStore(), f"demo-{demo}")
+    saved = checkpoint.load(agent)
+    if saved is not None and saved[0] != agent.end_action:
+        answer = input("Carry on from where the last session stopped? (y/n) ")
+        if answer.strip().lower().startswith("y"):
+            agent.resume(checkpoint)
+            return
+
+    agent.run(checkpoint=checkpoint)
+
+
+if __name__ == "__main__":
+    main()